@@ -1,17 +1,264 @@
 import os
+import json
+import math
+import time
 import logging
-from deepinfra_client import ask_deepinfra, get_model_config, DEEPINFRA_MODELS
+import threading
+import contextvars
+from collections import Counter
+from contextlib import nullcontext, contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from llm_backends import llm_backends, MODELS
+from llm_telemetry import feature, EMPTY
+import request_deadline
+from request_deadline import DeadlineExceeded
+
+# Extra attempts each page gets before a multi-page generation gives up
+PAGE_RETRIES = 2
+
+# Uploaded files are split into chunks that fit the model; a token is roughly 0.75 words
+WORDS_PER_TOKEN = 0.75
+PROMPT_OVERHEAD_TOKENS = 500
+# Expected reply length relative to its chunk, so each chunk's reply fits in max_tokens
+CHUNK_REPLY_RATIO = {
+    'expand': 2.0,
+    'fine-tune': 1.1,
+    'convert to script': 1.3,
+    'summarize': 0.2
+}
+
+# Stories longer than this are planned with an outline first and expanded chapter by chapter
+LONG_STORY_THRESHOLD = 50
+PAGES_PER_CHAPTER = 5
+MAX_CHAPTERS = 40
+# Token cap per long-story page keeps every call (and so the whole story) to a predictable duration
+LONG_STORY_PAGE_TOKENS = 700
+
+# A call isn't started with less than this long left before the request's deadline
+# (or the model's average latency, once the router knows it); see request_deadline
+MIN_CALL_SECONDS = 5.0
+
+# Events set when a fail-fast batch of concurrent tasks the current one belongs to has failed (see _run_concurrently)
+_cancelled = contextvars.ContextVar('ai_service_cancelled', default=())
+
+
+class GenerationCancelled(Exception):
+    """Another part of the same generation failed, so this one's model calls are skipped"""
+
+
+def check_cancelled(what="This step"):
+    """Raise GenerationCancelled once a fail-fast batch running the current task has failed"""
+    if any(event.is_set() for event in _cancelled.get()):
+        raise GenerationCancelled(f"{what} was cancelled because another part of the generation failed")
+
+
+class GenerationStep:
+    """
+    One step of a multi-step generation (see AIService._run_steps).
+    run(inputs) is called with {step name: result} for each step in `after`,
+    once all of them have succeeded.
+    """
+    
+    def __init__(self, name, run, after=()):
+        self.name = name
+        self.run = run
+        self.after = tuple(after)
+
 
 class AIService:
-    def __init__(self):
+    def __init__(self, client=None, cache=None, router=None, scheduler=None, telemetry=None, checkpoints=None):
         # Check if DeepInfra API key is available
         self.available = bool(os.environ.get("DEEPINFRA_API_KEY"))
         if not self.available:
             logging.error("DEEPINFRA_API_KEY not found in environment variables")
         
-        # Use the corrected model configurations from deepinfra_client_fixed
-        self.models = DEEPINFRA_MODELS
+        # Use the corrected model configurations from deepinfra_client_fixed, with any run on the local server (see llm_backends)
+        self.models = MODELS
+        
+        # Optional explicit client/cache/router/scheduler/telemetry/checkpoints (tests/benchmarks); otherwise the per-worker defaults
+        self._client = client
+        self._cache = cache
+        self._router = router
+        self._scheduler = scheduler
+        self._telemetry = telemetry
+        self._checkpoints = checkpoints
+    
+    @property
+    def client(self):
+        """LLM client used for every call made by this service; by default each model's backend (see llm_backends)"""
+        if self._client:
+            return self._client
+        return llm_backends
+    
+    @property
+    def cache(self):
+        """Response cache shared by all workers (see llm_cache)"""
+        if self._cache is None:
+            from llm_cache import llm_cache
+            self._cache = llm_cache
+        return self._cache
+    
+    @property
+    def router(self):
+        """Latency-aware model router shared by the process (see model_router)"""
+        if self._router is None:
+            from model_router import model_router
+            self._router = model_router
+        return self._router
+    
+    @property
+    def scheduler(self):
+        """Node-wide fair scheduler every call waits in for a slot (see llm_scheduler); None when disabled"""
+        if self._scheduler is None:
+            from llm_scheduler import llm_scheduler, scheduler_enabled
+            if not scheduler_enabled():
+                return None
+            self._scheduler = llm_scheduler
+        return self._scheduler
+    
+    @property
+    def telemetry(self):
+        """Latency and token usage recorder shared by all workers (see llm_telemetry)"""
+        if self._telemetry is None:
+            from llm_telemetry import llm_telemetry
+            self._telemetry = llm_telemetry
+        return self._telemetry
+    
+    @property
+    def checkpoints(self):
+        """Store of finished pages that multi-page generations resume from (see generation_checkpoints)"""
+        if self._checkpoints is None:
+            from generation_checkpoints import generation_checkpoints
+            self._checkpoints = generation_checkpoints
+        return self._checkpoints
+    
+    def _slot(self, model):
+        """Context manager holding a scheduler slot on model for the current user"""
+        scheduler = self.scheduler
+        return scheduler.slot(model) if scheduler else nullcontext()
+    
+    def _client_for(self, model_type):
+        """The client serving model_type: its backend's when the client routes between backends (see llm_backends)"""
+        for_model_type = getattr(self.client, 'for_model_type', None)
+        return for_model_type(model_type) if for_model_type and model_type in self.models else self.client
     
+    @contextmanager
+    def _model_call(self, model, needed=MIN_CALL_SECONDS):
+        """
+        One provider call on model: waits for a scheduler slot, then yields the
+        LLMCall telemetry records (pass its usage dict to the client). Raises
+        DeadlineExceeded instead when less than `needed` seconds of the
+        request's deadline are left, before or after the wait, and
+        GenerationCancelled once the rest of its generation has failed.
+        """
+        check_cancelled(f"A call to {model}")
+        with self.telemetry.track(model) as call:
+            request_deadline.check(needed, f"A call to {model}")
+            with self._slot(model):
+                check_cancelled(f"A call to {model}")
+                request_deadline.check(needed, f"A call to {model}")
+                call.started()
+                yield call
+    
+    def _expected_seconds(self, model_type):
+        """How long a call to model_type should be given to finish"""
+        latency = self.router.expected_latency(model_type) if model_type else None
+        return max(MIN_CALL_SECONDS, latency or 0.0)
+    
+    def _chat(self, prompt, system_msg, model, max_tokens, temperature=0.7, use_cache=False, hedge=False, model_type=None,
+              max_attempts=None):
+        """
+        Chat completion that is served from the shared response cache when use_cache is set.
+        hedge sends a backup request if the first one is slow (short interactive calls only).
+        With model_type, calls that reach the provider are timed for the router.
+        max_attempts caps the client's own HTTP retries (1 when the caller retries).
+        """
+        kwargs = {'hedge': True} if hedge else {}
+        if max_attempts:
+            kwargs['max_attempts'] = max_attempts
+        if not use_cache:
+            return self._call_model(model_type, prompt, system_msg, model=model, max_tokens=max_tokens, temperature=temperature, **kwargs)
+        
+        key = self.cache.make_key(model, system_msg, prompt, max_tokens, temperature)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        
+        content = self._call_model(model_type, prompt, system_msg, model=model, max_tokens=max_tokens, temperature=temperature, **kwargs)
+        if content:
+            self.cache.set(key, content)
+        return content
+    
+    def _call_model(self, model_type, prompt, system_msg, **kwargs):
+        """
+        client.chat once the scheduler gives this user a slot on the model,
+        recording the call in telemetry and, with model_type, its latency,
+        throughput and outcome in the router.
+        """
+        with self._model_call(kwargs.get('model'), self._expected_seconds(model_type)) as call:
+            start = time.monotonic()
+            try:
+                content = self._client_for(model_type).chat(prompt, system_msg, usage=call.usage, **kwargs)
+            except DeadlineExceeded:
+                # Cut short by the request's deadline, which says nothing about the model
+                raise
+            except Exception:
+                if model_type is not None:
+                    self.router.record(model_type, time.monotonic() - start, error=True)
+                raise
+            call.estimate(prompt, system_msg, content)
+            if not content:
+                call.outcome = EMPTY
+        if model_type is not None:
+            tokens = call.completion_tokens if content else 0
+            self.router.record(model_type, time.monotonic() - start, tokens=tokens, error=not content)
+        return content
+    
+    def _routed_chat(self, prompt, system_msg, model_type, max_tokens=None, temperature=0.7, use_cache=False, hedge=False,
+                     slo=None, max_attempts=None):
+        """
+        One chat call on the model the router picks for model_type, moving down
+        its fallback chain if that model fails. Returns (content, model type used).
+        max_tokens is capped at each model's own limit, and the SLO at the time
+        left before the request's deadline so slow models are passed over near it.
+        """
+        left = request_deadline.remaining()
+        if left is not None:
+            slo = min(slo or self.router.slo, left)
+        last_error = None
+        for candidate in self.router.candidates(model_type, slo, getattr(self.client, 'breakers', None)):
+            model_config = self.models[candidate]
+            try:
+                content = self._chat(
+                    prompt,
+                    system_msg,
+                    model=model_config['name'],
+                    max_tokens=min(max_tokens or model_config['max_tokens'], model_config['max_tokens']),
+                    temperature=temperature,
+                    use_cache=use_cache,
+                    hedge=hedge,
+                    model_type=candidate,
+                    max_attempts=max_attempts
+                )
+                if content:
+                    if candidate != model_type:
+                        logging.info(f"Served a {model_type} request with fallback model {candidate}")
+                    return content, candidate
+                last_error = Exception("Empty response from model")
+            except GenerationCancelled:
+                raise
+            except Exception as e:
+                last_error = e
+            logging.warning(f"Model {candidate} failed, trying its fallback: {last_error}")
+        
+        raise last_error
+    
+    def _model_type(self, model_config):
+        """self.models key of a model config (None for configs not in the table)"""
+        return next((key for key, config in self.models.items()
+                     if config['display_name'] == model_config.get('display_name')), None)
+    
+    @feature('generate_text')
     def generate_text(self, prompt, model_type='balanced', length='medium'):
         """Generate text with model selection and length control"""
         if not self.available:
@@ -22,28 +269,15 @@ class AIService:
             
         try:
             model_config = self.models.get(model_type, self.models['balanced'])
+            enhanced_prompt, system_msg = self._text_prompt(prompt, model_config, length)
             
-            # Length-based prompts
-            length_prompts = {
-                'short': f"Write a short paragraph (100-150 words) about: {prompt}",
-                'medium': f"Write a full page (300-500 words) about: {prompt}",
-                'long': f"Write a full chapter (500+ words) about: {prompt}. Include detailed descriptions, dialogue, and character development."
-            }
-            
-            enhanced_prompt = length_prompts.get(length, length_prompts['medium'])
-            system_msg = f"You are a skilled {model_config['display_name'].lower()} writing assistant. Generate high-quality, engaging content."
-            
-            content = ask_deepinfra(
-                enhanced_prompt, 
-                system_msg, 
-                model=model_config['name'],
-                max_tokens=model_config['max_tokens']
-            )
+            content, used = self._routed_chat(enhanced_prompt, system_msg, model_type)
             
             return {
                 "success": True,
                 "content": content,
-                "model_used": model_config['display_name'],
+                "model_used": self.models[used]['display_name'],
+                "models_used": {used: 1},
                 "length": length,
                 "word_count": len(content.split()) if content else 0
             }
@@ -55,8 +289,50 @@ class AIService:
                 "error": "AI service is temporarily unavailable. Please try again in a moment."
             }
     
-    def generate_story_chapter(self, story_context, chapter_number, total_chapters, model_type='creative', max_tokens=2500):
-        """Generate a single chapter of a story using DeepInfra with model selection"""
+    def _text_prompt(self, prompt, model_config, length):
+        """Build the (prompt, system message) pair used by generate_text and stream_text"""
+        # Length-based prompts
+        length_prompts = {
+            'short': f"Write a short paragraph (100-150 words) about: {prompt}",
+            'medium': f"Write a full page (300-500 words) about: {prompt}",
+            'long': f"Write a full chapter (500+ words) about: {prompt}. Include detailed descriptions, dialogue, and character development."
+        }
+        
+        enhanced_prompt = length_prompts.get(length, length_prompts['medium'])
+        system_msg = f"You are a skilled {model_config['display_name'].lower()} writing assistant. Generate high-quality, engaging content."
+        return enhanced_prompt, system_msg
+    
+    def stream_text(self, prompt, model_type='balanced', length='medium'):
+        """Streaming version of generate_text - yields content fragments as they arrive"""
+        if not self.available:
+            raise Exception("AI service is temporarily unavailable. Please try again in a moment.")
+        
+        model_config = self.models.get(model_type, self.models['balanced'])
+        enhanced_prompt, system_msg = self._text_prompt(prompt, model_config, length)
+        
+        with feature('stream_text'), self._model_call(model_config['name']) as call:
+            reply = []
+            for fragment in self._client_for(model_type).stream_chat(
+                enhanced_prompt,
+                system_msg,
+                model=model_config['name'],
+                max_tokens=model_config['max_tokens'],
+                usage=call.usage
+            ):
+                reply.append(fragment)
+                yield fragment
+            call.estimate(enhanced_prompt, system_msg, ''.join(reply))
+    
+    @feature('story_chapter')
+    def generate_story_chapter(self, story_context, chapter_number, total_chapters, model_type='creative', max_tokens=2500, memory=None):
+        """
+        Generate a single chapter of a story using DeepInfra with model selection.
+        
+        With a StoryMemory (see story_memory) the prompt is built from its
+        compact summary and fact sheet instead of story_context, and the memory
+        is updated with the new chapter - so the prompt stays the same size
+        however many chapters came before.
+        """
         if not self.available:
             return {
                 "success": False,
@@ -65,6 +341,8 @@ class AIService:
             
         try:
             model_config = self.models.get(model_type, self.models['creative'])
+            if memory is not None:
+                story_context = memory.render()
             
             prompt = f"""
             Story Context: {story_context}
@@ -76,20 +354,19 @@ class AIService:
             """
             
             system_msg = "You are a skilled storyteller. Write engaging, well-structured chapters that advance the narrative."
-            content = ask_deepinfra(
-                prompt, 
-                system_msg, 
-                model=model_config['name'],
-                max_tokens=min(max_tokens, model_config['max_tokens'])
-            )
+            content, used = self._routed_chat(prompt, system_msg, model_type, max_tokens=max_tokens)
             
-            return {
+            result = {
                 "success": True,
                 "content": content,
-                "model_used": model_config['display_name'],
+                "model_used": self.models[used]['display_name'],
                 "chapter_number": chapter_number,
                 "word_count": len(content.split()) if content else 0
             }
+            if memory is not None:
+                self.update_story_memory(memory, chapter_number, content, model_config)
+                result["memory"] = memory.to_dict()
+            return result
             
         except Exception as e:
             logging.error(f"Story chapter generation exception: {str(e)}")
@@ -108,46 +385,506 @@ class AIService:
             'cost_multiplier': config['cost_multiplier']
         } for key, config in self.models.items()}
 
-    def generate_story_with_model(self, story_prompt, page_count, model_type='creative'):
-        """Generate multi-page story with model selection"""
+    @feature('story_memory')
+    def update_story_memory(self, memory, chapter_number, chapter_text, model_config=None):
+        """Fold a finished chapter into the story's memory; a failed update falls back to a local trim"""
+        model_config = model_config or self.models['balanced']
+        prompt, system_msg = memory.update_prompt(chapter_number, chapter_text)
+        try:
+            reply = self._call_model(None, prompt, system_msg, model=model_config['name'], max_tokens=800, temperature=0.2)
+        except Exception as e:
+            logging.warning(f"Story memory update failed for chapter {chapter_number}: {e}")
+            reply = None
+        memory.apply_update(reply, chapter_number, chapter_text)
+    
+    def _generate_page(self, story_prompt, page_number, page_count, model_config, usage=None):
+        """Generate one page of a multi-page story, retrying that page on its own"""
+        chapter_prompt, system_msg = self._page_prompt(story_prompt, page_number, page_count, model_config)
+        return self._chat_with_retries(chapter_prompt, system_msg, model_config, f"Page {page_number}", usage=usage)
+    
+    def _chat_with_retries(self, prompt, system_msg, model_config, label, use_cache=False, max_tokens=None, usage=None):
+        """
+        One part of a larger generation (a page, a file chunk), retried on its own up to PAGE_RETRIES times.
+        Each attempt goes through the model router; the model type that served it is appended to usage.
+        These retries replace the client's: each attempt makes a single HTTP request per model.
+        """
+        model_type = self._model_type(model_config)
+        last_error = None
+        for attempt in range(1, PAGE_RETRIES + 2):
+            try:
+                if model_type is None:
+                    content, used = self._chat(
+                        prompt,
+                        system_msg,
+                        model=model_config['name'],
+                        max_tokens=max_tokens or model_config['max_tokens'],
+                        use_cache=use_cache,
+                        max_attempts=1
+                    ), None
+                else:
+                    content, used = self._routed_chat(prompt, system_msg, model_type, max_tokens=max_tokens,
+                                                      use_cache=use_cache, max_attempts=1)
+                if content:
+                    if usage is not None:
+                        usage.append(used)
+                    return content
+                last_error = Exception("Empty response from model")
+            except (DeadlineExceeded, GenerationCancelled):
+                # Retrying can only take longer, or isn't wanted any more
+                raise
+            except Exception as e:
+                last_error = e
+            logging.warning(f"{label} attempt {attempt} failed: {last_error}")
+        
+        raise last_error
+    
+    @staticmethod
+    def _with_progress(tasks, progress, total=None, offset=0):
+        """Wrap tasks so progress(done, total) is called as each one finishes"""
+        if not progress:
+            return tasks
+        total = total or len(tasks) + offset
+        done = [offset]
+        lock = threading.Lock()
+        
+        def wrap(task):
+            def run():
+                result = task()
+                with lock:
+                    done[0] += 1
+                    completed = done[0]
+                progress(completed, total)
+                return result
+            return run
+        
+        return [wrap(task) for task in tasks]
+    
+    @feature('long_story')
+    def generate_long_story(self, story_prompt, page_count, model_type='creative', progress=None, usage=None):
+        """
+        Long-form engine: plan the whole story as a structured outline in one
+        call, then expand every page concurrently. Each page prompt carries a
+        compact rolling context (premise, cast, its chapter and the chapters
+        either side) instead of earlier pages' text, so pages stay coherent
+        without waiting on each other and every call is capped at
+        LONG_STORY_PAGE_TOKENS.
+        """
         if not self.available:
             return None
-            
+        
         try:
-            model_config = self.models.get(model_type, self.models['creative'])
-            story_parts = []
+            pages, error, _ = self._long_story_pages(story_prompt, page_count, model_type, progress, usage)
+            if error:
+                logging.error(f"Page {len(pages) + 1} of {page_count} failed: {error}")
+                return None
+            return self.format_pages(pages)
             
-            for i in range(page_count):
-                chapter_prompt = f"""
+        except Exception as e:
+            logging.error(f"Long story generation exception: {str(e)}")
+            return None
+    
+    def _long_story_pages(self, story_prompt, page_count, model_type, progress=None, usage=None, generation_id=None):
+        """
+        The pages generate_long_story writes, as (pages, error, billable): every
+        page up to the first one that failed or was declined for time, that
+        page's error (None when all were written), and how many of the pages
+        returned aren't charged for yet. usage gets the model type of each of
+        those. With a generation_id the outline and every finished page are
+        checkpointed, and a resumed run reuses them. The outline failing raises.
+        """
+        model_config = self.models.get(model_type, self.models['creative'])
+        chapter_count = min(MAX_CHAPTERS, math.ceil(page_count / PAGES_PER_CHAPTER))
+        total_steps = page_count + 1
+        
+        saved = self.checkpoints.pages(generation_id) if generation_id else {}
+        outline = self.checkpoints.outline(generation_id) if generation_id else None
+        if outline is None:
+            outline = self._generate_outline(story_prompt, page_count, chapter_count, model_config)
+            if generation_id:
+                self.checkpoints.save_outline(generation_id, outline)
+        if progress:
+            progress(1, total_steps)
+        
+        # Spread pages over chapters as evenly as possible
+        plan = []
+        for index, chapter in enumerate(outline['chapters']):
+            pages_in_chapter = page_count // chapter_count + (1 if index < page_count % chapter_count else 0)
+            for page_in_chapter in range(1, pages_in_chapter + 1):
+                plan.append((index, page_in_chapter, pages_in_chapter))
+        
+        served_by = {}
+        
+        def page(page_number, step):
+            if page_number in saved:
+                return saved[page_number]['content']
+            page_usage = []
+            content = self._generate_long_page(story_prompt, outline, step, page_number, page_count, model_config,
+                                               page_usage)
+            served_by[page_number] = page_usage[-1] if page_usage else None
+            if generation_id and content:
+                self.checkpoints.save_page(generation_id, page_number, content, served_by[page_number])
+            return content
+        
+        tasks = [
+            (lambda page_number=page_number, step=step: page(page_number, step))
+            for page_number, step in enumerate(plan, 1)
+        ]
+        outcomes = self._run_concurrently(self._with_progress(tasks, progress, total_steps, offset=1),
+                                          model_config.get('max_concurrency', 1), fail_fast=True)
+        
+        pages = []
+        error = None
+        for (content, failure), (chapter_index, page_in_chapter, _) in zip(outcomes, plan):
+            if failure or not content:
+                error = failure or Exception("Empty response from model")
+                break
+            if page_in_chapter == 1:
+                chapter = outline['chapters'][chapter_index]
+                content = f"Chapter {chapter_index + 1}: {chapter['title']}\n\n{content.strip()}"
+            pages.append(content)
+        
+        billable = [n for n in range(1, len(pages) + 1) if not (n in saved and saved[n]['billed'])]
+        if usage is not None:
+            usage.extend(served_by[n] if n in served_by else saved[n]['model_type'] for n in billable)
+        return pages, error, len(billable)
+    
+    @feature('story_outline')
+    def _generate_outline(self, story_prompt, page_count, chapter_count, model_config):
+        """One call that plans title, cast and a summary for each chapter"""
+        prompt = f"""Plan a {page_count}-page story about: {story_prompt}
+                
+                Reply with JSON only, in exactly this shape:
+                {{"title": "...", "characters": ["Name - one line description"], "chapters": [{{"title": "...", "summary": "two or three sentences"}}]}}
+                
+                There must be exactly {chapter_count} chapters, together telling the complete story from opening to ending."""
+        system_msg = "You are a professional story architect. You plan long stories as concise, well-paced chapter outlines."
+        text = self._chat_with_retries(prompt, system_msg, model_config, "Outline")
+        return self._parse_outline(text, story_prompt, chapter_count)
+    
+    @staticmethod
+    def _parse_outline(text, story_prompt, chapter_count):
+        """Read the outline JSON, falling back to one chapter per line; always returns chapter_count chapters"""
+        outline = None
+        try:
+            outline = json.loads(text[text.index('{'):text.rindex('}') + 1])
+        except ValueError:
+            logging.warning("Outline was not valid JSON; using its lines as chapter summaries")
+        
+        if isinstance(outline, dict) and isinstance(outline.get('chapters'), list):
+            chapters = [
+                {'title': str(c.get('title') or f"Part {i}"), 'summary': str(c.get('summary') or '')}
+                for i, c in enumerate(outline['chapters'], 1) if isinstance(c, dict)
+            ]
+            title = str(outline.get('title') or story_prompt[:60])
+            characters = [str(c) for c in outline.get('characters') or []]
+        else:
+            lines = [line.strip(' -*#\t') for line in (text or '').splitlines() if line.strip(' -*#\t')]
+            chapters = [{'title': f"Part {i}", 'summary': line} for i, line in enumerate(lines, 1)]
+            title = story_prompt[:60]
+            characters = []
+        
+        chapters = chapters[:chapter_count]
+        while len(chapters) < chapter_count:
+            number = len(chapters) + 1
+            ending = number == chapter_count
+            chapters.append({
+                'title': f"Part {number}",
+                'summary': "Bring the story to a satisfying conclusion." if ending else "Continue the story, raising the stakes."
+            })
+        return {'title': title, 'characters': characters, 'chapters': chapters}
+    
+    def _generate_long_page(self, story_prompt, outline, step, page_number, page_count, model_config, usage=None):
+        """Expand one page of a long story from its place in the outline"""
+        chapter_index, page_in_chapter, pages_in_chapter = step
+        chapters = outline['chapters']
+        chapter = chapters[chapter_index]
+        previous = chapters[chapter_index - 1]['summary'] if chapter_index > 0 else "This is the opening chapter."
+        upcoming = (chapters[chapter_index + 1]['summary'] if chapter_index + 1 < len(chapters)
+                    else "This is the final chapter; bring the story to a satisfying end.")
+        if page_in_chapter == 1:
+            position = "Open the chapter."
+        elif page_in_chapter == pages_in_chapter:
+            position = "Close the chapter so it leads into what comes next."
+        else:
+            position = "Continue the chapter's action."
+        
+        prompt = f"""
                 Story: {story_prompt}
+                Title: {outline['title']}
+                Main characters: {'; '.join(outline['characters'][:8]) or 'as established in the story'}
                 
-                Write page {i+1} of {page_count} for this story.
-                Each page should be around 300-500 words.
-                Make it engaging and well-structured.
-                """
+                Chapter {chapter_index + 1} of {len(chapters)}: {chapter['title']}
+                What happens in this chapter: {chapter['summary']}
+                Previously: {previous}
+                Coming next: {upcoming}
                 
-                system_msg = f"You are a skilled storyteller using {model_config['display_name']} style. Create engaging content."
+                Write page {page_in_chapter} of {pages_in_chapter} of this chapter (page {page_number} of {page_count} overall), around 300-400 words.
+                {position} Write only the story text, without headings.
+                """
+        system_msg = f"You are a skilled novelist using {model_config['display_name']} style. Keep characters, tone and plot consistent with the outline."
+        return self._chat_with_retries(prompt, system_msg, model_config, f"Page {page_number}",
+                                       max_tokens=LONG_STORY_PAGE_TOKENS, usage=usage)
+    
+    @staticmethod
+    def _run_concurrently(tasks, max_workers, fail_fast=False):
+        """
+        Run zero-argument callables on a bounded thread pool.
+        Returns a list of (result, error) tuples in the same order as tasks.
+        With fail_fast, the first failure returns straight away: tasks that
+        haven't started yet are cancelled, and running ones stop before their
+        next model call with GenerationCancelled. A provider call already in
+        flight still finishes (and a page it completes is still checkpointed).
+        """
+        if not tasks:
+            return []
+        
+        outcomes = [(None, None)] * len(tasks)
+        cancelled = threading.Event()
+        
+        def run(task):
+            _cancelled.set(_cancelled.get() + (cancelled,))
+            return task()
+        
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))))
+        try:
+            # Each task runs in a copy of the caller's context so it is scheduled for the same user
+            futures = [executor.submit(contextvars.copy_context().run, run, task) for task in tasks]
+            for index, future in enumerate(futures):
+                try:
+                    outcomes[index] = (future.result(), None)
+                except Exception as e:
+                    outcomes[index] = (None, e)
+                    if fail_fast:
+                        cancelled.set()
+                        for pending in futures[index + 1:]:
+                            pending.cancel()
+                        break
+        finally:
+            executor.shutdown(wait=not fail_fast, cancel_futures=fail_fast)
+        return outcomes
+    
+    @staticmethod
+    def _run_steps(steps, max_workers):
+        """
+        Run a dependency graph of GenerationSteps on a bounded thread pool, starting
+        each step as soon as the steps it comes after have succeeded, so independent
+        steps run concurrently. Returns {name: {'success', 'result', 'error', 'seconds'}}
+        for every step in order. A step whose dependency failed is skipped, but
+        unrelated steps still run and keep their results.
+        """
+        by_name = {step.name: step for step in steps}
+        if len(by_name) != len(steps):
+            raise ValueError("Generation step names must be unique")
+        unplaced = {step.name: set(step.after) for step in steps}
+        for name, after in unplaced.items():
+            unknown = after - by_name.keys()
+            if unknown:
+                raise ValueError(f"Step {name} comes after unknown step(s): {', '.join(sorted(unknown))}")
+        while unplaced:
+            ready = [name for name, after in unplaced.items() if not after & unplaced.keys()]
+            if not ready:
+                raise ValueError(f"Generation steps form a cycle: {', '.join(sorted(unplaced))}")
+            for name in ready:
+                del unplaced[name]
+        
+        def timed(step, inputs):
+            start = time.monotonic()
+            try:
+                return step.run(inputs), None, time.monotonic() - start
+            except Exception as e:
+                return None, e, time.monotonic() - start
+        
+        outcomes = {}
+        waiting = list(steps)
+        running = {}
+        executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(steps))))
+        try:
+            while waiting or running:
+                for step in [step for step in waiting if all(name in outcomes for name in step.after)]:
+                    waiting.remove(step)
+                    failed = [name for name in step.after if not outcomes[name]['success']]
+                    if failed:
+                        outcomes[step.name] = {'success': False, 'result': None, 'seconds': 0.0,
+                                               'error': f"Skipped because {', '.join(failed)} failed"}
+                        continue
+                    inputs = {name: outcomes[name]['result'] for name in step.after}
+                    # Like _run_concurrently, each step runs in a copy of the caller's context
+                    running[executor.submit(contextvars.copy_context().run, timed, step, inputs)] = step.name
+                if not running:
+                    # Only skips happened this round; they may have settled more steps
+                    continue
                 
-                content = ask_deepinfra(
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result, error, seconds = future.result()
+                    if error:
+                        logging.error(f"Generation step {name} failed: {error}")
+                    outcomes[name] = {'success': error is None, 'result': result, 'seconds': round(seconds, 3),
+                                      'error': str(error) if error else None}
+        finally:
+            executor.shutdown(wait=True)
+        return {step.name: outcomes[step.name] for step in steps}
+    
+    @feature('story')
+    def generate_titled_story(self, story_prompt, page_count, model_type='creative', progress=None, usage=None,
+                              generation_id=None):
+        """
+        Generate a multi-page story and its title as one step graph: the title
+        and the pages (or the whole long-story engine above LONG_STORY_THRESHOLD
+        pages) run concurrently, and the pages are joined once they have all
+        finished. A failed title doesn't lose the story. A page that fails every
+        retry, or is declined because the request's deadline is near, cuts the
+        story short after the last unbroken page (partial, pages_delivered)
+        instead of failing it.
+        
+        With a generation_id each finished page is checkpointed as it completes,
+        and pages already checkpointed by an earlier run are reused rather than
+        generated again. pages_billable counts the delivered pages not yet
+        charged for, and usage gets the model type of each of them.
+        Returns success, content, title (None if it failed), error, page counts
+        and per-step timings.
+        """
+        if not self.available:
+            return {"success": False, "error": "AI service is temporarily unavailable. Please try again in a moment."}
+        
+        model_config = self.models.get(model_type, self.models['creative'])
+        
+        def title(_):
+            generated = self.generate_story_title(story_prompt)
+            if not generated['success']:
+                raise Exception("Title generation failed")
+            return generated['title']
+        
+        @feature('long_story')
+        def long_story(_):
+            pages, error, billable = self._long_story_pages(story_prompt, page_count, model_type, progress, usage,
+                                                            generation_id)
+            if not pages:
+                if isinstance(error, DeadlineExceeded):
+                    raise DeadlineExceeded("Ran out of time before the first page was finished")
+                raise error
+            if error:
+                # The story is cut short before this page rather than failed
+                logging.warning(f"Page {len(pages) + 1} of {page_count} not generated: {error}")
+            return {'content': self.format_pages(pages), 'pages': len(pages), 'billable': billable}
+        
+        saved = self.checkpoints.pages(generation_id) if generation_id and page_count <= LONG_STORY_THRESHOLD else {}
+        served_by = {}
+        failures = {}
+        
+        def page(page_number):
+            if page_number in saved:
+                return saved[page_number]['content']
+            page_usage = []
+            try:
+                content = self._generate_page(story_prompt, page_number, page_count, model_config, page_usage)
+            except Exception as e:
+                # The story is cut short before this page rather than failed
+                logging.warning(f"Page {page_number} of {page_count} not generated: {e}")
+                failures[page_number] = e
+                return None
+            served_by[page_number] = page_usage[-1] if page_usage else None
+            if generation_id:
+                self.checkpoints.save_page(generation_id, page_number, content, served_by[page_number])
+            return content
+        
+        def join(results):
+            texts = [results[step.name] for step in pages]
+            delivered = texts.index(None) if None in texts else len(texts)
+            if not delivered:
+                if isinstance(failures[1], DeadlineExceeded):
+                    raise DeadlineExceeded("Ran out of time before the first page was finished")
+                raise failures[1]
+            billable = [n for n in range(1, delivered + 1) if not (n in saved and saved[n]['billed'])]
+            if usage is not None:
+                usage.extend(served_by[n] if n in served_by else saved[n]['model_type'] for n in billable)
+            return {'content': self.format_pages(texts[:delivered]), 'pages': delivered, 'billable': len(billable)}
+        
+        steps = [GenerationStep('title', title)]
+        if page_count > LONG_STORY_THRESHOLD:
+            steps.append(GenerationStep('story', long_story))
+        else:
+            tasks = self._with_progress([(lambda page_number=i + 1: page(page_number)) for i in range(page_count)], progress)
+            pages = [GenerationStep(f'page_{i}', lambda _, task=task: task()) for i, task in enumerate(tasks, 1)]
+            steps += pages
+            steps.append(GenerationStep('story', join, after=[step.name for step in pages]))
+        
+        # One extra worker so the title doesn't take a page's slot
+        outcomes = self._run_steps(steps, model_config.get('max_concurrency', 1) + 1)
+        timings = {
+            name: {key: outcome[key] for key in ('success', 'seconds', 'error') if outcome[key] is not None}
+            for name, outcome in outcomes.items()
+        }
+        story = outcomes['story']
+        delivered = story['result']['pages'] if story['success'] else 0
+        return {
+            "success": story['success'],
+            "content": story['result']['content'] if story['success'] else None,
+            "title": outcomes['title']['result'],
+            "error": story['error'],
+            "pages_requested": page_count,
+            "pages_delivered": delivered,
+            "pages_billable": story['result']['billable'] if story['success'] else 0,
+            "partial": story['success'] and delivered < page_count,
+            "steps": timings
+        }
+    
+    def stream_story_with_model(self, story_prompt, page_count, model_type='creative', generation_id=None):
+        """
+        Streaming version of generate_titled_story's pages.
+        Yields (page_number, fragment) tuples; pages are streamed one after another.
+        With a generation_id each page is checkpointed once it has streamed in
+        full, and pages checkpointed by an earlier run are yielded whole instead.
+        """
+        if not self.available:
+            raise Exception("AI service is temporarily unavailable. Please try again in a moment.")
+        
+        model_config = self.models.get(model_type, self.models['creative'])
+        saved = self.checkpoints.pages(generation_id) if generation_id else {}
+        
+        for page_number in range(1, page_count + 1):
+            if page_number in saved:
+                yield page_number, saved[page_number]['content']
+                continue
+            chapter_prompt, system_msg = self._page_prompt(story_prompt, page_number, page_count, model_config)
+            
+            with feature('stream_story'), self._model_call(model_config['name']) as call:
+                reply = []
+                for fragment in self._client_for(self._model_type(model_config)).stream_chat(
                     chapter_prompt,
                     system_msg,
                     model=model_config['name'],
-                    max_tokens=model_config['max_tokens']
-                )
+                    max_tokens=model_config['max_tokens'],
+                    usage=call.usage
+                ):
+                    reply.append(fragment)
+                    yield page_number, fragment
+                call.estimate(chapter_prompt, system_msg, ''.join(reply))
+            if generation_id and ''.join(reply).strip():
+                self.checkpoints.save_page(generation_id, page_number, ''.join(reply).strip(), self._model_type(model_config))
+    
+    def _page_prompt(self, story_prompt, page_number, page_count, model_config):
+        """Build the (prompt, system message) pair for one page of a multi-page story"""
+        chapter_prompt = f"""
+                Story: {story_prompt}
                 
-                if content:
-                    story_parts.append(f"=== PAGE {i+1} ===\n\n{content}")
-                else:
-                    return None
-            
-            return "\n\n".join(story_parts)
-            
-        except Exception as e:
-            logging.error(f"Story generation with model exception: {str(e)}")
-            return None
+                Write page {page_number} of {page_count} for this story.
+                Each page should be around 300-500 words.
+                Make it engaging and well-structured.
+                """
+        
+        system_msg = f"You are a skilled storyteller using {model_config['display_name']} style. Create engaging content."
+        return chapter_prompt, system_msg
+    
+    @staticmethod
+    def format_pages(pages):
+        """Join page texts into the '=== PAGE n ===' layout used across the app"""
+        return "\n\n".join(f"=== PAGE {i} ===\n\n{content}" for i, content in enumerate(pages, 1))
 
-    def generate_story_title(self, story_prompt):
-        """Generate a title for a story using DeepInfra"""
+    @feature('story_title')
+    def generate_story_title(self, story_prompt, use_cache=True):
+        """Generate a title for a story with the 'fast' model (cached unless use_cache is False)"""
         if not self.available:
             return {
                 "success": False,
@@ -157,7 +894,8 @@ class AIService:
         try:
             prompt = f"Generate a compelling, creative title for a story about: {story_prompt}. Return only the title, no quotes or extra text."
             system_msg = "You are a title generator. Create short, catchy titles for stories."
-            title = ask_deepinfra(prompt, system_msg, model="mistralai/Mixtral-8x7B-Instruct-v0.1", max_tokens=50)
+            title = self._chat(prompt, system_msg, model=self.models['fast']['name'], max_tokens=50,
+                               use_cache=use_cache, hedge=True, model_type='fast')
             
             return {
                 "success": True,
@@ -171,6 +909,7 @@ class AIService:
                 "title": "Generated Story"
             }
 
+    @feature('single_text')
     def generate_single_text(self, prompt):
         """Generate single text from prompt"""
         if not self.available:
@@ -178,13 +917,14 @@ class AIService:
             
         try:
             system_msg = "You are a creative writing assistant. Generate high-quality, engaging content based on the user's prompt. Write approximately 800-1200 words with proper structure and flow."
-            content = ask_deepinfra(prompt, system_msg, model="mistralai/Mixtral-8x7B-Instruct-v0.1", max_tokens=2000)
+            content = self._call_model(None, prompt, system_msg, model="mistralai/Mixtral-8x7B-Instruct-v0.1", max_tokens=2000)
             return content
             
         except Exception as e:
             logging.error(f"Error in AI text generation: {e}")
             return None
 
+    @feature('story')
     def generate_story(self, prompt, page_count):
         """Generate multi-page story from prompt"""
         if not self.available:
@@ -198,23 +938,18 @@ class AIService:
             elif page_count <= 20:
                 words_per_page = 600
                 max_tokens = page_count * 900
-            elif page_count <= 50:
+            else:
                 words_per_page = 400
                 max_tokens = min(page_count * 600, 6000)
-            else:
-                # For very large page counts (50+), generate an outline approach
-                words_per_page = 200
-                max_tokens = min(3000, page_count * 50)  # Very conservative for 100+ pages
-            
-            # For large page counts, use a different approach
-            if page_count > 50:
-                story_prompt = f"Create a detailed {page_count}-page story outline and first few pages about: {prompt}. Structure it as: Title, Plot Summary, Character Overview, then write the first 3-5 pages in detail with 'Page X:' headers. For the remaining pages, provide chapter summaries."
-                system_msg = f"You are a professional storyteller. Create a comprehensive story structure for {page_count} pages with detailed opening and summaries for the rest."
-            else:
-                story_prompt = f"Create a {page_count}-page story about: {prompt}. Structure it with clear page breaks. Each page should be approximately {words_per_page} words. Use 'Page X:' headers to separate pages clearly."
-                system_msg = f"You are a professional storyteller. Create a {page_count}-page story with engaging narrative, character development, and proper structure. Keep each page concise but engaging with approximately {words_per_page} words per page."
             
-            content = ask_deepinfra(story_prompt, system_msg, model="mistralai/Mixtral-8x7B-Instruct-v0.1", max_tokens=max_tokens)
+            # Large page counts get real pages from the outline-then-expand engine
+            if page_count > LONG_STORY_THRESHOLD:
+                return self.generate_long_story(prompt, page_count)
+            
+            story_prompt = f"Create a {page_count}-page story about: {prompt}. Structure it with clear page breaks. Each page should be approximately {words_per_page} words. Use 'Page X:' headers to separate pages clearly."
+            system_msg = f"You are a professional storyteller. Create a {page_count}-page story with engaging narrative, character development, and proper structure. Keep each page concise but engaging with approximately {words_per_page} words per page."
+            
+            content = self._call_model(None, story_prompt, system_msg, model="mistralai/Mixtral-8x7B-Instruct-v0.1", max_tokens=max_tokens)
             return content
             
         except Exception as e:
@@ -235,8 +970,25 @@ class AIService:
         
         return formatted.strip()
     
-    def process_uploaded_file(self, file_content, instruction, model_type='balanced'):
-        """Process uploaded file content with AI enhancement"""
+    # Prompt prefix for each uploaded file instruction
+    FILE_INSTRUCTION_PROMPTS = {
+        'expand': 'Expand and add more details and content to this text while maintaining its core message and style:',
+        'fine-tune': 'Improve the writing quality, style, and readability of this text without changing its core content:',
+        'convert to script': 'Convert this narrative into a screenplay format with proper dialogue and scene directions:',
+        'summarize': 'Create a concise summary of this text while capturing all key points:',
+        'continue': 'Continue this story from where it ends, maintaining the same style and tone:'
+    }
+    
+    @feature('file_processing')
+    def process_uploaded_file(self, file_content, instruction, model_type='balanced', use_cache=True, progress=None):
+        """
+        Process uploaded file content with AI enhancement (summaries are cached unless use_cache is False).
+        
+        Files too large for one prompt are split on paragraph boundaries and the
+        chunks processed concurrently (map); summaries are then combined (reduce)
+        and other instructions stitched back together in order. progress, if
+        given, is called as progress(done, total) whenever a step finishes.
+        """
         if not self.available:
             return {
                 "success": False,
@@ -244,35 +996,53 @@ class AIService:
             }
             
         try:
-            model_config = self.models.get(model_type, self.models['balanced'])
+            from file_analyzer import FileAnalyzer
             
-            # Create processing prompt based on instruction
-            instruction_prompts = {
-                'expand': 'Expand and add more details and content to this text while maintaining its core message and style:',
-                'fine-tune': 'Improve the writing quality, style, and readability of this text without changing its core content:',
-                'convert to script': 'Convert this narrative into a screenplay format with proper dialogue and scene directions:',
-                'summarize': 'Create a concise summary of this text while capturing all key points:',
-                'continue': 'Continue this story from where it ends, maintaining the same style and tone:'
-            }
+            model_config = self.models.get(model_type, self.models['balanced'])
+            chunk_words = self._chunk_words(instruction, model_config)
+            chunks = FileAnalyzer.split_into_chunks(file_content, chunk_words) or [file_content]
             
-            prompt_prefix = instruction_prompts.get(instruction, f"Please {instruction} this text:")
-            enhanced_prompt = f"{prompt_prefix}\n\n{file_content}"
+            if instruction == 'continue':
+                # Only the end of the text matters for a continuation
+                chunks = chunks[-1:]
             
             system_msg = f"You are a skilled editor using {model_config['display_name']} style. Follow the instructions precisely while maintaining quality."
+            prompt_prefix = self.FILE_INSTRUCTION_PROMPTS.get(instruction, f"Please {instruction} this text:")
+            cache_summary = use_cache and instruction == 'summarize'
+            reduce_steps = 1 if instruction == 'summarize' and len(chunks) > 1 else 0
+            total_steps = len(chunks) + reduce_steps
+            usage = []
             
-            result = ask_deepinfra(
-                enhanced_prompt,
-                system_msg,
-                model=model_config['name'],
-                max_tokens=model_config['max_tokens']
-            )
+            if len(chunks) == 1:
+                result, used = self._routed_chat(f"{prompt_prefix}\n\n{chunks[0]}", system_msg, model_type,
+                                                 use_cache=cache_summary)
+                usage.append(used)
+                if progress:
+                    progress(1, 1)
+            else:
+                outputs = self._map_chunks(chunks, prompt_prefix, system_msg, model_config, cache_summary, progress, total_steps,
+                                           usage)
+                if outputs is None:
+                    return {
+                        "success": False,
+                        "error": "Failed to process part of the file. Please try again."
+                    }
+                if instruction == 'summarize':
+                    result = self._reduce_summaries(outputs, system_msg, model_config, chunk_words, cache_summary)
+                    if progress:
+                        progress(total_steps, total_steps)
+                else:
+                    result = "\n\n".join(output.strip() for output in outputs)
             
             if result:
+                models_used = dict(Counter(usage))
                 return {
                     "success": True,
                     "content": result,
-                    "model_used": model_type,
-                    "word_count": len(result.split()) if result else 0
+                    "model_used": max(models_used, key=models_used.get),
+                    "models_used": models_used,
+                    "word_count": len(result.split()) if result else 0,
+                    "chunks": len(chunks)
                 }
             else:
                 return {
@@ -286,14 +1056,64 @@ class AIService:
                 "success": False,
                 "error": f"Processing error: {str(e)}"
             }
+    
+    @staticmethod
+    def _chunk_words(instruction, model_config):
+        """Largest chunk, in words, whose prompt fits the context and whose reply fits max_tokens"""
+        max_tokens = model_config['max_tokens']
+        input_tokens = model_config.get('context_tokens', 8192) - max_tokens - PROMPT_OVERHEAD_TOKENS
+        ratio = CHUNK_REPLY_RATIO.get(instruction, 1.0)
+        input_tokens = min(input_tokens, max_tokens / ratio)
+        return max(200, int(input_tokens * WORDS_PER_TOKEN))
+    
+    def _map_chunks(self, chunks, prompt_prefix, system_msg, model_config, use_cache, progress, total_steps, usage=None):
+        """Process every chunk concurrently; returns outputs in order, or None if a chunk failed"""
+        def process(index, chunk):
+            prompt = (f"{prompt_prefix}\n\n(This is part {index + 1} of {len(chunks)} of a longer document. "
+                      f"Work on this part only; do not add an introduction or conclusion.)\n\n{chunk}")
+            return self._chat_with_retries(prompt, system_msg, model_config, f"Chunk {index + 1}", use_cache=use_cache,
+                                           usage=usage)
+        
+        tasks = [lambda index=index, chunk=chunk: process(index, chunk) for index, chunk in enumerate(chunks)]
+        outcomes = self._run_concurrently(self._with_progress(tasks, progress, total_steps),
+                                          model_config.get('max_concurrency', 1), fail_fast=True)
+        
+        for index, (content, error) in enumerate(outcomes):
+            if error is not None or not content:
+                logging.error(f"Chunk {index + 1} of {len(chunks)} failed: {error}")
+                return None
+        return [content for content, _ in outcomes]
+    
+    def _reduce_summaries(self, summaries, system_msg, model_config, chunk_words, use_cache):
+        """Combine chunk summaries into one, in rounds if they don't fit a single prompt"""
+        from file_analyzer import FileAnalyzer
+        
+        prefix = ("These are summaries of consecutive sections of one document. "
+                  "Combine them into a single concise summary that captures all key points:")
+        previous_groups = None
+        while True:
+            groups = FileAnalyzer.split_into_chunks("\n\n".join(summaries), chunk_words)
+            if len(groups) == 1:
+                return self._chat_with_retries(f"{prefix}\n\n{groups[0]}", system_msg, model_config,
+                                               "Summary reduce", use_cache=use_cache)
+            if previous_groups is not None and len(groups) >= previous_groups:
+                # Summaries stopped getting shorter; return what we have rather than loop
+                return "\n\n".join(summaries)
+            previous_groups = len(groups)
+            summaries = self._map_chunks(groups, prefix, system_msg, model_config, use_cache, None, 0)
+            if summaries is None:
+                raise Exception("Failed to combine section summaries")
 
+    @feature('write_tool')
     def sudowrite_write_tool(self, prompt, mode='auto', variants=1, temperature=0.7, model_type='balanced'):
         """Sudowrite-like Write tool with multiple modes and variants"""
         if not self.available:
             return {"success": False, "error": "AI service unavailable"}
             
         try:
-            model_config = self.models.get(model_type, self.models['balanced'])
+            # Variants share one model, picked by the router up front
+            model_type = self.router.choose(model_type, breakers=getattr(self.client, 'breakers', None))
+            model_config = self.models[model_type]
             results = []
             
             mode_prompts = {
@@ -305,17 +1125,13 @@ class AIService:
             }
             
             system_msg = f"You are a creative writing assistant. Generate high-quality content with temperature {temperature}."
+            prompt_text = mode_prompts.get(mode, mode_prompts['auto'])
             
             # Enforce maximum of 3 variants
             safe_variants = max(1, min(int(variants), 3))
-            for i in range(safe_variants):
-                content = ask_deepinfra(
-                    mode_prompts.get(mode, mode_prompts['auto']),
-                    system_msg,
-                    model=model_config['name'],
-                    max_tokens=model_config['max_tokens']
-                )
-                
+            contents = self._generate_variants(prompt_text, system_msg, model_config, safe_variants, float(temperature))
+            
+            for i, content in enumerate(contents):
                 if content:
                     results.append({
                         'variant': i + 1,
@@ -323,9 +1139,13 @@ class AIService:
                         'word_count': len(content.split())
                     })
             
+            if not results:
+                return {"success": False, "error": "Generation error: no variants could be generated"}
+            
             return {
                 "success": True,
                 "variants": results,
+                "requested": safe_variants,
                 "mode": mode,
                 "model_used": model_config['display_name']
             }
@@ -334,14 +1154,60 @@ class AIService:
             logging.error(f"Write tool error: {str(e)}")
             return {"success": False, "error": f"Generation error: {str(e)}"}
 
+    def _generate_variants(self, prompt, system_msg, model_config, count, temperature=0.7):
+        """
+        Generate `count` alternative completions for one prompt.
+        Uses a single request with the API's `n` parameter when the model supports it,
+        otherwise fans the calls out concurrently. Failed variants come back as None.
+        """
+        if count > 1 and model_config.get('supports_n'):
+            try:
+                with self._model_call(model_config['name']) as call:
+                    choices = self._client_for(self._model_type(model_config)).chat_choices(
+                        prompt,
+                        system_msg,
+                        model=model_config['name'],
+                        max_tokens=model_config['max_tokens'],
+                        temperature=temperature,
+                        n=count,
+                        usage=call.usage
+                    )
+                    call.estimate(prompt, system_msg, ' '.join(choices))
+                if len(choices) >= count:
+                    return choices[:count]
+                logging.warning(f"Model returned {len(choices)} of {count} choices, topping up individually")
+                return choices + self._generate_variants(prompt, system_msg, dict(model_config, supports_n=False),
+                                                         count - len(choices), temperature)
+            except Exception as e:
+                logging.warning(f"Multi-choice request failed, falling back to parallel calls: {e}")
+        
+        tasks = [
+            (lambda: self._call_model(
+                None,
+                prompt,
+                system_msg,
+                model=model_config['name'],
+                max_tokens=model_config['max_tokens'],
+                temperature=temperature
+            ))
+            for _ in range(count)
+        ]
+        outcomes = self._run_concurrently(tasks, model_config.get('max_concurrency', 1))
+        
+        contents = []
+        for index, (content, error) in enumerate(outcomes, 1):
+            if error:
+                logging.error(f"Variant {index} of {count} failed: {error}")
+            contents.append(content or None)
+        return contents
+
+    @feature('rewrite_tool')
     def sudowrite_rewrite_tool(self, text, rewrite_type='improve', model_type='balanced'):
         """Sudowrite-like Rewrite tool for passage improvements"""
         if not self.available:
             return {"success": False, "error": "AI service unavailable"}
             
         try:
-            model_config = self.models.get(model_type, self.models['balanced'])
-            
             rewrite_prompts = {
                 'show_not_tell': f"Rewrite this passage using 'show don't tell' techniques - replace exposition with action, dialogue, and sensory details:\n\n{text}",
                 'tone_change': f"Rewrite this passage with a different tone while keeping the same events:\n\n{text}",
@@ -353,33 +1219,27 @@ class AIService:
             prompt = rewrite_prompts.get(rewrite_type, rewrite_prompts['improve'])
             system_msg = "You are an expert editor. Rewrite the given text according to the specific instructions while maintaining the author's voice."
             
-            content = ask_deepinfra(
-                prompt,
-                system_msg,
-                model=model_config['name'],
-                max_tokens=model_config['max_tokens']
-            )
+            content, used = self._routed_chat(prompt, system_msg, model_type)
             
             return {
                 "success": True,
                 "original": text,
                 "rewritten": content,
                 "type": rewrite_type,
-                "model_used": model_config['display_name']
+                "model_used": self.models[used]['display_name']
             }
             
         except Exception as e:
             logging.error(f"Rewrite tool error: {str(e)}")
             return {"success": False, "error": f"Rewrite error: {str(e)}"}
 
+    @feature('describe_tool')
     def sudowrite_describe_tool(self, text, sense_focus='all', model_type='balanced'):
         """Sudowrite-like Describe tool for sensory details"""
         if not self.available:
             return {"success": False, "error": "AI service unavailable"}
             
         try:
-            model_config = self.models.get(model_type, self.models['balanced'])
-            
             sense_prompts = {
                 'sight': f"Add rich visual descriptions to this passage - colors, shapes, lighting, movement:\n\n{text}",
                 'sound': f"Add detailed sound descriptions to this passage - noises, music, voices, ambient sounds:\n\n{text}",
@@ -393,33 +1253,27 @@ class AIService:
             prompt = sense_prompts.get(sense_focus, sense_prompts['all'])
             system_msg = "You are a master of descriptive writing. Enhance the given text with vivid, specific sensory details."
             
-            content = ask_deepinfra(
-                prompt,
-                system_msg,
-                model=model_config['name'],
-                max_tokens=model_config['max_tokens']
-            )
+            content, used = self._routed_chat(prompt, system_msg, model_type)
             
             return {
                 "success": True,
                 "original": text,
                 "enhanced": content,
                 "sense_focus": sense_focus,
-                "model_used": model_config['display_name']
+                "model_used": self.models[used]['display_name']
             }
             
         except Exception as e:
             logging.error(f"Describe tool error: {str(e)}")
             return {"success": False, "error": f"Description error: {str(e)}"}
 
-    def sudowrite_brainstorm_tool(self, category, context="", count=10, model_type='fast'):
-        """Sudowrite-like Brainstorm tool for generating lists"""
+    @feature('brainstorm_tool')
+    def sudowrite_brainstorm_tool(self, category, context="", count=10, model_type='fast', use_cache=True):
+        """Sudowrite-like Brainstorm tool for generating lists (cached unless use_cache is False)"""
         if not self.available:
             return {"success": False, "error": "AI service unavailable"}
             
         try:
-            model_config = self.models.get(model_type, self.models['fast'])  # Use fast model for brainstorming
-            
             category_prompts = {
                 'names': f"Generate {count} unique character names for this context: {context}",
                 'plot_ideas': f"Generate {count} creative plot ideas for this context: {context}",
@@ -433,12 +1287,8 @@ class AIService:
             prompt = category_prompts.get(category, f"Generate {count} creative ideas for {category} in this context: {context}")
             system_msg = f"You are a creative brainstorming assistant. Generate exactly {count} diverse, specific, and interesting suggestions. Format as a numbered list."
             
-            content = ask_deepinfra(
-                prompt,
-                system_msg,
-                model=model_config['name'],
-                max_tokens=1000
-            )
+            content, used = self._routed_chat(prompt, system_msg, model_type, max_tokens=1000, use_cache=use_cache,
+                                              hedge=True)
             
             return {
                 "success": True,
@@ -446,7 +1296,7 @@ class AIService:
                 "context": context,
                 "suggestions": content,
                 "count": count,
-                "model_used": model_config['display_name']
+                "model_used": self.models[used]['display_name']
             }
             
         except Exception as e:
@@ -456,26 +1306,39 @@ class AIService:
 # Create a global instance
 ai_service = AIService()
 
-def generate_text_simple(prompt, model_type='balanced', pages=1):
+def generate_text_simple(prompt, model_type='balanced', pages=1, progress=None, generation_id=None):
     """
     Simplified generation function that handles both single and multi-page requests.
     This acts as a bridge between the route handlers and the AIService class.
+    A multi-page generation with a generation_id resumes from its checkpointed pages.
     """
     try:
         if pages > 1:
-            # Multi-page generation
-            # Use generate_story_with_model for better control
-            content = ai_service.generate_story_with_model(prompt, pages, model_type)
-            if content:
+            # Multi-page generation: title and pages generated concurrently
+            usage = []
+            story = ai_service.generate_titled_story(prompt, pages, model_type, progress=progress, usage=usage,
+                                                     generation_id=generation_id)
+            if story['success']:
+                # Pages the router moved to a fallback model are billed at that model's rate
+                models_used = dict(Counter(usage)) or {model_type: story['pages_billable']}
                 return {
                     "success": True, 
-                    "content": content, 
-                    "model_used": model_type
+                    "content": story['content'], 
+                    "title": story['title'],
+                    "model_used": max(models_used, key=models_used.get),
+                    "models_used": models_used,
+                    "partial": story['partial'],
+                    "pages_requested": story['pages_requested'],
+                    "pages_delivered": story['pages_delivered'],
+                    "pages_billable": story['pages_billable'],
+                    "generation_id": generation_id,
+                    "steps": story['steps']
                 }
             else:
                 return {
                     "success": False, 
-                    "error": "Failed to generate content"
+                    "error": "Failed to generate content",
+                    "steps": story.get('steps', {})
                 }
         else:
             # Single page generation
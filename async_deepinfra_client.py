@@ -0,0 +1,343 @@
+"""
+Async DeepInfra Client and Gateway for Penora
+
+AsyncDeepInfraClient is the asyncio counterpart of DeepInfraClient: one
+pooled httpx.AsyncClient, the same payloads, errors, retries and circuit
+breakers. ask_deepinfra_async is the async equivalent of ask_deepinfra.
+
+DeepInfraGateway runs an AsyncDeepInfraClient on a background event loop in
+each worker process and exposes the DeepInfraClient interface to sync code.
+Request threads only wait on a future while every in-flight LLM call is
+multiplexed over the one loop, so a gthread worker can hold hundreds of
+concurrent generations without a socket and a blocked read per call.
+
+Settings:
+- DEEPINFRA_ASYNC_GATEWAY: route AIService calls through the gateway (default: off)
+- DEEPINFRA_ASYNC_MAX_CONNECTIONS: connections the gateway keeps to DeepInfra (default: 100)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, List, Optional, AsyncIterator, Iterator
+
+import httpx
+
+from deepinfra_client import DeepInfraClient, DEEPINFRA_BASE_URL
+from llm_resilience import RetryPolicy, CircuitBreakerRegistry, CircuitOpenError, RETRYABLE_STATUS_CODES, parse_retry_after
+import request_deadline
+from request_deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONNECTIONS = 100
+
+
+def async_gateway_enabled() -> bool:
+    """Whether DEEPINFRA_ASYNC_GATEWAY asks for calls to go through the async gateway"""
+    return os.environ.get("DEEPINFRA_ASYNC_GATEWAY", "").lower() in ("1", "true", "yes")
+
+
+class AsyncDeepInfraClient:
+    """Asyncio DeepInfra chat completions client with a pooled keep-alive connection set"""
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, max_connections: Optional[int] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breakers: Optional[CircuitBreakerRegistry] = None,
+                 hedge_after: Optional[float] = None):
+        self.api_key = api_key or os.environ.get("DEEPINFRA_API_KEY")
+        self.base_url = (base_url or os.environ.get("DEEPINFRA_BASE_URL") or DEEPINFRA_BASE_URL).rstrip('/')
+        self.max_connections = int(max_connections or os.environ.get("DEEPINFRA_ASYNC_MAX_CONNECTIONS") or DEFAULT_MAX_CONNECTIONS)
+
+        self.http = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_connections
+        ))
+
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = breakers or CircuitBreakerRegistry()
+        self.hedge_after = float(hedge_after or os.environ.get("DEEPINFRA_HEDGE_AFTER", 2.0))
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+
+    def _headers(self) -> Dict[str, str]:
+        if not self.api_key:
+            raise Exception("DEEPINFRA_API_KEY environment variable not set. Please add it to Replit Secrets.")
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def _send(self, data: Dict[str, Any], headers: Dict[str, str], timeout: float, stream: bool = False,
+                    max_attempts: Optional[int] = None) -> httpx.Response:
+        """POST with the same retry, circuit breaker and deadline rules as DeepInfraClient._send"""
+        breaker = self.breakers.get(data.get("model", ""))
+        if not breaker.allow():
+            raise CircuitOpenError(f"{data.get('model')} is temporarily unavailable (circuit open)")
+
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            attempt_timeout = request_deadline.cap(timeout)
+            try:
+                request = self.http.build_request("POST", self.url, headers=headers, json=data, timeout=attempt_timeout)
+                response = await self.http.send(request, stream=stream)
+            except httpx.TimeoutException as e:
+                if attempt_timeout < timeout:
+                    raise DeadlineExceeded(f"The request's time budget ran out waiting for {data.get('model')}") from e
+                error = e
+            except httpx.TransportError as e:
+                error = e
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    breaker.record_success()
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} Server Error from {self.url}", request=request, response=response
+                )
+                await response.aclose()
+
+            breaker.record_failure()
+            if attempt >= (max_attempts or self.retry_policy.max_attempts) or not breaker.allow():
+                raise error
+
+            delay = self.retry_policy.delay(attempt, retry_after)
+            left = request_deadline.remaining()
+            if left is not None and delay >= left:
+                raise error
+            logger.warning(f"DeepInfra attempt {attempt} failed ({error}); retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def _send_hedged(self, data: Dict[str, Any], headers: Dict[str, str], timeout: float,
+                           max_attempts: Optional[int] = None) -> httpx.Response:
+        """Send a backup request if the first hasn't answered within hedge_after seconds"""
+        primary = asyncio.ensure_future(self._send(data, headers, timeout, max_attempts=max_attempts))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        pending = {primary, asyncio.ensure_future(self._send(data, headers, timeout, max_attempts=max_attempts))}
+        last_error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    last_error = task.exception()
+                    continue
+                for other in pending:
+                    other.cancel()
+                return task.result()
+        raise last_error
+
+    async def chat(self, prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+                   model: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7, top_p: float = 0.9,
+                   hedge: bool = False, usage: Optional[Dict[str, Any]] = None, max_attempts: Optional[int] = None) -> str:
+        """Async equivalent of DeepInfraClient.chat"""
+        return (await self.chat_choices(prompt, system_msg, max_tokens, model, temperature, top_p, hedge=hedge, usage=usage,
+                                        max_attempts=max_attempts))[0]
+
+    async def chat_choices(self, prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+                           model: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7, top_p: float = 0.9,
+                           n: int = 1, hedge: bool = False, usage: Optional[Dict[str, Any]] = None,
+                           max_attempts: Optional[int] = None) -> List[str]:
+        """Async equivalent of DeepInfraClient.chat_choices"""
+        headers = self._headers()
+        data = DeepInfraClient._payload(prompt, system_msg, max_tokens, model, temperature, top_p)
+        if n > 1:
+            data["n"] = n
+        timeout = DeepInfraClient._timeout(max_tokens)
+
+        try:
+            ttfb = None
+            if hedge:
+                response = await self._send_hedged(data, headers, timeout, max_attempts)
+            else:
+                # Defer reading the body so the time to the response headers can be measured
+                start = time.monotonic()
+                response = await self._send(data, headers, timeout, stream=True, max_attempts=max_attempts)
+                ttfb = time.monotonic() - start
+                try:
+                    await response.aread()
+                finally:
+                    await response.aclose()
+            response.raise_for_status()
+
+            result = response.json()
+            DeepInfraClient._fill_usage(usage, result, ttfb)
+            if "choices" in result and len(result["choices"]) > 0:
+                return [choice["message"]["content"].strip() for choice in result["choices"]]
+            else:
+                raise Exception(f"Unexpected API response format: {result}")
+
+        except httpx.HTTPError as e:
+            raise Exception(f"DeepInfra API request failed: {str(e)}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"Failed to parse DeepInfra API response: {str(e)}")
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            raise Exception(f"DeepInfra API error: {str(e)}")
+
+    async def stream_chat(self, prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+                          model: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7,
+                          top_p: float = 0.9, usage: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """Async equivalent of DeepInfraClient.stream_chat"""
+        headers = self._headers()
+        data = DeepInfraClient._payload(prompt, system_msg, max_tokens, model, temperature, top_p)
+        data["stream"] = True
+        data["stream_options"] = {"include_usage": True}
+
+        try:
+            start = time.monotonic()
+            response = await self._send(data, headers, DeepInfraClient._timeout(max_tokens), stream=True)
+            try:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    if chunk.get("usage"):
+                        DeepInfraClient._fill_usage(usage, chunk)
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            DeepInfraClient._fill_usage(usage, {}, time.monotonic() - start)
+                            yield content
+            finally:
+                await response.aclose()
+
+        except httpx.HTTPError as e:
+            raise Exception(f"DeepInfra API request failed: {str(e)}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"Failed to parse DeepInfra API response: {str(e)}")
+
+    async def aclose(self):
+        """Close all pooled connections"""
+        await self.http.aclose()
+
+
+async def ask_deepinfra_async(prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+                              model: str = "mistralai/Mistral-7B-Instruct-v0.3",
+                              client: Optional[AsyncDeepInfraClient] = None) -> str:
+    """
+    Async equivalent of ask_deepinfra.
+
+    Pass a long-lived client to reuse its connections; without one a client
+    is created and closed for this call. Recorded in llm_telemetry like ask_deepinfra.
+    """
+    from llm_telemetry import llm_telemetry
+    with llm_telemetry.track(model) as call:
+        call.started()
+        if client is not None:
+            content = await client.chat(prompt, system_msg, max_tokens=max_tokens, model=model, usage=call.usage)
+        else:
+            client = AsyncDeepInfraClient()
+            try:
+                content = await client.chat(prompt, system_msg, max_tokens=max_tokens, model=model, usage=call.usage)
+            finally:
+                await client.aclose()
+        call.estimate(prompt, system_msg, content)
+    return content
+
+
+class DeepInfraGateway:
+    """
+    Sync facade over an AsyncDeepInfraClient running on a background event loop.
+
+    Offers the same chat / chat_choices / stream_chat methods as DeepInfraClient,
+    so AIService can use either. client_class swaps in another async client
+    with the same interface (see llm_backends).
+    """
+
+    def __init__(self, client_class=None, **client_kwargs):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="deepinfra-gateway", daemon=True)
+        self._thread.start()
+        # Build the client on the loop so its connection pool belongs to it
+        self.client = self.run(self._make_client(client_class or AsyncDeepInfraClient, client_kwargs))
+
+    @staticmethod
+    async def _make_client(client_class, client_kwargs):
+        return client_class(**client_kwargs)
+
+    @property
+    def breakers(self):
+        """The wrapped client's circuit breakers (read by model_router)"""
+        return self.client.breakers
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the gateway loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def chat(self, *args, **kwargs) -> str:
+        return self.run(self.client.chat(*args, **kwargs))
+
+    def chat_choices(self, *args, **kwargs) -> List[str]:
+        return self.run(self.client.chat_choices(*args, **kwargs))
+
+    def stream_chat(self, *args, **kwargs) -> Iterator[str]:
+        """Yield fragments from the async stream as they arrive"""
+        fragments = queue.Queue()
+        done = object()
+
+        async def pump():
+            try:
+                async for fragment in self.client.stream_chat(*args, **kwargs):
+                    fragments.put(fragment)
+            except Exception as e:
+                fragments.put(e)
+            finally:
+                fragments.put(done)
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self.loop)
+        try:
+            while True:
+                item = fragments.get()
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Client went away mid-stream: stop reading from DeepInfra too
+            future.cancel()
+
+    def close(self):
+        """Close pooled connections and stop the loop"""
+        self.run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+_gateway = None
+_gateway_pid = None
+_gateway_lock = threading.Lock()
+
+
+def get_deepinfra_gateway() -> DeepInfraGateway:
+    """
+    Get the gateway for the current worker process.
+
+    Like get_deepinfra_client, it is created lazily and re-created after a
+    fork: an event loop thread does not survive into gunicorn's workers.
+    """
+    global _gateway, _gateway_pid
+    pid = os.getpid()
+    if _gateway is None or _gateway_pid != pid:
+        with _gateway_lock:
+            if _gateway is None or _gateway_pid != pid:
+                _gateway = DeepInfraGateway()
+                _gateway_pid = pid
+    return _gateway
@@ -0,0 +1,80 @@
+"""
+Load test: blocking DeepInfraClient vs the async DeepInfra gateway at equal concurrency
+
+Fires a burst of concurrent generation requests at the local stub server and
+serves it with the same number of request threads twice: each thread
+blocked on its own pooled DeepInfraClient call, then each thread waiting on
+the gateway's event loop. Running both at every --concurrency level keeps the
+thread count out of the comparison, so any difference comes from how the
+I/O is done (connections opened, per-call overhead). Request latency is
+measured from arrival, so time spent queued for a free thread counts.
+
+Usage:
+    python bench_async_gateway.py --requests 200 --latency 1.0 --concurrency 6,50,100
+"""
+
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("DEEPINFRA_API_KEY", "stub-key")
+
+from async_deepinfra_client import DeepInfraGateway
+from deepinfra_client import DeepInfraClient
+from stub_llm_server import StubLLMServer
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(client, slots, requests):
+    """Serve `requests` simultaneous arrivals with `slots` request threads"""
+    arrived = time.perf_counter()
+
+    def handle(i):
+        client.chat(f"Write a short scene number {i}")
+        return time.perf_counter() - arrived
+
+    with ThreadPoolExecutor(max_workers=slots) as pool:
+        latencies = list(pool.map(handle, range(requests)))
+    return time.perf_counter() - arrived, latencies
+
+
+def report(label, elapsed, latencies, stub):
+    print(f"{label:<34} {len(latencies) / elapsed:7.1f} req/s  "
+          f"p50 {statistics.median(latencies):6.2f}s  p95 {percentile(latencies, 95):6.2f}s  "
+          f"p99 {percentile(latencies, 99):6.2f}s  connections {stub.connections_opened}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="Concurrent generation requests in the burst")
+    parser.add_argument("--latency", type=float, default=1.0, help="Stub generation latency per call (s)")
+    parser.add_argument("--concurrency", default="6,50,100",
+                        help="Comma-separated request thread counts, each run with both clients")
+    args = parser.parse_args()
+
+    with StubLLMServer(latency=args.latency) as stub:
+        for slots in (int(n) for n in args.concurrency.split(',')):
+            stub.reset_stats()
+            client = DeepInfraClient(base_url=stub.base_url)
+            elapsed, latencies = run(client, slots, args.requests)
+            report(f"blocking client, {slots} threads", elapsed, latencies, stub)
+            client.close()
+            sync_p95 = percentile(latencies, 95)
+
+            stub.reset_stats()
+            gateway = DeepInfraGateway(base_url=stub.base_url)
+            elapsed, latencies = run(gateway, slots, args.requests)
+            report(f"async gateway, {slots} threads", elapsed, latencies, stub)
+            gateway.close()
+
+            print(f"  p95 at {slots} threads: {sync_p95:.2f}s blocking vs {percentile(latencies, 95):.2f}s gateway\n")
+
+
+if __name__ == "__main__":
+    main()
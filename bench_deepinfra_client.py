@@ -0,0 +1,68 @@
+"""
+Benchmark: pooled keep-alive DeepInfraClient vs per-call requests.post
+
+Runs a 10-page AIService.generate_titled_story against the local stub
+server twice - once opening a new connection per call (the old behaviour of
+ask_deepinfra) and once through the pooled client - and reports per-call
+latency for each.
+
+Usage:
+    python bench_deepinfra_client.py --pages 10 --handshake-latency 0.15 --latency 0.05
+"""
+
+import argparse
+import os
+import time
+
+import requests
+
+os.environ.setdefault("DEEPINFRA_API_KEY", "stub-key")
+
+from ai_service import AIService
+from deepinfra_client import DeepInfraClient
+from stub_llm_server import StubLLMServer
+
+
+class PerCallClient(DeepInfraClient):
+    """Reproduces the old ask_deepinfra behaviour: a fresh connection for every call"""
+
+    def _post(self, data, headers, timeout, **kwargs):
+        return requests.post(self.url, headers=headers, json=data, timeout=timeout, **kwargs)
+
+
+def run(service, pages):
+    start = time.perf_counter()
+    story = service.generate_titled_story("A lighthouse keeper finds a message in a bottle", pages)
+    elapsed = time.perf_counter() - start
+    if story['partial'] or not story['success']:
+        raise SystemExit("Generation failed - is the stub server reachable?")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub generation latency per call (s)")
+    parser.add_argument("--handshake-latency", type=float, default=0.15, help="Stub connection setup cost (s)")
+    args = parser.parse_args()
+
+    with StubLLMServer(latency=args.latency, handshake_latency=args.handshake_latency) as stub:
+        results = {}
+        for label, client in (("per-call requests.post", PerCallClient(base_url=stub.base_url)),
+                              ("pooled DeepInfraClient", DeepInfraClient(base_url=stub.base_url))):
+            service = AIService(client=client)
+            stub.reset_stats()
+            timings = [run(service, args.pages) for _ in range(args.rounds)]
+            best = min(timings)
+            results[label] = best
+            print(f"{label:<24} total {best:6.3f}s  per page {best / args.pages * 1000:7.1f}ms  "
+                  f"connections opened {stub.connections_opened} for {stub.requests_served} calls")
+            client.close()
+
+        saved = (results["per-call requests.post"] - results["pooled DeepInfraClient"]) / args.pages
+        print(f"\nPooling saves {saved * 1000:.1f}ms per page on a {args.pages}-page story")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: growing story_context vs StoryMemory for generate_story_chapter
+
+Writes a 30-chapter story against the local stub server twice. The first run
+grows story_context by every finished chapter, the way callers did; the
+second passes a StoryMemory. The stub charges time per prompt word
+(--prompt-latency) to emulate prefill, so prompt growth shows up as latency.
+
+Usage:
+    python bench_story_memory.py --chapters 30 --prompt-latency 0.00005
+"""
+
+import argparse
+import logging
+import os
+import time
+
+os.environ.setdefault("DEEPINFRA_API_KEY", "stub-key")
+
+from ai_service import AIService
+from deepinfra_client import DeepInfraClient
+from story_memory import StoryMemory
+from stub_llm_server import StubLLMServer
+
+PREMISE = "A lighthouse keeper discovers that the storms hitting her island are being summoned by someone she loves."
+CHAPTER_TEXT = ("Mara climbed the spiral stairs again, counting each iron step as the wind screamed against the glass. " * 30).strip()
+
+
+class RecordingClient(DeepInfraClient):
+    """Remembers the size of the last chapter prompt sent"""
+
+    def chat(self, prompt, *args, **kwargs):
+        if "Write Chapter" in prompt:
+            self.last_prompt_words = len(prompt.split())
+        return super().chat(prompt, *args, **kwargs)
+
+
+def write_story(service, client, chapters, use_memory):
+    memory = StoryMemory(PREMISE) if use_memory else None
+    story_context = PREMISE
+    rows = []
+    for chapter in range(1, chapters + 1):
+        start = time.perf_counter()
+        result = service.generate_story_chapter(story_context, chapter, chapters, memory=memory)
+        elapsed = time.perf_counter() - start
+        if not result['success']:
+            raise SystemExit(f"Chapter {chapter} failed: {result['error']}")
+        if not use_memory:
+            story_context += f"\n\nChapter {chapter}:\n{result['content']}"
+        rows.append((chapter, client.last_prompt_words, elapsed))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub base latency per call (s)")
+    parser.add_argument("--prompt-latency", type=float, default=0.00005, help="Stub seconds per prompt word")
+    args = parser.parse_args()
+
+    # The stub's canned reply isn't the JSON a real model returns, so every
+    # memory update takes the local fallback path; keep its warnings quiet
+    logging.getLogger("story_memory").setLevel(logging.ERROR)
+
+    with StubLLMServer(latency=args.latency, prompt_latency=args.prompt_latency, reply=CHAPTER_TEXT) as stub:
+        client = RecordingClient(base_url=stub.base_url)
+        service = AIService(client=client)
+        growing = write_story(service, client, args.chapters, use_memory=False)
+        memory = write_story(service, client, args.chapters, use_memory=True)
+        client.close()
+
+    print(f"{'chapter':>7}  {'growing context':>26}  {'StoryMemory (incl. update)':>28}")
+    checkpoints = sorted({1, 2, 5, 10, 20, args.chapters} & set(range(1, args.chapters + 1)))
+    for chapter in checkpoints:
+        _, g_words, g_time = growing[chapter - 1]
+        _, m_words, m_time = memory[chapter - 1]
+        print(f"{chapter:>7}  {g_words:>7} words {g_time:8.3f}s     {m_words:>7} words {m_time:8.3f}s")
+
+    last = args.chapters - 1
+    print(f"\nChapter {args.chapters} prompt is {growing[last][1] / growing[1][1]:.1f}x chapter 2's with a growing context; "
+          f"with StoryMemory no chapter prompt exceeded {max(words for _, words, _ in memory)} words")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Generation Billing for Penora
+Works out what a finished generation costs, shared by the web app and job_worker.py
+
+A generation is quoted up front from its page count and model. What is
+charged once it finishes can be lower: the model router may have fallen back
+to cheaper models, only some of the pages may have been delivered, or earlier
+runs of the same generation (resumed from generation_checkpoints) may already
+have paid for some. This module has no Flask dependency, so the job worker
+can charge for a generation without loading the web app.
+"""
+
+import math
+
+# Credit multipliers applied to page counts for each model choice
+MODEL_CREDIT_MULTIPLIERS = {
+    'creative': 1.5,
+    'balanced': 1.0,
+    'fast': 0.5,
+    'summarize': 0.3
+}
+
+
+def _checkpoints(checkpoints=None):
+    if checkpoints is None:
+        from generation_checkpoints import generation_checkpoints
+        return generation_checkpoints
+    return checkpoints
+
+
+def calculate_page_credits(page_count, model_type):
+    """Credits charged for a fresh multi-page generation with the given model"""
+    multiplier = MODEL_CREDIT_MULTIPLIERS.get(model_type, 1.0)
+    return max(1, int(page_count * multiplier))
+
+
+def credits_for_pages(quoted_credits, pages_delivered, pages_requested, already_charged=0):
+    """
+    Credits owed once pages_delivered of the requested pages have been delivered
+    over all runs of a generation: their share of the quote, less what earlier
+    runs were already charged. Shares are worked out from the running total, so
+    a generation finished over several runs costs no more than its quote.
+    """
+    if pages_delivered >= pages_requested:
+        owed = quoted_credits
+    elif pages_delivered <= 0:
+        owed = 0
+    else:
+        owed = max(1, math.ceil(quoted_credits * pages_delivered / pages_requested))
+    return max(0, owed - already_charged)
+
+
+def credits_already_charged(generation_id, checkpoints=None):
+    """Credits earlier runs of a multi-page generation were charged (see generation_checkpoints)"""
+    return _checkpoints(checkpoints).credits_charged(generation_id) if generation_id else 0
+
+
+def credits_for_generation(generation_result, quoted_credits, model_type, checkpoints=None):
+    """
+    Credits to charge for a finished generation: the quote, lowered if the model
+    router fell back to cheaper models, only some of the pages were delivered,
+    or earlier runs of the same generation were already charged for some
+    """
+    from model_router import billed_credits
+    if generation_result.get('pages_billable') is not None:
+        quoted_credits = credits_for_pages(quoted_credits, generation_result['pages_delivered'],
+                                           generation_result['pages_requested'],
+                                           credits_already_charged(generation_result.get('generation_id'), checkpoints))
+        if not quoted_credits:
+            return 0
+    return billed_credits(quoted_credits, model_type, generation_result.get('models_used') or {}, MODEL_CREDIT_MULTIPLIERS)
+
+
+def record_delivery(generation_result, credits_charged, checkpoints=None):
+    """
+    Once a generation is charged credits_charged, forget its checkpoints, or mark
+    a partial one's delivered pages paid for along with what all its runs have
+    actually been charged (after any fallback discount), so a resumed run only
+    charges the rest of the quote
+    """
+    generation_id = generation_result.get('generation_id')
+    if generation_id:
+        checkpoints = _checkpoints(checkpoints)
+        checkpoints.record_delivery(generation_id, generation_result['pages_delivered'],
+                                    generation_result['pages_requested'],
+                                    credits_already_charged(generation_id, checkpoints) + credits_charged)
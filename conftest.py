@@ -0,0 +1,24 @@
+"""
+Test isolation for the node-local SQLite stores
+
+The stores' global instances (llm_cache, llm_scheduler, llm_telemetry,
+single_flight, job_queue, generation_checkpoints, export_metrics) pick their
+paths when their modules are imported, so the data directory is pointed at a
+temporary one here, before any test module imports them.
+"""
+
+import os
+import shutil
+import tempfile
+
+STORE_DB_SETTINGS = ('LLM_CACHE_DB', 'LLM_SCHEDULER_DB', 'LLM_TELEMETRY_DB', 'SINGLE_FLIGHT_DB', 'JOB_QUEUE_DB',
+                     'GENERATION_CHECKPOINT_DB', 'EXPORT_METRICS_DB')
+
+_data_dir = tempfile.mkdtemp(prefix='penora-test-data-')
+os.environ['PENORA_DATA_DIR'] = _data_dir
+for setting in STORE_DB_SETTINGS:
+    os.environ.pop(setting, None)
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_data_dir, ignore_errors=True)
@@ -0,0 +1,23 @@
+"""
+Data Directory for Penora
+Where the node-local SQLite stores keep their files
+
+The LLM cache, scheduler, telemetry, job queue, single-flight, generation
+checkpoint and export metrics stores each default to a file in one data
+directory, created on first use, instead of scattering them over whatever
+directory the process was started from. Each store's own *_DB setting
+still overrides its path.
+
+Settings:
+- PENORA_DATA_DIR: directory holding the stores' SQLite files (default: the current directory)
+"""
+
+import os
+
+
+def data_path(filename: str) -> str:
+    """Path of filename in the data directory, creating the directory if needed"""
+    directory = os.environ.get("PENORA_DATA_DIR", "")
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, filename)
@@ -7,17 +7,367 @@ using the mistralai/Mistral-7B-Instruct-v0.3 model.
 Setup:
 - Add DEEPINFRA_API_KEY to your Replit Secrets with your DeepInfra API key
 - The key can be obtained from https://deepinfra.com/
+
+Optional settings:
+- DEEPINFRA_BASE_URL: OpenAI-compatible base URL (default: https://api.deepinfra.com/v1/openai)
+- DEEPINFRA_POOL_SIZE: keep-alive connections held per worker (default: 10)
+- DEEPINFRA_HEDGE_AFTER: seconds before a hedged call sends its backup request (default: 2)
+- Retry and circuit breaker settings are documented in llm_resilience
+- Timeouts and retries never outlast the calling request's deadline (see request_deadline)
 """
 
 import os
+import threading
+import time
+import logging
+import contextvars
 import requests
 import json
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional
+
+from llm_resilience import RetryPolicy, CircuitBreakerRegistry, CircuitOpenError, RETRYABLE_STATUS_CODES, parse_retry_after
+import request_deadline
+from request_deadline import DeadlineExceeded
+
+logger = logging.getLogger(__name__)
+
+
+DEEPINFRA_BASE_URL = "https://api.deepinfra.com/v1/openai"
+DEFAULT_POOL_SIZE = 10
+
+
+class DeepInfraClient:
+    """
+    Pooled keep-alive client for DeepInfra's chat completions API.
+    
+    One instance is shared by every request handled in a worker process, so
+    repeated calls reuse open connections instead of paying a DNS lookup,
+    TCP connect and TLS handshake each time.
+    """
+    
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, pool_size: Optional[int] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breakers: Optional[CircuitBreakerRegistry] = None,
+                 hedge_after: Optional[float] = None):
+        self.api_key = api_key or os.environ.get("DEEPINFRA_API_KEY")
+        self.base_url = (base_url or os.environ.get("DEEPINFRA_BASE_URL") or DEEPINFRA_BASE_URL).rstrip('/')
+        self.pool_size = int(pool_size or os.environ.get("DEEPINFRA_POOL_SIZE") or DEFAULT_POOL_SIZE)
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        # Resilience: retries with backoff, per-model circuit breakers and hedged requests
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.breakers = breakers or CircuitBreakerRegistry()
+        self.hedge_after = float(hedge_after or os.environ.get("DEEPINFRA_HEDGE_AFTER", 2.0))
+        self._hedge_pool = None
+        self._hedge_lock = threading.Lock()
+    
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/chat/completions"
+    
+    def _headers(self) -> Dict[str, str]:
+        if not self.api_key:
+            raise Exception("DEEPINFRA_API_KEY environment variable not set. Please add it to Replit Secrets.")
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+    
+    def _post(self, data: Dict[str, Any], headers: Dict[str, str], timeout: float, **kwargs) -> requests.Response:
+        """Send a request over the pooled session"""
+        return self.session.post(self.url, headers=headers, json=data, timeout=timeout, **kwargs)
+    
+    def _send(self, data: Dict[str, Any], headers: Dict[str, str], timeout: float, max_attempts: Optional[int] = None,
+              **kwargs) -> requests.Response:
+        """
+        POST with retries and the model's circuit breaker.
+        
+        Timeouts, connection errors, 429 and 5xx responses are retried with
+        jittered exponential backoff (or the provider's Retry-After), up to
+        max_attempts times (default: the retry policy's). While the
+        model's breaker is open, calls fail fast with CircuitOpenError. Each
+        attempt's timeout is capped at the request deadline, and no retry is
+        started that the deadline would cut short. An attempt that times out
+        only because the deadline shortened it raises DeadlineExceeded and
+        isn't held against the model's breaker.
+        """
+        breaker = self.breakers.get(data.get("model", ""))
+        if not breaker.allow():
+            raise CircuitOpenError(f"{data.get('model')} is temporarily unavailable (circuit open)")
+        
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            attempt_timeout = request_deadline.cap(timeout)
+            try:
+                response = self._post(data, headers, attempt_timeout, **kwargs)
+            except requests.exceptions.Timeout as e:
+                if attempt_timeout < timeout:
+                    raise DeadlineExceeded(f"The request's time budget ran out waiting for {data.get('model')}") from e
+                error = e
+            except requests.exceptions.ConnectionError as e:
+                error = e
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    # Anything else (success or a client error) means the provider is up
+                    breaker.record_success()
+                    return response
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                error = requests.exceptions.HTTPError(
+                    f"{response.status_code} Server Error from {self.url}", response=response
+                )
+                response.close()
+            
+            breaker.record_failure()
+            if attempt >= (max_attempts or self.retry_policy.max_attempts) or not breaker.allow():
+                raise error
+            
+            delay = self.retry_policy.delay(attempt, retry_after)
+            left = request_deadline.remaining()
+            if left is not None and delay >= left:
+                raise error
+            logger.warning(f"DeepInfra attempt {attempt} failed ({error}); retrying in {delay:.2f}s")
+            time.sleep(delay)
+    
+    def _send_hedged(self, data: Dict[str, Any], headers: Dict[str, str], timeout: float,
+                     max_attempts: Optional[int] = None) -> requests.Response:
+        """
+        Hedged request: if the first call hasn't answered within hedge_after
+        seconds, send an identical backup and use whichever succeeds first.
+        Meant for short calls (titles, brainstorms) where tail latency dominates.
+        """
+        with self._hedge_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="deepinfra-hedge")
+        
+        # Both requests run in the caller's context so they keep its deadline
+        primary = self._hedge_pool.submit(contextvars.copy_context().run, self._send, data, headers, timeout, max_attempts)
+        try:
+            return primary.result(timeout=self.hedge_after)
+        except FutureTimeoutError:
+            pass
+        
+        backup = self._hedge_pool.submit(contextvars.copy_context().run, self._send, data, headers, timeout, max_attempts)
+        pending = {primary, backup}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                # Release the loser's connection whenever it finishes
+                for other in pending:
+                    other.add_done_callback(lambda f: f.exception() is None and f.result().close())
+                return response
+        raise last_error
+    
+    @staticmethod
+    def _payload(prompt: str, system_msg: str, max_tokens: int, model: str, temperature: float, top_p: float) -> Dict[str, Any]:
+        return {
+            "model": model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_msg
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p
+        }
+    
+    @staticmethod
+    def _fill_usage(usage: Optional[Dict[str, Any]], result: Dict[str, Any], ttfb: Optional[float] = None):
+        """Copy the token counts the provider reported (and the time to first byte) into a caller's usage dict"""
+        if usage is None:
+            return
+        counts = result.get("usage") or {}
+        for key in ("prompt_tokens", "completion_tokens"):
+            if counts.get(key) is not None:
+                usage[key] = counts[key]
+        if ttfb is not None:
+            usage.setdefault("ttfb", ttfb)
+    
+    @staticmethod
+    def _timeout(max_tokens: int) -> float:
+        # Increase timeout for large requests, within whatever is left of the request's deadline
+        return request_deadline.cap(120 if max_tokens and max_tokens > 4000 else 60)
+    
+    def chat(self, prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+             model: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7, top_p: float = 0.9,
+             hedge: bool = False, usage: Optional[Dict[str, Any]] = None, max_attempts: Optional[int] = None) -> str:
+        """
+        Send a prompt to the chat completions API.
+        
+        Args:
+            prompt (str): The user prompt to send to the AI
+            system_msg (str): System message to set AI behavior
+            max_tokens (int): Maximum tokens to generate (default: 2500)
+            model (str): Model name to use
+            temperature (float): Sampling temperature
+            top_p (float): Nucleus sampling cutoff
+            hedge (bool): Send a backup request if the first is slow (short calls only)
+            usage (dict): Filled with prompt_tokens, completion_tokens and ttfb (seconds) when given
+            max_attempts (int): HTTP attempts before giving up (default: the retry policy's; 1 when
+                the caller retries on its own)
+        
+        Returns:
+            str: The AI's response text
+        
+        Raises:
+            Exception: If API call fails or returns an error
+        """
+        return self.chat_choices(prompt, system_msg, max_tokens, model, temperature, top_p, hedge=hedge, usage=usage,
+                                 max_attempts=max_attempts)[0]
+    
+    def chat_choices(self, prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+                     model: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7, top_p: float = 0.9,
+                     n: int = 1, hedge: bool = False, usage: Optional[Dict[str, Any]] = None,
+                     max_attempts: Optional[int] = None) -> List[str]:
+        """
+        Request one or more completions for the same prompt in a single API call.
+        
+        With n > 1 the API's `n` parameter is used, so every choice is sampled
+        server-side from one request. Only use it for models that support it
+        (see `supports_n` in DEEPINFRA_MODELS). A usage dict is filled with the
+        provider's token counts and, for unhedged calls, the time to first byte.
+        
+        Returns:
+            List[str]: The response text of each returned choice, in order
+        
+        Raises:
+            Exception: If API call fails or returns an error
+        """
+        headers = self._headers()
+        data = self._payload(prompt, system_msg, max_tokens, model, temperature, top_p)
+        if n > 1:
+            data["n"] = n
+        
+        try:
+            ttfb = None
+            if hedge:
+                response = self._send_hedged(data, headers, self._timeout(max_tokens), max_attempts)
+            else:
+                # Defer reading the body so the time to the response headers can be measured
+                start = time.monotonic()
+                response = self._send(data, headers, self._timeout(max_tokens), max_attempts, stream=True)
+                ttfb = time.monotonic() - start
+            with response:
+                response.raise_for_status()
+                result = response.json()
+            self._fill_usage(usage, result, ttfb)
+            
+            if "choices" in result and len(result["choices"]) > 0:
+                return [choice["message"]["content"].strip() for choice in result["choices"]]
+            else:
+                raise Exception(f"Unexpected API response format: {result}")
+                
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"DeepInfra API request failed: {str(e)}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"Failed to parse DeepInfra API response: {str(e)}")
+        except (CircuitOpenError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            raise Exception(f"DeepInfra API error: {str(e)}")
+    
+    def stream_chat(self, prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500,
+                    model: str = "mistralai/Mistral-7B-Instruct-v0.3", temperature: float = 0.7, top_p: float = 0.9,
+                    usage: Optional[Dict[str, Any]] = None):
+        """
+        Stream a chat completion, yielding text fragments as the provider emits them.
+        
+        Uses the API's `stream: true` mode (server-sent events), so the first words
+        are available long before the whole completion has been generated.
+        A usage dict gets the seconds to the first fragment as ttfb, and the
+        token counts from the final chunk once the stream is exhausted.
+        
+        Yields:
+            str: Content deltas in order
+        
+        Raises:
+            Exception: If API call fails or returns an error
+        """
+        headers = self._headers()
+        data = self._payload(prompt, system_msg, max_tokens, model, temperature, top_p)
+        data["stream"] = True
+        # Ask for a final chunk carrying the token counts
+        data["stream_options"] = {"include_usage": True}
+        
+        try:
+            start = time.monotonic()
+            response = self._send(data, headers, self._timeout(max_tokens), stream=True)
+            with response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    # SSE frames look like "data: {...}"; blank lines separate events
+                    if not line or not line.startswith(b"data:"):
+                        continue
+                    payload = line[5:].strip()
+                    if payload == b"[DONE]":
+                        break
+                    
+                    chunk = json.loads(payload.decode("utf-8"))
+                    if chunk.get("usage"):
+                        self._fill_usage(usage, chunk)
+                    choices = chunk.get("choices") or []
+                    if choices:
+                        delta = (choices[0].get("delta") or {}).get("content")
+                        if delta:
+                            self._fill_usage(usage, {}, time.monotonic() - start)
+                            yield delta
+                            
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"DeepInfra API request failed: {str(e)}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"Failed to parse DeepInfra API response: {str(e)}")
+    
+    def close(self):
+        """Close all pooled connections"""
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_deepinfra_client() -> DeepInfraClient:
+    """
+    Get the DeepInfra client for the current worker process.
+    
+    The client is created lazily and re-created after a fork, so gunicorn
+    workers never share sockets inherited from the master process.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = DeepInfraClient()
+                _client_pid = pid
+    return _client
 
 
 def ask_deepinfra(prompt: str, system_msg: str = "You are a helpful assistant.", max_tokens: int = 2500, model: str = "mistralai/Mistral-7B-Instruct-v0.3") -> str:
     """
     Send a prompt to DeepInfra's chat completions API.
+    The call's latency and token usage are recorded in llm_telemetry.
     
     Args:
         prompt (str): The user prompt to send to the AI
@@ -30,84 +380,70 @@ def ask_deepinfra(prompt: str, system_msg: str = "You are a helpful assistant.",
     Raises:
         Exception: If API call fails or returns an error
     """
-    api_key = os.environ.get("DEEPINFRA_API_KEY")
-    if not api_key:
-        raise Exception("DEEPINFRA_API_KEY environment variable not set. Please add it to Replit Secrets.")
-    
-    url = "https://api.deepinfra.com/v1/openai/chat/completions"
-    
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
-    
-    data = {
-        "model": model,
-        "messages": [
-            {
-                "role": "system",
-                "content": system_msg
-            },
-            {
-                "role": "user", 
-                "content": prompt
-            }
-        ],
-        "max_tokens": max_tokens,
-        "temperature": 0.7,
-        "top_p": 0.9
-    }
-    
-    try:
-        # Increase timeout for large requests
-        timeout = 120 if max_tokens and max_tokens > 4000 else 60
-        response = requests.post(url, headers=headers, json=data, timeout=timeout)
-        response.raise_for_status()
-        
-        result = response.json()
-        
-        if "choices" in result and len(result["choices"]) > 0:
-            return result["choices"][0]["message"]["content"].strip()
-        else:
-            raise Exception(f"Unexpected API response format: {result}")
-            
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"DeepInfra API request failed: {str(e)}")
-    except json.JSONDecodeError as e:
-        raise Exception(f"Failed to parse DeepInfra API response: {str(e)}")
-    except Exception as e:
-        raise Exception(f"DeepInfra API error: {str(e)}")
+    from llm_telemetry import llm_telemetry
+    with llm_telemetry.track(model) as call:
+        call.started()
+        content = get_deepinfra_client().chat(prompt, system_msg, max_tokens=max_tokens, model=model, usage=call.usage)
+        call.estimate(prompt, system_msg, content)
+    return content
 
 
 # Model Configurations
+# max_concurrency caps how many requests one generation may have in flight
+# against a model at once (keeps page fan-out inside provider rate limits);
+# supports_n marks models that honour the API's `n` parameter for multiple choices;
+# context_tokens is the model's context window (prompt + reply), used to size file chunks;
+# fallback is the faster/cheaper model model_router switches to when this one is slow or failing;
+# backend is the server that runs the model (see llm_backends)
 DEEPINFRA_MODELS = {
     'balanced': {
         'name': 'mistralai/Mistral-7B-Instruct-v0.3',
         'display_name': 'Mistral 7B (Balanced)',
         'description': 'Good balance of speed and quality',
         'max_tokens': 2500,
-        'cost_multiplier': 1.0
+        'cost_multiplier': 1.0,
+        'max_concurrency': 4,
+        'supports_n': True,
+        'context_tokens': 32768,
+        # 'fast' is the same model with a smaller budget, so it can't stand in for this one
+        'fallback': None,
+        'backend': 'deepinfra'
     },
     'creative': {
         'name': 'mistralai/Mixtral-8x7B-Instruct-v0.1',
         'display_name': 'Mixtral 8x7B (Creative)',
         'description': 'Better for creative writing and stories',
         'max_tokens': 4000,
-        'cost_multiplier': 2.0
+        'cost_multiplier': 2.0,
+        'max_concurrency': 3,
+        'supports_n': False,
+        'context_tokens': 32768,
+        'fallback': 'balanced',
+        'backend': 'deepinfra'
     },
     'fast': {
         'name': 'mistralai/Mistral-7B-Instruct-v0.3',
         'display_name': 'Mistral 7B (Fast)',
         'description': 'Fastest generation for simple tasks',
         'max_tokens': 1000,
-        'cost_multiplier': 0.5
+        'cost_multiplier': 0.5,
+        'max_concurrency': 6,
+        'supports_n': True,
+        'context_tokens': 32768,
+        'fallback': None,
+        'backend': 'deepinfra'
     },
     'smart': {
         'name': 'meta-llama/Meta-Llama-3-70B-Instruct',
         'display_name': 'Llama 3 70B (Smart)',
         'description': 'Highest quality for complex instructions',
         'max_tokens': 4000,
-        'cost_multiplier': 3.0
+        'cost_multiplier': 3.0,
+        'max_concurrency': 2,
+        'supports_n': False,
+        'context_tokens': 8192,
+        'fallback': 'balanced',
+        'backend': 'deepinfra'
     }
 }
 
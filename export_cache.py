@@ -0,0 +1,145 @@
+"""
+Export Artifact Cache for Penora
+Keeps rendered PDF, DOCX and TXT downloads on disk so a repeat download is a streamed file read
+
+Artifacts are keyed by their owner (a workspace project code or a
+generation id), a hash of the title and content they were rendered from,
+and the format, so an edited project can never be served a stale file.
+WorkspaceProject.update_content and soft_delete drop the project's
+artifacts straight away; anything else ages out of the size-bounded LRU.
+Files live in one directory shared by every gunicorn worker on the node
+and are written atomically; a PDF is rendered straight into its cache file.
+
+Settings:
+- EXPORT_CACHE_DIR: directory holding the artifacts (default: penora_export_cache in the temp dir)
+- EXPORT_CACHE_MAX_MB: total size kept before least recently used artifacts are evicted (default: 500)
+"""
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+from typing import Any, BinaryIO, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ExportArtifactCache:
+    """Size-bounded LRU of rendered export files on local disk"""
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get("EXPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "penora_export_cache")
+        self.max_bytes = int(max_bytes or float(os.environ.get("EXPORT_CACHE_MAX_MB", 500)) * 1024 * 1024)
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def _owner(owner) -> str:
+        return re.sub(r'[^A-Za-z0-9_]', '_', str(owner))
+
+    @classmethod
+    def make_key(cls, owner, title: str, content: str, format: str) -> str:
+        """Artifact key: owner, then a hash of what is rendered, then the format"""
+        digest = hashlib.sha256(f"{title}\0{content}".encode('utf-8')).hexdigest()[:32]
+        return f"{cls._owner(owner)}-{digest}.{format}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key: str) -> bool:
+        """Whether the artifact is cached, without counting as a use"""
+        return os.path.exists(self._path(key))
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """The cached artifact opened for reading (so it can be streamed), or None on a miss"""
+        path = self._path(key)
+        try:
+            artifact = open(path, 'rb')
+            # The modification time doubles as the LRU clock
+            os.utime(path)
+            return artifact
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Export cache read failed for {key}: {e}")
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        """The cached artifact's bytes, or None on a miss"""
+        artifact = self.open(key)
+        if artifact is None:
+            return None
+        with artifact:
+            return artifact.read()
+
+    def write(self, key: str, render: Callable[[BinaryIO], Any]) -> BinaryIO:
+        """
+        Store the artifact render(file) writes straight into the cache and
+        return it opened for reading. Raises OSError if the cache can't be
+        written, and whatever render raises.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.tmp-')
+        os.close(fd)
+        artifact = None
+        try:
+            # Opened by path, so render can hand the file's name to another process
+            with open(tmp_path, 'wb') as f:
+                render(f)
+            # Opened before it can be evicted; an open file survives its removal
+            artifact = open(tmp_path, 'rb')
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if artifact is not None:
+                artifact.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._evict()
+        return artifact
+
+    def put(self, key: str, data: bytes):
+        """Store an artifact, evicting the least recently used ones past the size limit"""
+        try:
+            self.write(key, lambda f: f.write(data)).close()
+        except OSError as e:
+            logger.warning(f"Export cache write failed for {key}: {e}")
+
+    def invalidate(self, owner):
+        """Drop every artifact rendered for owner"""
+        prefix = f"{self._owner(owner)}-"
+        try:
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(prefix):
+                    try:
+                        os.remove(self._path(name))
+                    except FileNotFoundError:
+                        pass
+        except OSError as e:
+            logger.warning(f"Export cache invalidation failed for {owner}: {e}")
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.cache_dir):
+                if entry.is_file() and not entry.name.startswith('.tmp-'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Evicted or invalidated by another worker meanwhile
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+
+# Global instance
+export_cache = ExportArtifactCache()
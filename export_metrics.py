@@ -0,0 +1,126 @@
+"""
+Export Metrics for Penora
+Per-format export cache hit rates and pre-render outcomes
+
+Every download counts as a hit (served from the export cache) or a miss
+(rendered while the user waited), by format; every background pre-render
+(see export_prerender) counts as rendered, failed or dropped. Comparing a
+format's hit rate with pre-rendering on and off, and the number of
+pre-renders against the hits they bought, shows whether pre-rendering a
+format pays for its CPU. Counts live in SQLite so every worker on the node
+adds to the same figures, and are exposed on /metrics and /metrics/exports.
+Recording never raises.
+
+Settings:
+- EXPORT_METRICS_DB: SQLite file shared by the workers (default: export_metrics.db in PENORA_DATA_DIR)
+- METRICS_TOKEN: bearer token the metrics endpoints require; they are off when unset (see routes.require_metrics_token)
+"""
+
+import sqlite3
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any
+
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+HIT = 'hit'
+MISS = 'miss'
+PRERENDERED = 'prerendered'
+PRERENDER_FAILED = 'prerender_failed'
+PRERENDER_DROPPED = 'prerender_dropped'
+
+DOWNLOAD_EVENTS = (HIT, MISS)
+PRERENDER_EVENTS = (PRERENDERED, PRERENDER_FAILED, PRERENDER_DROPPED)
+
+
+class ExportMetrics:
+    """SQLite counters of export downloads and pre-renders by format"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get("EXPORT_METRICS_DB") or data_path("export_metrics.db")
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.execute('PRAGMA synchronous=NORMAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize export metrics schema"""
+        try:
+            with self.get_db_connection() as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS export_events (
+                        format TEXT NOT NULL,
+                        event TEXT NOT NULL,
+                        count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (format, event)
+                    )
+                """)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Export metrics initialization error: {e}")
+
+    def record(self, format: str, event: str):
+        """Count one download (HIT, MISS) or pre-render (PRERENDERED, PRERENDER_FAILED, PRERENDER_DROPPED)"""
+        try:
+            with self.get_db_connection() as conn:
+                conn.execute("""
+                    INSERT INTO export_events (format, event, count) VALUES (?, ?, 1)
+                    ON CONFLICT(format, event) DO UPDATE SET count = count + 1
+                """, (format, event))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to record export metric: {e}")
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """{format: {event: count, ..., 'hit_rate'}} with the hit rate of its downloads (None before any)"""
+        with self.get_db_connection() as conn:
+            rows = conn.execute("SELECT format, event, count FROM export_events").fetchall()
+
+        formats = {}
+        for format, event, count in rows:
+            formats.setdefault(format, {name: 0 for name in DOWNLOAD_EVENTS + PRERENDER_EVENTS})[event] = count
+        for counts in formats.values():
+            downloads = counts[HIT] + counts[MISS]
+            counts['hit_rate'] = round(counts[HIT] / downloads, 3) if downloads else None
+        return dict(sorted(formats.items()))
+
+    def render_prometheus(self) -> str:
+        """Download and pre-render counters in the Prometheus text exposition format"""
+        summary = self.summary()
+        counters = (
+            ('penora_export_downloads_total', 'Export downloads by format and cache outcome', 'cache', DOWNLOAD_EVENTS),
+            ('penora_export_prerenders_total', 'Background export pre-renders by format and outcome', 'outcome', PRERENDER_EVENTS)
+        )
+        lines = []
+        for name, help_text, label, events in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for format, counts in summary.items():
+                for event in events:
+                    value = event.replace('prerender_', '') if label == 'outcome' else event
+                    lines.append(f'{name}{{format="{format}",{label}="{value}"}} {counts[event]}')
+        return '\n'.join(lines) + '\n'
+
+
+# Global instance
+export_metrics = ExportMetrics()
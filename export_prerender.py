@@ -0,0 +1,129 @@
+"""
+Export Pre-rendering for Penora
+Renders a project's usual download formats into the export cache as soon as it is saved
+
+Most users download a project shortly after saving or updating it. With
+pre-rendering on, WorkspaceService.save_generation and update_project hand
+the saved project to a background thread, which renders each configured
+format through the render pool into the export cache, so the first
+download is a cache hit instead of a render. Saves of the same project
+waiting to be pre-rendered are coalesced into the latest one, and at most
+EXPORT_PRERENDER_QUEUE projects wait; past that, saves are not pre-rendered.
+Hits, misses and pre-render outcomes per format are counted by
+export_metrics, to show which formats are worth pre-rendering.
+
+Each gunicorn worker process runs its own pre-render thread.
+
+Settings:
+- EXPORT_PRERENDER_FORMATS: comma-separated formats rendered after each save, e.g. pdf,docx (default: none, off)
+- EXPORT_PRERENDER_QUEUE: projects waiting to be pre-rendered before new saves are skipped (default: 100)
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from export_cache import export_cache
+from export_metrics import export_metrics, PRERENDERED, PRERENDER_FAILED, PRERENDER_DROPPED
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('pdf', 'docx', 'txt')
+
+
+class ExportPrerenderer:
+    """Background thread pre-rendering saved projects into the export cache"""
+
+    def __init__(self, formats=None, max_queued=None, cache=None, pool=None, metrics=None):
+        if formats is None:
+            formats = [name.strip() for name in os.environ.get("EXPORT_PRERENDER_FORMATS", "").split(',') if name.strip()]
+        unknown = [name for name in formats if name not in FORMATS]
+        if unknown:
+            logger.warning(f"Ignoring unknown EXPORT_PRERENDER_FORMATS {unknown}")
+        self.formats = [name for name in formats if name in FORMATS]
+        self.max_queued = int(max_queued or os.environ.get("EXPORT_PRERENDER_QUEUE", 100))
+        self.cache = cache or export_cache
+        self.metrics = metrics or export_metrics
+        self._pool = pool
+        # owner -> (title, content) of its latest save, oldest first
+        self._pending = OrderedDict()
+        self._busy = False
+        self._cond = threading.Condition()
+        self._thread = None
+        self._thread_pid = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            from render_pool import render_pool
+            self._pool = render_pool
+        return self._pool
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.formats)
+
+    def schedule(self, owner, title: str, content: str) -> bool:
+        """
+        Queue title and content, as saved for owner, to be pre-rendered in
+        every configured format; True if queued. Never raises.
+        """
+        if not self.enabled:
+            return False
+        try:
+            with self._cond:
+                if owner not in self._pending and len(self._pending) >= self.max_queued:
+                    for format in self.formats:
+                        self.metrics.record(format, PRERENDER_DROPPED)
+                    logger.warning(f"Pre-render queue full, not pre-rendering {owner}")
+                    return False
+                self._pending[owner] = (title, content)
+                self._ensure_thread()
+                self._cond.notify()
+            return True
+        except Exception as e:
+            logger.error(f"Failed to queue pre-render for {owner}: {e}")
+            return False
+
+    def _ensure_thread(self):
+        # Started on first use, and again in a forked gunicorn worker
+        pid = os.getpid()
+        if self._thread is None or self._thread_pid != pid or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='export-prerender', daemon=True)
+            self._thread_pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._busy = False
+                    self._cond.notify_all()
+                    self._cond.wait()
+                owner, (title, content) = self._pending.popitem(last=False)
+                self._busy = True
+            self.prerender(owner, title, content)
+
+    def prerender(self, owner, title: str, content: str):
+        """Render title and content into the export cache in every configured format not already there"""
+        for format in self.formats:
+            key = self.cache.make_key(owner, title, content, format)
+            if self.cache.contains(key):
+                continue
+            try:
+                self.cache.write(key, lambda output: self.pool.render(format, title, content, output)).close()
+                self.metrics.record(format, PRERENDERED)
+            except Exception as e:
+                self.metrics.record(format, PRERENDER_FAILED)
+                logger.warning(f"Pre-rendering {format.upper()} for {owner} failed: {e}")
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every queued save is pre-rendered; False if timeout ran out first"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout)
+
+
+# Global instance
+export_prerenderer = ExportPrerenderer()
@@ -24,31 +24,9 @@ class ExportService:
     def create_doc_file(self, title, content, chapters=None):
         """Create a .docx file from story content"""
         try:
-            doc = Document()
-            
-            # Add title
-            title_paragraph = doc.add_heading(title, 0)
-            title_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            
-            # Add metadata
-            doc.add_paragraph(f"Generated on: {datetime.now().strftime('%B %d, %Y')}")
-            doc.add_paragraph("Created with Penora AI")
-            doc.add_paragraph().add_run().add_break()
-            
-            if chapters:
-                # Multi-chapter story
-                for i, chapter in enumerate(chapters, 1):
-                    doc.add_heading(f"Chapter {i}", level=1)
-                    doc.add_paragraph(chapter)
-                    doc.add_paragraph().add_run().add_break()
-            else:
-                # Single content
-                doc.add_paragraph(content)
-            
             # Save to bytes
             doc_io = io.BytesIO()
-            doc.save(doc_io)
-            doc_io.seek(0)
+            self.write_doc_file(title, content, doc_io, chapters)
             
             return {
                 'success': True,
@@ -62,6 +40,31 @@ class ExportService:
                 'error': str(e)
             }
     
+    def write_doc_file(self, title, content, output, chapters=None):
+        """Render story content as a .docx straight into output, any writable binary file object"""
+        doc = Document()
+        
+        # Add title
+        title_paragraph = doc.add_heading(title, 0)
+        title_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        
+        # Add metadata
+        doc.add_paragraph(f"Generated on: {datetime.now().strftime('%B %d, %Y')}")
+        doc.add_paragraph("Created with Penora AI")
+        doc.add_paragraph().add_run().add_break()
+        
+        if chapters:
+            # Multi-chapter story
+            for i, chapter in enumerate(chapters, 1):
+                doc.add_heading(f"Chapter {i}", level=1)
+                doc.add_paragraph(chapter)
+                doc.add_paragraph().add_run().add_break()
+        else:
+            # Single content
+            doc.add_paragraph(content)
+        
+        doc.save(output)
+    
     def create_txt_file(self, title, content, chapters=None):
         """Create a plain text file from story content"""
         try:
@@ -5,6 +5,7 @@ Analyzes uploaded files and determines page count for credit calculation
 
 import logging
 import os
+import re
 import tempfile
 from io import BytesIO
 from docx import Document
@@ -335,6 +336,70 @@ class FileAnalyzer:
                 'pages': 0
             }
     
+    @staticmethod
+    def split_into_chunks(content, max_words):
+        """
+        Split extracted text into chunks of at most max_words words.
+        Chunks break on paragraph boundaries (blank lines), keeping the line
+        breaks inside a paragraph, so scripts, poems and lists keep their
+        layout. A paragraph that is too long on its own is broken between
+        lines, a line that is too long on sentence boundaries, and as a last
+        resort on words.
+        """
+        paragraphs = [p.strip() for p in re.split(r'\n\s*\n', content or '') if p.strip()]
+        
+        pieces = []
+        for paragraph in paragraphs:
+            if len(paragraph.split()) <= max_words:
+                pieces.append(paragraph)
+                continue
+            line_group = []
+            group_words = 0
+            for line in paragraph.split('\n'):
+                for part in FileAnalyzer._split_line(line, max_words):
+                    part_words = len(part.split())
+                    if line_group and group_words + part_words > max_words:
+                        pieces.append('\n'.join(line_group))
+                        line_group, group_words = [], 0
+                    line_group.append(part)
+                    group_words += part_words
+            if line_group:
+                pieces.append('\n'.join(line_group))
+        
+        chunks = []
+        current = []
+        current_words = 0
+        for piece in pieces:
+            piece_words = len(piece.split())
+            if current and current_words + piece_words > max_words:
+                chunks.append('\n\n'.join(current))
+                current, current_words = [], 0
+            current.append(piece)
+            current_words += piece_words
+        if current:
+            chunks.append('\n\n'.join(current))
+        return chunks
+    
+    @staticmethod
+    def _split_line(line, max_words):
+        """A line as-is when it fits in max_words, else broken on sentences, then on words"""
+        if len(line.split()) <= max_words:
+            return [line]
+        parts = []
+        sentence_group = []
+        for sentence in re.split(r'(?<=[.!?])\s+', line.strip()):
+            words = sentence.split()
+            while len(words) > max_words:
+                parts.append(' '.join(words[:max_words]))
+                words = words[max_words:]
+            if len(sentence_group) + len(words) > max_words:
+                parts.append(' '.join(sentence_group))
+                sentence_group = []
+            sentence_group.extend(words)
+        if sentence_group:
+            parts.append(' '.join(sentence_group))
+        return parts
+    
     @staticmethod
     def get_supported_formats():
         """Get list of supported file formats"""
@@ -0,0 +1,196 @@
+"""
+Generation Checkpoints for Penora
+Keeps every finished page of a multi-page generation so a failed run can resume
+
+Each page is stored as soon as it is generated, under a generation id hashed
+from the user, prompt, page count and model. When a run fails part-way or
+runs out of time, the user gets the unbroken run of pages finished so far and
+is charged for those only; submitting the same generation again reuses the
+stored pages and only generates (and charges for) the missing ones. Pages
+are marked billed once charged, together with the credits charged for the
+generation so far, so a later run charges only the rest of the quote and
+all runs together never cost more than one complete run. A long story's
+outline is kept with its pages (as page 0), so a resumed run expands the
+missing pages from the same plan. A generation's pages are dropped once
+all of them have been delivered.
+
+Settings:
+- GENERATION_CHECKPOINT_DB: SQLite file shared by the workers (default: generation_checkpoints.db in PENORA_DATA_DIR)
+- GENERATION_CHECKPOINT_TTL: seconds an unfinished generation's pages are kept (default: 86400)
+"""
+
+import sqlite3
+import logging
+import hashlib
+import json
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+# Page number a long story's outline is stored under
+OUTLINE_PAGE = 0
+
+
+class GenerationCheckpoints:
+    """SQLite store of the finished pages of multi-page generations"""
+
+    def __init__(self, db_path=None, ttl_seconds=None):
+        self.db_path = db_path or os.environ.get("GENERATION_CHECKPOINT_DB") or data_path("generation_checkpoints.db")
+        self.ttl_seconds = int(ttl_seconds or os.environ.get("GENERATION_CHECKPOINT_TTL", 86400))
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize checkpoint schema"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS generation_pages (
+                        generation_id TEXT NOT NULL,
+                        page_number INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        model_type TEXT,
+                        billed INTEGER DEFAULT 0,
+                        created_at REAL NOT NULL,
+                        PRIMARY KEY (generation_id, page_number)
+                    )
+                """)
+
+                # Credits charged so far for the delivered pages of a partly delivered generation
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS generation_charges (
+                        generation_id TEXT PRIMARY KEY,
+                        credits INTEGER NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_generation_pages_created ON generation_pages(created_at)")
+                conn.commit()
+
+        except Exception as e:
+            logger.error(f"Generation checkpoint initialization error: {e}")
+
+    @staticmethod
+    def make_id(user_id, prompt: str, page_count: int, model_type: str) -> str:
+        """Generation id shared by every run of the same generation for a user"""
+        raw = json.dumps([str(user_id), prompt, int(page_count), model_type])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def save_page(self, generation_id: str, page_number: int, content: str, model_type: Optional[str] = None):
+        """Store a finished page; a page already stored (and perhaps billed) is kept"""
+        try:
+            with self.get_db_connection() as conn:
+                conn.execute("""
+                    INSERT OR IGNORE INTO generation_pages (generation_id, page_number, content, model_type, created_at)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (generation_id, page_number, content, model_type, time.time()))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Checkpoint write failed for page {page_number}: {e}")
+
+    def save_outline(self, generation_id: str, outline: Dict[str, Any]):
+        """Store a long story's outline; an outline already stored is kept"""
+        self.save_page(generation_id, OUTLINE_PAGE, json.dumps(outline))
+
+    def outline(self, generation_id: str) -> Optional[Dict[str, Any]]:
+        """The stored outline of a long story, or None"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT content FROM generation_pages WHERE generation_id = ? AND page_number = ? AND created_at > ?
+                """, (generation_id, OUTLINE_PAGE, time.time() - self.ttl_seconds))
+                row = cursor.fetchone()
+                return json.loads(row[0]) if row else None
+        except Exception as e:
+            logger.warning(f"Checkpoint read failed: {e}")
+            return None
+
+    def pages(self, generation_id: str) -> Dict[int, Dict[str, Any]]:
+        """{page number: {'content', 'model_type', 'billed'}} for the stored pages of a generation"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT page_number, content, model_type, billed FROM generation_pages
+                    WHERE generation_id = ? AND page_number != ? AND created_at > ?
+                """, (generation_id, OUTLINE_PAGE, time.time() - self.ttl_seconds))
+                return {row[0]: {'content': row[1], 'model_type': row[2], 'billed': bool(row[3])}
+                        for row in cursor.fetchall()}
+        except Exception as e:
+            logger.warning(f"Checkpoint read failed: {e}")
+            return {}
+
+    def credits_charged(self, generation_id: str) -> int:
+        """Credits earlier runs were charged for a generation whose billed pages are still kept"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT credits FROM generation_charges WHERE generation_id = ? AND EXISTS (
+                        SELECT 1 FROM generation_pages
+                        WHERE generation_id = ? AND page_number != ? AND billed = 1 AND created_at > ?
+                    )
+                """, (generation_id, generation_id, OUTLINE_PAGE, time.time() - self.ttl_seconds))
+                row = cursor.fetchone()
+                return row[0] if row else 0
+        except Exception as e:
+            logger.warning(f"Checkpoint read failed: {e}")
+            return 0
+
+    def record_delivery(self, generation_id: str, pages_delivered: int, pages_requested: int, credits_charged: int = 0):
+        """
+        Called once the delivered pages are charged: forgets a complete
+        generation, or marks a partial one's delivered pages billed, with the
+        credits charged for them over all runs so far, so a resumed run
+        doesn't charge for them again
+        """
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                if pages_delivered >= pages_requested:
+                    cursor.execute("DELETE FROM generation_pages WHERE generation_id = ?", (generation_id,))
+                else:
+                    cursor.execute("""
+                        UPDATE generation_pages SET billed = 1 WHERE generation_id = ? AND page_number <= ?
+                    """, (generation_id, pages_delivered))
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO generation_charges (generation_id, credits, updated_at) VALUES (?, ?, ?)
+                    """, (generation_id, credits_charged, time.time()))
+                cursor.execute("DELETE FROM generation_pages WHERE created_at <= ?", (time.time() - self.ttl_seconds,))
+                cursor.execute("""
+                    DELETE FROM generation_charges WHERE generation_id NOT IN (SELECT generation_id FROM generation_pages)
+                """)
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Checkpoint update failed: {e}")
+
+
+# Global instance
+generation_checkpoints = GenerationCheckpoints()
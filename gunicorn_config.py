@@ -1,15 +1,21 @@
 import multiprocessing
+import os
 
 # Bind to localhost
 bind = "0.0.0.0:5000"
 
-# Increase timeout to 5 minutes (300 seconds) for long AI generations
-timeout = 300
+# Increase timeout to 5 minutes (300 seconds) for long AI generations; request_deadline
+# reads the same GUNICORN_TIMEOUT so generations finish (partially) before it
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 300))
 
 # Worker configuration
-workers = 3  # Start with a few workers
-worker_class = "sync"
-threads = 2
+# With DEEPINFRA_ASYNC_GATEWAY=1 LLM calls are multiplexed on one event loop per
+# worker, so request threads are cheap waiters: run many of them on gthread workers
+async_gateway = os.environ.get("DEEPINFRA_ASYNC_GATEWAY", "").lower() in ("1", "true", "yes")
+
+workers = int(os.environ.get("GUNICORN_WORKERS", 3))  # Start with a few workers
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread" if async_gateway else "sync")
+threads = int(os.environ.get("GUNICORN_THREADS", 100 if async_gateway else 2))
 
 # Logging
 loglevel = "info"
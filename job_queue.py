@@ -0,0 +1,281 @@
+"""
+Durable Job Queue for Penora
+Moves long generations out of the gunicorn request cycle
+
+Requests enqueue a job and return its id straight away; job_worker.py claims
+jobs from the same SQLite file, runs them and stores the result. Claims are
+leased, so a job whose worker died (crash, deploy, restart) is picked up again
+once its lease expires, up to JOB_MAX_ATTEMPTS times. A job's charge is
+recorded before it is made, so an attempt that picks up a job whose earlier
+worker died after charging doesn't charge again.
+
+Settings:
+- JOB_QUEUE_DB: SQLite file shared by the web and job workers (default: jobs.db in PENORA_DATA_DIR)
+- JOB_LEASE_SECONDS: seconds a claimed job stays owned without a heartbeat (default: 600)
+- JOB_MAX_ATTEMPTS: times a job is started before it is marked failed (default: 2)
+"""
+
+import sqlite3
+import logging
+import json
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue:
+    """SQLite-backed queue of generation jobs with leased claims"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    COMPLETED = 'completed'
+    FAILED = 'failed'
+
+    def __init__(self, db_path=None, lease_seconds=None, max_attempts=None):
+        self.db_path = db_path or os.environ.get("JOB_QUEUE_DB") or data_path("jobs.db")
+        self.lease_seconds = int(lease_seconds or os.environ.get("JOB_LEASE_SECONDS", 600))
+        self.max_attempts = int(max_attempts or os.environ.get("JOB_MAX_ATTEMPTS", 2))
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize job queue schema"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS generation_jobs (
+                        job_id TEXT PRIMARY KEY,
+                        user_id TEXT NOT NULL,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'queued',
+                        result TEXT,
+                        error TEXT,
+                        progress TEXT,
+                        charged_credits INTEGER,
+                        attempts INTEGER DEFAULT 0,
+                        worker_id TEXT,
+                        lease_expires REAL,
+                        created_at REAL NOT NULL,
+                        started_at REAL,
+                        finished_at REAL
+                    )
+                """)
+
+                # Queues created before progress reporting and charge records
+                cursor.execute("PRAGMA table_info(generation_jobs)")
+                columns = [column[1] for column in cursor.fetchall()]
+                if 'progress' not in columns:
+                    cursor.execute("ALTER TABLE generation_jobs ADD COLUMN progress TEXT")
+                if 'charged_credits' not in columns:
+                    cursor.execute("ALTER TABLE generation_jobs ADD COLUMN charged_credits INTEGER")
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status_created ON generation_jobs(status, created_at)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_user_id ON generation_jobs(user_id)")
+                conn.commit()
+
+        except Exception as e:
+            logger.error(f"Job queue initialization error: {e}")
+
+    @staticmethod
+    def _row_to_job(row) -> Dict[str, Any]:
+        return {
+            'job_id': row[0],
+            'user_id': row[1],
+            'kind': row[2],
+            'payload': json.loads(row[3]),
+            'status': row[4],
+            'result': json.loads(row[5]) if row[5] else None,
+            'error': row[6],
+            'attempts': row[7],
+            'worker_id': row[8],
+            'created_at': row[9],
+            'started_at': row[10],
+            'finished_at': row[11],
+            'progress': json.loads(row[12]) if row[12] else None
+        }
+
+    _COLUMNS = ("job_id, user_id, kind, payload, status, result, error, attempts, "
+                "worker_id, created_at, started_at, finished_at, progress")
+
+    def enqueue(self, user_id: str, kind: str, payload: Dict[str, Any]) -> str:
+        """Add a job and return its id"""
+        job_id = uuid.uuid4().hex
+        with self.get_db_connection() as conn:
+            conn.execute("""
+                INSERT INTO generation_jobs (job_id, user_id, kind, payload, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (job_id, str(user_id), kind, json.dumps(payload), self.QUEUED, time.time()))
+            conn.commit()
+        logger.info(f"Enqueued {kind} job {job_id} for user {user_id}")
+        return job_id
+
+    def claim(self, worker_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Atomically take the oldest runnable job for worker_id.
+        Runnable means queued, or running with an expired lease (its worker died).
+        """
+        now = time.time()
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            # Take the write lock up front so two workers can't claim the same row
+            cursor.execute("BEGIN IMMEDIATE")
+
+            # Jobs abandoned too many times are given up on
+            cursor.execute("""
+                UPDATE generation_jobs
+                SET status = ?, error = 'Job worker stopped responding', finished_at = ?
+                WHERE status = ? AND lease_expires < ? AND attempts >= ?
+            """, (self.FAILED, now, self.RUNNING, now, self.max_attempts))
+
+            cursor.execute(f"""
+                SELECT {self._COLUMNS} FROM generation_jobs
+                WHERE status = ? OR (status = ? AND lease_expires < ?)
+                ORDER BY created_at ASC LIMIT 1
+            """, (self.QUEUED, self.RUNNING, now))
+            row = cursor.fetchone()
+
+            if not row:
+                conn.commit()
+                return None
+
+            cursor.execute("""
+                UPDATE generation_jobs
+                SET status = ?, worker_id = ?, attempts = attempts + 1,
+                    lease_expires = ?, started_at = COALESCE(started_at, ?)
+                WHERE job_id = ?
+            """, (self.RUNNING, worker_id, now + self.lease_seconds, now, row[0]))
+            conn.commit()
+
+        job = self._row_to_job(row)
+        job.update(status=self.RUNNING, worker_id=worker_id, attempts=job['attempts'] + 1)
+        return job
+
+    def heartbeat(self, job_id: str, worker_id: str) -> bool:
+        """Extend the lease on a running job; False if the job is no longer ours"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE generation_jobs SET lease_expires = ?
+                WHERE job_id = ? AND worker_id = ? AND status = ?
+            """, (time.time() + self.lease_seconds, job_id, worker_id, self.RUNNING))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def set_progress(self, job_id: str, done: int, total: int):
+        """Record how many steps (pages, file chunks) of a running job are finished"""
+        with self.get_db_connection() as conn:
+            conn.execute("UPDATE generation_jobs SET progress = ? WHERE job_id = ?",
+                         (json.dumps({'done': done, 'total': total}), job_id))
+            conn.commit()
+
+    def record_charge(self, job_id: str, credits: int) -> bool:
+        """
+        Record that a job is being charged `credits`, before the charge is made.
+        False if an earlier attempt already recorded its charge, which then must
+        not be made again.
+        """
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE generation_jobs SET charged_credits = ? WHERE job_id = ? AND charged_credits IS NULL",
+                           (credits, job_id))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def charged_credits(self, job_id: str) -> Optional[int]:
+        """Credits recorded as charged for a job, or None if it hasn't been charged"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT charged_credits FROM generation_jobs WHERE job_id = ?", (job_id,))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def forget_charge(self, job_id: str):
+        """Drop a job's charge record when the charge didn't go through"""
+        with self.get_db_connection() as conn:
+            conn.execute("UPDATE generation_jobs SET charged_credits = NULL WHERE job_id = ?", (job_id,))
+            conn.commit()
+
+    def complete(self, job_id: str, result: Dict[str, Any], worker_id: Optional[str] = None) -> bool:
+        """
+        Mark a job finished and store its result. With worker_id, only while
+        that worker still holds the job's lease; False if it doesn't.
+        """
+        return self._finish(job_id, self.COMPLETED, worker_id, result=json.dumps(result))
+
+    def fail(self, job_id: str, error: str, worker_id: Optional[str] = None) -> bool:
+        """Mark a job failed with a user-facing error message; worker_id as for complete"""
+        return self._finish(job_id, self.FAILED, worker_id, error=error)
+
+    def _finish(self, job_id, status, worker_id=None, result=None, error=None) -> bool:
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            if worker_id is None:
+                cursor.execute("""
+                    UPDATE generation_jobs
+                    SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires = NULL
+                    WHERE job_id = ?
+                """, (status, result, error, time.time(), job_id))
+            else:
+                cursor.execute("""
+                    UPDATE generation_jobs
+                    SET status = ?, result = ?, error = ?, finished_at = ?, lease_expires = NULL
+                    WHERE job_id = ? AND worker_id = ? AND status = ?
+                """, (status, result, error, time.time(), job_id, worker_id, self.RUNNING))
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the job with the given id, or None"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {self._COLUMNS} FROM generation_jobs WHERE job_id = ?", (job_id,))
+            row = cursor.fetchone()
+        return self._row_to_job(row) if row else None
+
+    def position(self, job_id: str) -> int:
+        """Number of queued jobs ahead of this one (0 once it is running)"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COUNT(*) FROM generation_jobs
+                WHERE status = ? AND created_at < (SELECT created_at FROM generation_jobs WHERE job_id = ?)
+            """, (self.QUEUED, job_id))
+            return cursor.fetchone()[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Job counts by status"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT status, COUNT(*) FROM generation_jobs GROUP BY status")
+            return dict(cursor.fetchall())
+
+
+# Global instance
+job_queue = JobQueue()
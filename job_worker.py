@@ -0,0 +1,224 @@
+"""
+Penora Job Worker
+Runs queued generations outside the gunicorn request cycle
+
+Usage:
+    python job_worker.py --threads 4
+
+Each thread claims a job from job_queue, runs the generation, then charges the
+user's credits and saves the result to their workspace - the steps
+start_writing used to do inline. Run one or more of these next to gunicorn
+with the same JOB_QUEUE_DB and set JOB_QUEUE_ENABLED=1 for the web app.
+"""
+
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+from typing import Dict, Any
+
+from billing import credits_for_generation, record_delivery
+from job_queue import job_queue
+from llm_scheduler import LLMScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class JobError(Exception):
+    """Job failure whose message can be shown to the user"""
+
+
+def run_story_job(payload: Dict[str, Any], progress=None) -> Dict[str, Any]:
+    """
+    Fresh single or multi-page generation from start_writing, reporting progress per page.
+    A retried job resumes from the pages its earlier attempts checkpointed.
+    """
+    from ai_service import generate_text_simple
+    return generate_text_simple(payload['prompt'], payload.get('model_type', 'balanced'),
+                                pages=payload.get('page_count', 1), progress=progress,
+                                generation_id=payload.get('generation_id'))
+
+
+def run_file_job(payload: Dict[str, Any], progress=None) -> Dict[str, Any]:
+    """Uploaded file processing from start_writing, reporting progress per chunk"""
+    from ai_service import ai_service
+    return ai_service.process_uploaded_file(payload['content'], payload['instruction'],
+                                            payload.get('model_type', 'balanced'), progress=progress)
+
+
+JOB_HANDLERS = {
+    'story': run_story_job,
+    'file': run_file_job
+}
+
+
+def save_to_workspace(user_id, title, content):
+    """Save a finished generation to the user's workspace, returning the project code or None"""
+    try:
+        from app import app
+        from workspace_service import WorkspaceService
+
+        with app.app_context():
+            success, project, message = WorkspaceService.save_generation(user_id, title, content)
+            if success and project:
+                return getattr(project, 'code', None)
+            logger.error(f"Workspace save failed for job: {message}")
+    except Exception as e:
+        # The user has been charged by now; the job still completes with its content
+        logger.error(f"Workspace save error for job: {e}")
+    return None
+
+
+def finish_generation(job: Dict[str, Any], generation: Dict[str, Any], queue=None) -> Dict[str, Any]:
+    """
+    Charge the user and save the generation; returns the stored job result.
+    The charge is recorded on the job first, so a retry of a job whose worker
+    died after charging doesn't charge again.
+    """
+    from shared_credit_workspace_system import unified_system
+
+    queue = queue or job_queue
+    payload = job['payload']
+    user_id = job['user_id']
+    credits_needed = credits_for_generation(generation, payload['credits_needed'], payload.get('model_type', 'balanced'))
+
+    unified_system.create_or_update_user(
+        user_id=user_id,
+        username=payload.get('username', 'Unknown'),
+        email=payload.get('email', 'unknown@example.com'),
+        initial_credits=payload.get('credits', 0)
+    )
+    if not queue.record_charge(job['job_id'], credits_needed):
+        credits_needed = queue.charged_credits(job['job_id'])
+        logger.info(f"Job {job['job_id']} was charged {credits_needed} credit(s) by an earlier attempt, not charging again")
+    elif credits_needed and not unified_system.deduct_credits(user_id, credits_needed, 'penora', payload.get('description', 'Generation')):
+        queue.forget_charge(job['job_id'])
+        raise JobError("You don't have enough credits left to complete this generation.")
+    record_delivery(generation, credits_needed)
+
+    content = generation['content']
+    return {
+        'content': content,
+        'model_used': generation.get('model_used', payload.get('model_type')),
+        'credits_used': credits_needed,
+        'remaining_credits': unified_system.get_user_credits(user_id),
+        'project_code': save_to_workspace(user_id, generation.get('title') or payload.get('title', 'Untitled'), content),
+        'word_count': len(content.split()),
+        'partial': bool(generation.get('partial')),
+        'pages_delivered': generation.get('pages_delivered'),
+        'pages_requested': generation.get('pages_requested')
+    }
+
+
+class JobWorker:
+    """Pool of threads claiming and running jobs from a JobQueue"""
+
+    def __init__(self, queue=None, threads=2, poll_interval=1.0, handlers=None, finalize=None):
+        self.queue = queue or job_queue
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.handlers = handlers or JOB_HANDLERS
+        self.finalize = finalize or (lambda job, generation: finish_generation(job, generation, self.queue))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _keep_leased(self, job_id, done):
+        """Renew the job's lease until it finishes so other workers leave it alone"""
+        interval = max(1.0, self.queue.lease_seconds / 3)
+        while not done.wait(interval):
+            if not self.queue.heartbeat(job_id, self.worker_id):
+                return
+
+    def process(self, job: Dict[str, Any]):
+        """Run one claimed job to completion or failure"""
+        job_id = job['job_id']
+        handler = self.handlers.get(job['kind'])
+        if handler is None:
+            self.queue.fail(job_id, f"Unknown job type: {job['kind']}", self.worker_id)
+            return
+
+        done = threading.Event()
+        threading.Thread(target=self._keep_leased, args=(job_id, done), daemon=True).start()
+        try:
+            # Model calls wait their turn against every other user's (see llm_scheduler)
+            with LLMScheduler.user_context(job['user_id']):
+                generation = handler(job['payload'], lambda completed, total: self.queue.set_progress(job_id, completed, total))
+            if not generation or not generation.get('success'):
+                error = (generation or {}).get('error') or 'Generation failed. Please try again.'
+                self.queue.fail(job_id, error, self.worker_id)
+                return
+            # Renewing the lease right before charging both checks that no other worker has
+            # reclaimed the job (and will charge for it) and gives the charge a full lease
+            if not self.queue.heartbeat(job_id, self.worker_id):
+                logger.warning(f"Job {job_id} lost its lease to another worker, not charging for it")
+                return
+            if self.queue.complete(job_id, self.finalize(job, generation), self.worker_id):
+                logger.info(f"Job {job_id} completed")
+            else:
+                logger.error(f"Job {job_id} lost its lease while finishing")
+        except JobError as e:
+            self.queue.fail(job_id, str(e), self.worker_id)
+        except Exception as e:
+            logger.error(f"Job {job_id} crashed: {e}\n{traceback.format_exc()}")
+            self.queue.fail(job_id, 'Generation failed. Please try again.', self.worker_id)
+        finally:
+            done.set()
+
+    def run_once(self) -> bool:
+        """Claim and process one job; False when the queue was empty"""
+        job = self.queue.claim(self.worker_id)
+        if job is None:
+            return False
+        self.process(job)
+        return True
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if not self.run_once():
+                    self._stop.wait(self.poll_interval)
+            except Exception as e:
+                logger.error(f"Job worker loop error: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Start the worker threads and return self"""
+        self._stop.clear()
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        """Stop claiming new jobs and wait for running ones"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run queued Penora generations")
+    parser.add_argument("--threads", type=int, default=int(os.environ.get("JOB_WORKER_THREADS", 4)),
+                        help="Jobs run at the same time by this process")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of an empty queue")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    worker = JobWorker(threads=args.threads, poll_interval=args.poll_interval).start()
+    logger.info(f"Job worker {worker.worker_id} running {args.threads} thread(s) on {worker.queue.db_path}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        logger.info("Stopping job worker, waiting for running jobs")
+        worker.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+"""
+LLM Backends for Penora
+Chooses which OpenAI-compatible server runs each model
+
+Every DEEPINFRA_MODELS entry names its `backend`:
+- deepinfra: api.deepinfra.com through the pooled DeepInfraClient (or the
+  async gateway when DEEPINFRA_ASYNC_GATEWAY is set)
+- local: any OpenAI-compatible server, such as a self-hosted llama.cpp or
+  vLLM box, for cheap low-latency tasks like brainstorms and titles
+
+The table AIService and the router work from is MODELS: DEEPINFRA_MODELS
+with the LOCAL_LLM_MODEL_TYPES entries moved to the local backend and
+renamed to LOCAL_LLM_MODEL. A local entry without a fallback falls back to
+DeepInfra's balanced model, so the router has somewhere to send its calls
+while the local server is down. It is a copy, so DEEPINFRA_MODELS itself
+always describes DeepInfra.
+
+AIService talks to `llm_backends`, a BackendRouter with the client interface
+(chat, chat_choices, stream_chat, breakers) that hands each call to the
+backend running its model type. Model types are matched by key rather than
+by model name, since several types can share one name (balanced and fast
+both run Mistral 7B) while running on different backends. Retries, circuit
+breakers, hedging and deadlines work the same on every backend.
+
+Settings:
+- LOCAL_LLM_BASE_URL: base URL of the local server, e.g. http://10.0.0.5:8000/v1 (no local backend without it)
+- LOCAL_LLM_API_KEY: bearer token the local server expects (default: none is sent)
+- LOCAL_LLM_MODEL: model name the local server serves (default: local)
+- LOCAL_LLM_MODEL_TYPES: comma-separated DEEPINFRA_MODELS entries it runs (default: fast)
+"""
+
+import os
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from deepinfra_client import DeepInfraClient, DEEPINFRA_MODELS, get_deepinfra_client
+from async_deepinfra_client import AsyncDeepInfraClient, DeepInfraGateway, get_deepinfra_gateway, async_gateway_enabled
+from llm_resilience import CircuitBreakerRegistry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BACKEND = 'deepinfra'
+# The clients' own default model, for calls that don't name one
+DEFAULT_MODEL = "mistralai/Mistral-7B-Instruct-v0.3"
+# Where local model types without a fallback of their own go when the local server fails
+LOCAL_FALLBACK = 'balanced'
+
+
+def _headers(api_key: Optional[str]) -> Dict[str, str]:
+    headers = {"Content-Type": "application/json"}
+    if api_key:
+        headers["Authorization"] = f"Bearer {api_key}"
+    return headers
+
+
+class OpenAICompatibleClient(DeepInfraClient):
+    """DeepInfraClient for another OpenAI-compatible server; never sends the DeepInfra API key"""
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, **kwargs):
+        super().__init__(base_url=base_url, **kwargs)
+        self.api_key = api_key
+
+    def _headers(self) -> Dict[str, str]:
+        return _headers(self.api_key)
+
+
+class AsyncOpenAICompatibleClient(AsyncDeepInfraClient):
+    """Async counterpart of OpenAICompatibleClient, for the gateway"""
+
+    def __init__(self, base_url: str, api_key: Optional[str] = None, **kwargs):
+        super().__init__(base_url=base_url, **kwargs)
+        self.api_key = api_key
+
+    def _headers(self) -> Dict[str, str]:
+        return _headers(self.api_key)
+
+
+_local_client = None
+_local_client_pid = None
+_local_client_lock = threading.Lock()
+
+
+def get_local_client():
+    """
+    Client for the LOCAL_LLM_BASE_URL server in the current worker process
+    (a gateway when the async gateway is enabled), re-created after a fork
+    like get_deepinfra_client.
+    """
+    global _local_client, _local_client_pid
+    base_url = os.environ.get("LOCAL_LLM_BASE_URL")
+    if not base_url:
+        raise Exception("A model is set to the local backend but LOCAL_LLM_BASE_URL is not set")
+    pid = os.getpid()
+    if _local_client is None or _local_client_pid != pid:
+        with _local_client_lock:
+            if _local_client is None or _local_client_pid != pid:
+                api_key = os.environ.get("LOCAL_LLM_API_KEY")
+                if async_gateway_enabled():
+                    _local_client = DeepInfraGateway(client_class=AsyncOpenAICompatibleClient, base_url=base_url, api_key=api_key)
+                else:
+                    _local_client = OpenAICompatibleClient(base_url, api_key)
+                _local_client_pid = pid
+    return _local_client
+
+
+def get_deepinfra_backend():
+    """The DeepInfra client AIService used before backends existed"""
+    return get_deepinfra_gateway() if async_gateway_enabled() else get_deepinfra_client()
+
+
+def with_local_backend(models: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """models with the LOCAL_LLM_MODEL_TYPES entries run on the local server (models itself without LOCAL_LLM_BASE_URL)"""
+    if not os.environ.get("LOCAL_LLM_BASE_URL"):
+        return models
+    local_types = {t.strip() for t in os.environ.get("LOCAL_LLM_MODEL_TYPES", "fast").split(",")} & set(models)
+    local_name = os.environ.get("LOCAL_LLM_MODEL", "local")
+    fallback = LOCAL_FALLBACK if LOCAL_FALLBACK in models and LOCAL_FALLBACK not in local_types else None
+    return {model_type: dict(config, backend='local', name=local_name, fallback=config.get('fallback') or fallback)
+            if model_type in local_types else config
+            for model_type, config in models.items()}
+
+
+MODELS = with_local_backend(DEEPINFRA_MODELS)
+
+
+class _RoutedBreakers:
+    """CircuitBreakerRegistry lookalike answering from the breakers of each model's backend"""
+
+    def __init__(self, router):
+        self.router = router
+        self._fallback = CircuitBreakerRegistry()
+
+    def get(self, model: str):
+        breakers = getattr(self.router.backend(model), 'breakers', None)
+        return (breakers or self._fallback).get(model)
+
+    def for_model_type(self, model_type: str):
+        """The breaker of the backend running model_type, which a lookup by name can miss"""
+        breakers = getattr(self.router.for_model_type(model_type), 'breakers', None)
+        return (breakers or self._fallback).get(self.router.models[model_type]['name'])
+
+
+class BackendRouter:
+    """
+    The client interface over several backends: each call goes to the
+    backend named by the `backend` of its MODELS entry, found by
+    the call's model_type keyword when given and by its model name
+    otherwise (DEFAULT_BACKEND for models not in the table).
+
+    backends maps names to zero-argument callables returning the client, so
+    clients are only built (per worker process) once a call needs them.
+    """
+
+    def __init__(self, backends: Dict[str, Callable[[], Any]], models: Optional[Dict[str, Dict[str, Any]]] = None,
+                 default: str = DEFAULT_BACKEND):
+        self.backends = backends
+        self.models = models or MODELS
+        self.default = default
+        self.breakers = _RoutedBreakers(self)
+
+    def backend_name(self, model: str, model_type: Optional[str] = None) -> str:
+        if model_type in self.models:
+            return self.models[model_type].get('backend', self.default)
+        return next((config.get('backend', self.default) for config in self.models.values() if config['name'] == model),
+                    self.default)
+
+    def backend(self, model: str, model_type: Optional[str] = None):
+        """Client for the backend running model_type, or model when no type is given"""
+        name = self.backend_name(model, model_type)
+        if name not in self.backends:
+            raise Exception(f"Unknown LLM backend '{name}' for {model_type or model}")
+        return self.backends[name]()
+
+    def for_model_type(self, model_type: str):
+        """Client for the backend running model_type"""
+        return self.backend(self.models[model_type]['name'], model_type)
+
+    @staticmethod
+    def _model(args, kwargs) -> str:
+        # model is the fourth positional parameter of every client method
+        return kwargs.get('model') or (args[3] if len(args) > 3 else DEFAULT_MODEL)
+
+    def chat(self, *args, model_type: Optional[str] = None, **kwargs) -> str:
+        return self.backend(self._model(args, kwargs), model_type).chat(*args, **kwargs)
+
+    def chat_choices(self, *args, model_type: Optional[str] = None, **kwargs):
+        return self.backend(self._model(args, kwargs), model_type).chat_choices(*args, **kwargs)
+
+    def stream_chat(self, *args, model_type: Optional[str] = None, **kwargs):
+        return self.backend(self._model(args, kwargs), model_type).stream_chat(*args, **kwargs)
+
+
+# Global instance
+llm_backends = BackendRouter({
+    'deepinfra': get_deepinfra_backend,
+    'local': get_local_client
+})
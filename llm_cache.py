@@ -0,0 +1,185 @@
+"""
+LLM Response Cache for Penora
+Shares completions for identical requests across all gunicorn workers on a node
+
+Entries are keyed on (model, system message, prompt, max_tokens, temperature)
+and stored in SQLite so every worker process sees the same cache. Entries
+expire after a TTL and the least recently used ones are evicted once the
+cache grows past its entry limit.
+
+Settings:
+- LLM_CACHE_DB: SQLite file shared by the workers (default: llm_cache.db in PENORA_DATA_DIR)
+- LLM_CACHE_TTL: seconds an entry stays valid (default: 86400)
+- LLM_CACHE_MAX_ENTRIES: entries kept before LRU eviction (default: 5000)
+"""
+
+import sqlite3
+import logging
+import hashlib
+import json
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+
+class LLMResponseCache:
+    """SQLite-backed TTL + LRU cache for chat completion responses"""
+
+    def __init__(self, db_path=None, ttl_seconds=None, max_entries=None):
+        self.db_path = db_path or os.environ.get("LLM_CACHE_DB") or data_path("llm_cache.db")
+        self.ttl_seconds = int(ttl_seconds or os.environ.get("LLM_CACHE_TTL", 86400))
+        self.max_entries = int(max_entries or os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000))
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize cache schema"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        response TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        expires_at REAL NOT NULL,
+                        last_access REAL NOT NULL
+                    )
+                """)
+
+                # Hit/miss counters shared by every worker
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_cache_stats (
+                        name TEXT PRIMARY KEY,
+                        value INTEGER DEFAULT 0
+                    )
+                """)
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+                conn.commit()
+
+        except Exception as e:
+            logger.error(f"LLM cache initialization error: {e}")
+
+    @staticmethod
+    def make_key(model: str, system_msg: str, prompt: str, max_tokens: int, temperature: float) -> str:
+        """Build the cache key for one chat completion request"""
+        raw = json.dumps([model, system_msg, prompt, max_tokens, round(float(temperature), 4)])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _bump(self, cursor, name: str, amount: int = 1):
+        cursor.execute("""
+            INSERT INTO llm_cache_stats (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        """, (name, amount))
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response for key, or None on a miss"""
+        try:
+            now = time.time()
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT response, expires_at FROM llm_cache WHERE cache_key = ?", (key,))
+                row = cursor.fetchone()
+
+                if row and row[1] > now:
+                    cursor.execute("UPDATE llm_cache SET last_access = ? WHERE cache_key = ?", (now, key))
+                    self._bump(cursor, 'hits')
+                    conn.commit()
+                    return row[0]
+
+                if row:
+                    cursor.execute("DELETE FROM llm_cache WHERE cache_key = ?", (key,))
+                self._bump(cursor, 'misses')
+                conn.commit()
+                return None
+
+        except Exception as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    def set(self, key: str, response: str):
+        """Store a response, evicting expired and least recently used entries"""
+        try:
+            now = time.time()
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT OR REPLACE INTO llm_cache (cache_key, response, created_at, expires_at, last_access)
+                    VALUES (?, ?, ?, ?, ?)
+                """, (key, response, now, now + self.ttl_seconds, now))
+
+                cursor.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+
+                cursor.execute("SELECT COUNT(*) FROM llm_cache")
+                overflow = cursor.fetchone()[0] - self.max_entries
+                if overflow > 0:
+                    cursor.execute("""
+                        DELETE FROM llm_cache WHERE cache_key IN (
+                            SELECT cache_key FROM llm_cache ORDER BY last_access ASC LIMIT ?
+                        )
+                    """, (overflow,))
+                    self._bump(cursor, 'evictions', overflow)
+
+                conn.commit()
+
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT name, value FROM llm_cache_stats")
+                counters = dict(cursor.fetchall())
+                cursor.execute("SELECT COUNT(*) FROM llm_cache")
+                entries = cursor.fetchone()[0]
+        except Exception as e:
+            logger.warning(f"LLM cache stats failed: {e}")
+            counters, entries = {}, 0
+
+        hits = counters.get('hits', 0)
+        misses = counters.get('misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0
+        }
+
+    def clear(self):
+        """Remove every cached response and reset the counters"""
+        with self.get_db_connection() as conn:
+            conn.execute("DELETE FROM llm_cache")
+            conn.execute("DELETE FROM llm_cache_stats")
+            conn.commit()
+
+
+# Global instance
+llm_cache = LLMResponseCache()
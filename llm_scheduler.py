@@ -0,0 +1,351 @@
+"""
+Fair LLM Call Scheduler for Penora
+Shares DeepInfra capacity fairly between users across every gunicorn and job worker on a node
+
+Every chat call AIService makes waits here for a slot first:
+- a global cap on calls in flight per model, so the node stays inside the provider's rate limit
+- a token bucket per user, so one user can't burst through the whole node's capacity
+- weighted fair queuing between users: each waiting call gets a virtual finish tag
+  (max(model clock, user's previous tag) + 1/weight) and the smallest tag goes next,
+  so one user's fifty queued pages don't starve another user's single call
+- queue position per user, shown to them while they wait
+
+State lives in SQLite (WAL) so the caps hold node-wide. Slots are leased, and
+waiters that stop polling are dropped, so a crashed worker can't hold capacity.
+Waiters poll with a read-only check, with jitter, and only take SQLite's
+write lock when a slot looks free for them or to show they're still alive,
+so a queue of waiters doesn't slow the grants and releases it waits on.
+
+Settings:
+- LLM_SCHEDULER_DB: SQLite file shared by the workers (default: llm_scheduler.db in PENORA_DATA_DIR)
+- LLM_MAX_IN_FLIGHT: calls in flight per model across the node (default: 32)
+- LLM_USER_RATE: calls per second added to each user's bucket (default: 2)
+- LLM_USER_BURST: bucket size, the most calls a user can start at once (default: 20)
+- LLM_QUEUE_TIMEOUT: seconds a call may wait for a slot before failing (default: 300), or less
+  when the calling request's deadline comes first (see request_deadline)
+- LLM_SCHEDULER_ENABLED: set to 0 to send calls straight to the client (default: 1)
+"""
+
+import sqlite3
+import logging
+import os
+import time
+import uuid
+import random
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+from data_dir import data_path
+
+import request_deadline
+
+logger = logging.getLogger(__name__)
+
+# (user_id, weight) the calls made in the current request or job are scheduled for
+_current_user = contextvars.ContextVar('llm_scheduler_user', default=(None, 1.0))
+
+
+class SchedulerTimeout(Exception):
+    """A call waited longer than the queue timeout for a free slot"""
+
+
+class LLMScheduler:
+    """SQLite-backed global concurrency cap, per-user token buckets and weighted fair queue"""
+
+    # The model's virtual clock is stored as the tag of the reserved user ''
+    _CLOCK = ''
+
+    def __init__(self, db_path=None, max_in_flight=None, user_rate=None, user_burst=None, wait_timeout=None,
+                 lease_seconds=600, poll_interval=0.05):
+        self.db_path = db_path or os.environ.get("LLM_SCHEDULER_DB") or data_path("llm_scheduler.db")
+        self.max_in_flight = int(max_in_flight or os.environ.get("LLM_MAX_IN_FLIGHT", 32))
+        self.user_rate = float(user_rate or os.environ.get("LLM_USER_RATE", 2.0))
+        self.user_burst = float(user_burst or os.environ.get("LLM_USER_BURST", 20))
+        self.wait_timeout = float(wait_timeout or os.environ.get("LLM_QUEUE_TIMEOUT", 300))
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        # Waiters that haven't polled for this long belong to a dead worker
+        self.stale_after = max(5.0, poll_interval * 50)
+        # A waiter that isn't up next still writes this often, to show it's alive
+        self.heartbeat_interval = self.stale_after / 3
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                # Slots and queue entries are transient; skip the per-commit fsync
+                conn.execute('PRAGMA synchronous=NORMAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize scheduler schema"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+
+                # Calls currently running against a model
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_slots (
+                        slot_id TEXT PRIMARY KEY,
+                        model TEXT NOT NULL,
+                        user_id TEXT,
+                        acquired_at REAL NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                """)
+
+                # Calls waiting for a slot, served in virtual finish tag order
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_waiters (
+                        ticket TEXT PRIMARY KEY,
+                        model TEXT NOT NULL,
+                        user_id TEXT,
+                        start_tag REAL NOT NULL,
+                        finish_tag REAL NOT NULL,
+                        enqueued_at REAL NOT NULL,
+                        last_poll REAL NOT NULL
+                    )
+                """)
+
+                # Per-model virtual clock and each user's latest tag
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_fair_tags (
+                        model TEXT NOT NULL,
+                        user_id TEXT NOT NULL,
+                        tag REAL NOT NULL,
+                        PRIMARY KEY (model, user_id)
+                    )
+                """)
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_buckets (
+                        user_id TEXT PRIMARY KEY,
+                        tokens REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_slots_model ON llm_slots(model)")
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_llm_waiters_model ON llm_waiters(model, finish_tag)")
+                conn.commit()
+                logger.info("✅ LLM scheduler tables initialized")
+        except Exception as e:
+            logger.error(f"❌ LLM scheduler database initialization failed: {e}")
+            raise
+
+    @staticmethod
+    @contextmanager
+    def user_context(user_id, weight: float = 1.0):
+        """Schedule the LLM calls made inside this block (and tasks copied from it) for user_id"""
+        token = _current_user.set((str(user_id) if user_id is not None else None, weight))
+        try:
+            yield
+        finally:
+            _current_user.reset(token)
+
+    @staticmethod
+    def current_user():
+        return _current_user.get()
+
+    def _enqueue(self, cursor, ticket, model, user_id, weight, now):
+        cursor.execute("SELECT user_id, tag FROM llm_fair_tags WHERE model = ? AND user_id IN (?, ?)",
+                       (model, self._CLOCK, user_id or self._CLOCK))
+        tags = dict(cursor.fetchall())
+        clock = tags.get(self._CLOCK, 0.0)
+        start_tag = max(clock, tags.get(user_id, 0.0)) if user_id else clock
+        finish_tag = start_tag + 1.0 / max(weight, 0.01)
+        if user_id:
+            cursor.execute("INSERT OR REPLACE INTO llm_fair_tags (model, user_id, tag) VALUES (?, ?, ?)",
+                           (model, user_id, finish_tag))
+        waiter = (user_id, start_tag, finish_tag, now)
+        self._insert_waiter(cursor, ticket, model, waiter, now)
+        return waiter
+
+    @staticmethod
+    def _insert_waiter(cursor, ticket, model, waiter, now):
+        cursor.execute("""
+            INSERT INTO llm_waiters (ticket, model, user_id, start_tag, finish_tag, enqueued_at, last_poll)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (ticket, model, *waiter, now))
+
+    def _bucket_tokens(self, cursor, user_id, now) -> float:
+        cursor.execute("SELECT tokens, updated_at FROM llm_buckets WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return self.user_burst
+        return min(self.user_burst, row[0] + (now - row[1]) * self.user_rate)
+
+    def _runnable(self, cursor, model, now, live_since=0.0):
+        """
+        Waiting (ticket, user_id, start_tag) on model in the order they may run:
+        by finish tag, skipping calls beyond their user's bucket
+        """
+        cursor.execute("""
+            SELECT ticket, user_id, start_tag FROM llm_waiters
+            WHERE model = ? AND last_poll >= ? ORDER BY finish_tag, enqueued_at
+        """, (model, live_since))
+        tokens = {}
+        runnable = []
+        for waiter, user_id, start_tag in cursor.fetchall():
+            if user_id is not None:
+                if user_id not in tokens:
+                    tokens[user_id] = self._bucket_tokens(cursor, user_id, now)
+                if tokens[user_id] < 1.0:
+                    continue
+                tokens[user_id] -= 1.0
+            runnable.append((waiter, user_id, start_tag))
+        return runnable
+
+    def _may_dispatch(self, ticket, model, now) -> bool:
+        """
+        Read-only version of _try_dispatch's check: whether a slot looks free for
+        ticket (or its row was dropped as stale), so that taking the write lock is worth it
+        """
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM llm_slots WHERE model = ? AND expires_at >= ?", (model, now))
+            free = self.max_in_flight - cursor.fetchone()[0]
+            if free <= 0:
+                return False
+            cursor.execute("SELECT 1 FROM llm_waiters WHERE ticket = ? AND last_poll >= ?", (ticket, now - self.stale_after))
+            if cursor.fetchone() is None:
+                return True
+            return ticket in [waiter for waiter, _, _ in self._runnable(cursor, model, now, now - self.stale_after)[:free]]
+
+    def _try_dispatch(self, ticket, model, waiter, now) -> bool:
+        """
+        Take a slot for ticket if there is one free for it: every waiter that runs before
+        it must be able to get one too. True when it has one. waiter is what _enqueue
+        returned, to queue the ticket again in its old place if its row was dropped as
+        stale while this process was stalled.
+        """
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM llm_slots WHERE expires_at < ?", (now,))
+            cursor.execute("DELETE FROM llm_waiters WHERE last_poll < ?", (now - self.stale_after,))
+            cursor.execute("UPDATE llm_waiters SET last_poll = ? WHERE ticket = ?", (now, ticket))
+            if cursor.rowcount == 0:
+                self._insert_waiter(cursor, ticket, model, waiter, now)
+
+            cursor.execute("SELECT COUNT(*) FROM llm_slots WHERE model = ?", (model,))
+            free = self.max_in_flight - cursor.fetchone()[0]
+
+            # The smallest finish tags whose users still have a token, as many as there are free slots
+            chosen = next((runnable for runnable in self._runnable(cursor, model, now)[:max(0, free)]
+                           if runnable[0] == ticket), None)
+            if chosen is None:
+                conn.commit()
+                return False
+
+            _, user_id, start_tag = chosen
+            if user_id is not None:
+                cursor.execute("INSERT OR REPLACE INTO llm_buckets (user_id, tokens, updated_at) VALUES (?, ?, ?)",
+                               (user_id, self._bucket_tokens(cursor, user_id, now) - 1.0, now))
+            cursor.execute("DELETE FROM llm_waiters WHERE ticket = ?", (ticket,))
+            cursor.execute("INSERT INTO llm_slots (slot_id, model, user_id, acquired_at, expires_at) VALUES (?, ?, ?, ?, ?)",
+                           (ticket, model, user_id, now, now + self.lease_seconds))
+            # Advance the model's virtual clock to the start tag just served
+            cursor.execute("""
+                INSERT INTO llm_fair_tags (model, user_id, tag) VALUES (?, ?, ?)
+                ON CONFLICT(model, user_id) DO UPDATE SET tag = MAX(tag, excluded.tag)
+            """, (model, self._CLOCK, start_tag))
+            conn.commit()
+            return True
+
+    def acquire(self, model: str, user_id=None, weight: float = 1.0) -> str:
+        """Wait for a slot on model; returns the slot id to release"""
+        ticket = uuid.uuid4().hex
+        now = time.time()
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            waiter = self._enqueue(cursor, ticket, model, user_id, weight, now)
+            conn.commit()
+
+        deadline = now + self.wait_timeout
+        last_write = now
+        try:
+            while True:
+                now = time.time()
+                if self._may_dispatch(ticket, model, now) or now - last_write >= self.heartbeat_interval:
+                    if self._try_dispatch(ticket, model, waiter, now):
+                        break
+                    last_write = now
+                if time.time() >= deadline:
+                    raise SchedulerTimeout(f"Timed out after {self.wait_timeout:.0f}s waiting for a {model} slot")
+                # Stop queueing once the calling request has run out of time
+                request_deadline.check(what=f"Waiting for a {model} slot")
+                # Jitter keeps waiters from polling in lockstep
+                time.sleep(self.poll_interval * random.uniform(0.5, 1.5))
+        except BaseException:
+            self._forget(ticket)
+            raise
+        return ticket
+
+    def _forget(self, ticket):
+        with self.get_db_connection() as conn:
+            conn.execute("DELETE FROM llm_waiters WHERE ticket = ?", (ticket,))
+            conn.commit()
+
+    def release(self, slot_id: str):
+        with self.get_db_connection() as conn:
+            conn.execute("DELETE FROM llm_slots WHERE slot_id = ?", (slot_id,))
+            conn.commit()
+
+    @contextmanager
+    def slot(self, model: str):
+        """Hold a slot on model for the current user (see user_context) while the block runs"""
+        user_id, weight = self.current_user()
+        slot_id = self.acquire(model, user_id, weight)
+        try:
+            yield
+        finally:
+            self.release(slot_id)
+
+    def position(self, user_id) -> Optional[int]:
+        """Calls queued ahead of this user's next waiting call, or None if nothing of theirs is waiting"""
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT MIN((SELECT COUNT(*) FROM llm_waiters ahead
+                            WHERE ahead.model = mine.model
+                              AND (ahead.finish_tag < mine.finish_tag
+                                   OR (ahead.finish_tag = mine.finish_tag AND ahead.enqueued_at < mine.enqueued_at))))
+                FROM llm_waiters mine WHERE mine.user_id = ?
+            """, (str(user_id),))
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def stats(self) -> Dict[str, Any]:
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT model, COUNT(*) FROM llm_slots WHERE expires_at >= ? GROUP BY model", (time.time(),))
+            in_flight = dict(cursor.fetchall())
+            cursor.execute("SELECT model, COUNT(*) FROM llm_waiters GROUP BY model")
+            waiting = dict(cursor.fetchall())
+        return {'max_in_flight': self.max_in_flight, 'in_flight': in_flight, 'waiting': waiting}
+
+
+def scheduler_enabled():
+    """Calls are scheduled unless LLM_SCHEDULER_ENABLED is set to 0/false"""
+    return os.environ.get('LLM_SCHEDULER_ENABLED', '1').lower() not in ('0', 'false', 'no')
+
+
+# Global instance
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,340 @@
+"""
+LLM Call Telemetry for Penora
+Latency histograms, token throughput and usage accounting for every DeepInfra call
+
+Each call is timed in three parts: time queued for a scheduler slot, time
+to the provider's first byte, and total latency. The prompt and completion
+token counts the provider reports (estimated from word counts when it
+doesn't) are kept with the model, the feature that made the call and its
+outcome (ok, empty, error, circuit_open, queue_timeout, deadline_exceeded,
+cancelled).
+
+Calls are aggregated into cumulative histograms, exposed in Prometheus
+format on /metrics, and a per-day usage rollup (calls, tokens, latency per
+model, feature and outcome) on /metrics/llm-usage for tuning max_tokens,
+PAGE_RETRIES and credit prices against real cost. Both live in SQLite so
+every worker on the node adds to the same figures. Recording never raises:
+a telemetry failure is logged and the call carries on.
+
+Settings:
+- LLM_TELEMETRY_DB: SQLite file shared by the workers (default: llm_telemetry.db in PENORA_DATA_DIR)
+- METRICS_TOKEN: bearer token the metrics endpoints require; they are off when unset (see routes.require_metrics_token)
+"""
+
+import sqlite3
+import logging
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the latency histogram buckets; a final +Inf bucket catches the rest
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+# Histogram metric name -> LLMCall attribute it measures
+HISTOGRAMS = {
+    'llm_queue_seconds': 'queue_seconds',
+    'llm_ttfb_seconds': 'ttfb',
+    'llm_latency_seconds': 'latency'
+}
+
+HISTOGRAM_HELP = {
+    'llm_queue_seconds': 'Time a call waited for a scheduler slot',
+    'llm_ttfb_seconds': 'Time from sending a call to the provider\'s first byte',
+    'llm_latency_seconds': 'Time from sending a call to its last byte'
+}
+
+# A token is roughly 0.75 words (see ai_service.WORDS_PER_TOKEN)
+WORDS_PER_TOKEN = 0.75
+
+OK = 'ok'
+EMPTY = 'empty'
+ERROR = 'error'
+CANCELLED = 'cancelled'
+# Exceptions recognised by name so this module doesn't import the client or scheduler
+OUTCOMES_BY_ERROR = {
+    'CircuitOpenError': 'circuit_open',
+    'SchedulerTimeout': 'queue_timeout',
+    'DeadlineExceeded': 'deadline_exceeded',
+    'GenerationCancelled': CANCELLED,
+    'GeneratorExit': CANCELLED
+}
+
+# Feature (story, rewrite_tool, file_processing...) the calls made in the current context are for
+_current_feature = contextvars.ContextVar('llm_telemetry_feature', default='other')
+
+
+@contextmanager
+def feature(name: str):
+    """Label the LLM calls made inside this block (or decorated function) with a feature name"""
+    token = _current_feature.set(name)
+    try:
+        yield
+    finally:
+        _current_feature.reset(token)
+
+
+def current_feature() -> str:
+    return _current_feature.get()
+
+
+def estimate_tokens(*texts) -> int:
+    return int(sum(len(text.split()) for text in texts if text) / WORDS_PER_TOKEN)
+
+
+class LLMCall:
+    """Measurements for one call, filled in while it runs"""
+
+    def __init__(self, model: str, feature_name: str):
+        self.model = model or 'unknown'
+        self.feature = feature_name
+        self.outcome = OK
+        # Filled by the client: prompt_tokens, completion_tokens and ttfb as the provider reports them
+        self.usage: Dict[str, Any] = {}
+        self.queue_seconds = 0.0
+        self.latency = None
+        self._created = time.monotonic()
+        self._sent = None
+
+    def started(self):
+        """The call has its slot and is being sent to the provider"""
+        self._sent = time.monotonic()
+        self.queue_seconds = self._sent - self._created
+
+    def finish(self):
+        now = time.monotonic()
+        if self._sent is None:
+            # Never left the queue
+            self.queue_seconds = now - self._created
+            return
+        self.latency = now - self._sent
+
+    @property
+    def ttfb(self) -> Optional[float]:
+        return self.usage.get('ttfb')
+
+    @property
+    def prompt_tokens(self) -> int:
+        return int(self.usage.get('prompt_tokens') or 0)
+
+    @property
+    def completion_tokens(self) -> int:
+        return int(self.usage.get('completion_tokens') or 0)
+
+    def estimate(self, prompt: str, system_msg: str, reply: Optional[str]):
+        """Fill in token counts the provider didn't report from the texts' word counts"""
+        self.usage.setdefault('prompt_tokens', estimate_tokens(prompt, system_msg))
+        self.usage.setdefault('completion_tokens', estimate_tokens(reply))
+
+
+class LLMTelemetry:
+    """SQLite-backed histograms and per-day usage rollup shared by every worker on the node"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.environ.get("LLM_TELEMETRY_DB") or data_path("llm_telemetry.db")
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                # Losing the last few counts in a power cut is fine; skip the per-commit fsync
+                conn.execute('PRAGMA synchronous=NORMAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize telemetry schema"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_histograms (
+                        metric TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        feature TEXT NOT NULL,
+                        bucket INTEGER NOT NULL,
+                        count INTEGER NOT NULL DEFAULT 0,
+                        PRIMARY KEY (metric, model, feature, bucket)
+                    )
+                """)
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_histogram_totals (
+                        metric TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        feature TEXT NOT NULL,
+                        count INTEGER NOT NULL DEFAULT 0,
+                        total REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (metric, model, feature)
+                    )
+                """)
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_usage_daily (
+                        day TEXT NOT NULL,
+                        model TEXT NOT NULL,
+                        feature TEXT NOT NULL,
+                        outcome TEXT NOT NULL,
+                        calls INTEGER NOT NULL DEFAULT 0,
+                        prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                        completion_tokens INTEGER NOT NULL DEFAULT 0,
+                        queue_seconds REAL NOT NULL DEFAULT 0,
+                        ttfb_seconds REAL NOT NULL DEFAULT 0,
+                        latency_seconds REAL NOT NULL DEFAULT 0,
+                        PRIMARY KEY (day, model, feature, outcome)
+                    )
+                """)
+
+                conn.commit()
+                logger.info("✅ LLM telemetry database initialized")
+        except Exception as e:
+            logger.error(f"❌ LLM telemetry database initialization failed: {e}")
+            raise
+
+    @contextmanager
+    def track(self, model: str, feature_name: Optional[str] = None):
+        """
+        Time one call to model and record it when the block exits.
+        Call started() on the yielded LLMCall once it leaves the queue, and
+        pass its usage dict to the client so provider token counts are kept.
+        """
+        call = LLMCall(model, feature_name or current_feature())
+        try:
+            yield call
+        except BaseException as e:
+            call.outcome = OUTCOMES_BY_ERROR.get(type(e).__name__, ERROR)
+            raise
+        finally:
+            call.finish()
+            self.record(call)
+
+    def record(self, call: LLMCall):
+        """Add a finished call to the histograms and today's rollup"""
+        try:
+            day = time.strftime('%Y-%m-%d', time.gmtime())
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+                for metric, attribute in HISTOGRAMS.items():
+                    value = getattr(call, attribute)
+                    if value is None:
+                        continue
+                    cursor.execute("""
+                        INSERT INTO llm_histograms (metric, model, feature, bucket, count) VALUES (?, ?, ?, ?, 1)
+                        ON CONFLICT(metric, model, feature, bucket) DO UPDATE SET count = count + 1
+                    """, (metric, call.model, call.feature, bisect.bisect_left(LATENCY_BUCKETS, value)))
+                    cursor.execute("""
+                        INSERT INTO llm_histogram_totals (metric, model, feature, count, total) VALUES (?, ?, ?, 1, ?)
+                        ON CONFLICT(metric, model, feature) DO UPDATE SET count = count + 1, total = total + excluded.total
+                    """, (metric, call.model, call.feature, value))
+
+                cursor.execute("""
+                    INSERT INTO llm_usage_daily (day, model, feature, outcome, calls, prompt_tokens, completion_tokens,
+                                                 queue_seconds, ttfb_seconds, latency_seconds)
+                    VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?)
+                    ON CONFLICT(day, model, feature, outcome) DO UPDATE SET
+                        calls = calls + 1,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        queue_seconds = queue_seconds + excluded.queue_seconds,
+                        ttfb_seconds = ttfb_seconds + excluded.ttfb_seconds,
+                        latency_seconds = latency_seconds + excluded.latency_seconds
+                """, (day, call.model, call.feature, call.outcome, call.prompt_tokens, call.completion_tokens,
+                      call.queue_seconds, call.ttfb or 0.0, call.latency or 0.0))
+                conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to record LLM telemetry: {e}")
+
+    def daily(self, days: int = 30) -> List[Dict[str, Any]]:
+        """Per-day usage for the last `days` days, newest first, with average latency and throughput"""
+        since = time.strftime('%Y-%m-%d', time.gmtime(time.time() - (days - 1) * 86400))
+        with self.get_db_connection() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("""
+                SELECT * FROM llm_usage_daily WHERE day >= ?
+                ORDER BY day DESC, model, feature, outcome
+            """, (since,)).fetchall()
+
+        usage = []
+        for row in rows:
+            entry = dict(row)
+            entry['avg_latency'] = round(row['latency_seconds'] / row['calls'], 3)
+            entry['avg_queue'] = round(row['queue_seconds'] / row['calls'], 3)
+            entry['tokens_per_second'] = (
+                round(row['completion_tokens'] / row['latency_seconds'], 1) if row['latency_seconds'] else 0.0
+            )
+            usage.append(entry)
+        return usage
+
+    def render_prometheus(self) -> str:
+        """All histograms and call/token counters in the Prometheus text exposition format"""
+        with self.get_db_connection() as conn:
+            buckets = conn.execute("SELECT metric, model, feature, bucket, count FROM llm_histograms").fetchall()
+            totals = conn.execute(
+                "SELECT metric, model, feature, count, total FROM llm_histogram_totals ORDER BY metric, model, feature"
+            ).fetchall()
+            usage = conn.execute("""
+                SELECT model, feature, outcome, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens)
+                FROM llm_usage_daily GROUP BY model, feature, outcome ORDER BY model, feature, outcome
+            """).fetchall()
+
+        counts = {}
+        for metric, model, feature_name, bucket, count in buckets:
+            counts[(metric, model, feature_name, bucket)] = count
+
+        lines = []
+        for metric in HISTOGRAMS:
+            name = f'penora_{metric}'
+            lines.append(f'# HELP {name} {HISTOGRAM_HELP[metric]}')
+            lines.append(f'# TYPE {name} histogram')
+            for total_metric, model, feature_name, count, total in totals:
+                if total_metric != metric:
+                    continue
+                labels = _labels(model=model, feature=feature_name)
+                cumulative = 0
+                for index, bound in enumerate(LATENCY_BUCKETS + ('+Inf',)):
+                    cumulative += counts.get((metric, model, feature_name, index), 0)
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_sum{{{labels}}} {total}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+
+        counters = (
+            ('penora_llm_calls_total', 'LLM calls by outcome', 3),
+            ('penora_llm_prompt_tokens_total', 'Prompt tokens sent', 4),
+            ('penora_llm_completion_tokens_total', 'Completion tokens received', 5)
+        )
+        for name, help_text, column in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for row in usage:
+                labels = _labels(model=row[0], feature=row[1], outcome=row[2])
+                lines.append(f'{name}{{{labels}}} {row[column]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels) -> str:
+    escaped = {key: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for key, value in labels.items()}
+    return ','.join(f'{key}="{value}"' for key, value in escaped.items())
+
+
+# Global instance
+llm_telemetry = LLMTelemetry()
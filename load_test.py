@@ -0,0 +1,260 @@
+"""
+End-to-end load test for Penora
+
+Replays a weighted mix of real user actions (/start-writing, the /sudowrite
+tools, /workspace and workspace downloads) against a running app and
+reports requests/sec and p50/p95/p99 latency per endpoint. Point the app at
+stub_llm_server.py so the run costs nothing on api.deepinfra.com:
+
+    python stub_llm_server.py --port 8001 --latency 0.3 --token-latency 0.01 --reply-words 300
+    DEEPINFRA_BASE_URL=http://127.0.0.1:8001/v1/openai DEEPINFRA_API_KEY=stub gunicorn -c gunicorn_config.py main:app
+    python load_test.py --base-url http://127.0.0.1:5000 --users 50 --duration 60
+
+Each virtual user signs in through the sukusuku.ai URL parameters (a new
+user starts with 250 credits), saves one workspace project to download, then
+picks actions by --mix weight with --think-time seconds between them. Users
+are named from --user-prefix, so a rerun with the same prefix reuses spent
+balances; change the prefix for a fresh set. /start-writing runs that are
+handed to the job queue are timed until the job finishes. Requests that end
+on /pricing (out of credits) are counted as errors.
+
+Usage:
+    python load_test.py --users 20 --duration 30 --mix write=3,rewrite=3,workspace=5,download=2
+    python load_test.py --users 100 --requests 2000 --pages 3 --model-type fast
+"""
+
+import argparse
+import random
+import statistics
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+SCENARIOS = ("start_writing", "write", "rewrite", "describe", "brainstorm", "workspace", "download")
+DEFAULT_MIX = "start_writing=2,write=2,rewrite=3,describe=2,brainstorm=2,workspace=5,download=3"
+DOWNLOAD_FORMATS = ("pdf", "docx", "txt")
+
+SAMPLE_TEXT = ("The lighthouse keeper watched the storm roll in across the bay, counting the seconds between "
+               "each flash of lightning. Below, the harbour lights went out one by one.")
+PROMPTS = (
+    "A lighthouse keeper finds a message in a bottle",
+    "Two rival bakers are snowed in together on Christmas Eve",
+    "A detective who can hear lies investigates her own disappearance",
+    "The last library on Mars gets a new librarian"
+)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def parse_mix(text):
+    """'write=3,workspace=5' -> {'write': 3.0, 'workspace': 5.0}"""
+    mix = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Unknown scenario '{name}' (choose from {', '.join(SCENARIOS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Results:
+    """Latency samples and error counts per endpoint, shared by every virtual user"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_samples = {}
+
+    def add(self, endpoint, seconds, error=None):
+        with self.lock:
+            self.latencies[endpoint].append(seconds)
+            if error:
+                self.errors[endpoint] += 1
+                self.error_samples.setdefault(endpoint, error)
+
+    @property
+    def total(self):
+        with self.lock:
+            return sum(len(samples) for samples in self.latencies.values())
+
+    def report(self, elapsed):
+        print(f"\n{'endpoint':<28} {'requests':>8} {'errors':>7} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        rows = sorted(self.latencies.items()) + [("TOTAL", [s for samples in self.latencies.values() for s in samples])]
+        for endpoint, samples in rows:
+            if not samples:
+                continue
+            errors = sum(self.errors.values()) if endpoint == "TOTAL" else self.errors[endpoint]
+            print(f"{endpoint:<28} {len(samples):>8} {errors:>7} {len(samples) / elapsed:>7.1f} "
+                  f"{statistics.median(samples):>7.2f}s {percentile(samples, 95):>7.2f}s "
+                  f"{percentile(samples, 99):>7.2f}s {max(samples):>7.2f}s")
+        for endpoint, error in sorted(self.error_samples.items()):
+            print(f"  first {endpoint} error: {error}")
+
+
+class VirtualUser:
+    """One signed-in browser session replaying the mix"""
+
+    def __init__(self, base_url, name, args, results):
+        self.base_url = base_url.rstrip("/")
+        self.name = name
+        self.args = args
+        self.results = results
+        self.http = requests.Session()
+        self.project_code = None
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    @staticmethod
+    def text():
+        # Vary every request so the app's single-flight replay and response cache don't serve it
+        return f"{SAMPLE_TEXT} Scene {random.randrange(10 ** 9)}."
+
+    def sign_in(self):
+        response = self.http.get(self.url("/"), params={
+            "user_id": self.name,
+            "email": f"{self.name}@loadtest.invalid",
+            "first_name": "Load",
+            "last_name": self.name
+        }, timeout=self.args.timeout)
+        response.raise_for_status()
+
+        self.http.post(self.url("/workspace/save"), data={"title": f"Load test {self.name}", "content": SAMPLE_TEXT * 20},
+                       timeout=self.args.timeout)
+        projects = self.http.get(self.url("/api/user-projects"), timeout=self.args.timeout).json().get("projects") or []
+        if projects:
+            self.project_code = projects[0]["id"]
+
+    def timed(self, endpoint, send):
+        """Time send(), recording an error for failed statuses and for redirects to /pricing"""
+        start = time.perf_counter()
+        error = None
+        try:
+            response = send()
+            if response.status_code >= 400:
+                error = f"HTTP {response.status_code}"
+            elif response.url.rstrip("/").endswith("/pricing"):
+                error = "out of credits"
+        except requests.RequestException as e:
+            response, error = None, str(e)
+        self.results.add(endpoint, time.perf_counter() - start, error)
+        return response
+
+    def start_writing(self):
+        data = {
+            "writing_type": "fresh",
+            "prompt": f"{random.choice(PROMPTS)} (draft {random.randrange(10 ** 9)})",
+            "page_count": self.args.pages,
+            "model_type": self.args.model_type,
+            "output_length": "medium"
+        }
+        start = time.perf_counter()
+        response = self.timed("POST /start-writing", lambda: self.http.post(self.url("/start-writing"), data=data,
+                                                                          timeout=self.args.timeout))
+        if response is not None and "/jobs/" in response.url:
+            self.wait_for_job(response.url.split("/jobs/")[1].split("/")[0], start)
+
+    def wait_for_job(self, job_id, start):
+        """Poll a queued generation and record the time from submit to result"""
+        error = "timed out"
+        while time.perf_counter() - start < self.args.timeout:
+            try:
+                status = self.http.get(self.url(f"/jobs/{job_id}"), timeout=self.args.timeout).json()
+            except (requests.RequestException, ValueError) as e:
+                error = str(e)
+                break
+            if status.get("status") == "completed":
+                error = None
+                break
+            if status.get("status") == "failed":
+                error = status.get("error") or "job failed"
+                break
+            time.sleep(0.5)
+        self.results.add("start-writing job", time.perf_counter() - start, error)
+
+    def write(self):
+        data = {"main_text": self.text(), "direction": "Continue the scene", "mode": "auto", "variants": 2}
+        self.timed("POST /sudowrite/write", lambda: self.http.post(self.url("/sudowrite/write"), data=data,
+                                                                  timeout=self.args.timeout))
+
+    def rewrite(self):
+        data = {"selected_text": self.text(), "rewrite_type": random.choice(["improve", "shorter", "longer"])}
+        self.timed("POST /sudowrite/rewrite", lambda: self.http.post(self.url("/sudowrite/rewrite"), data=data,
+                                                                    timeout=self.args.timeout))
+
+    def describe(self):
+        data = {"selected_text": self.text(), "sense_focus": "all"}
+        self.timed("POST /sudowrite/describe", lambda: self.http.post(self.url("/sudowrite/describe"), data=data,
+                                                                     timeout=self.args.timeout))
+
+    def brainstorm(self):
+        data = {"category": "plot_ideas", "context": self.text(), "count": 5}
+        self.timed("POST /sudowrite/brainstorm", lambda: self.http.post(self.url("/sudowrite/brainstorm"), data=data,
+                                                                       timeout=self.args.timeout))
+
+    def workspace(self):
+        self.timed("GET /workspace", lambda: self.http.get(self.url("/workspace"), timeout=self.args.timeout))
+
+    def download(self):
+        if not self.project_code:
+            return self.workspace()
+        fmt = random.choice(DOWNLOAD_FORMATS)
+        path = f"/workspace/download/{self.project_code}/{fmt}"
+        self.timed(f"GET download {fmt}", lambda: self.http.get(self.url(path), timeout=self.args.timeout))
+
+    def run(self, mix, stop):
+        try:
+            self.sign_in()
+        except requests.RequestException as e:
+            self.results.add("sign-in", 0.0, str(e))
+            return
+        names, weights = list(mix), list(mix.values())
+        while not stop():
+            getattr(self, random.choices(names, weights)[0])()
+            if self.args.think_time:
+                time.sleep(random.uniform(0, 2 * self.args.think_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000", help="Running Penora app")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run (ignored with --requests)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests instead")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"Scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--think-time", type=float, default=1.0, help="Mean seconds a user pauses between actions")
+    parser.add_argument("--pages", type=int, default=1, help="Pages per /start-writing generation")
+    parser.add_argument("--model-type", default="balanced")
+    parser.add_argument("--timeout", type=float, default=600, help="Per-request timeout (s)")
+    parser.add_argument("--user-prefix", default=f"load-{uuid.uuid4().hex[:6]}", help="Virtual user id prefix")
+    args = parser.parse_args()
+
+    results = Results()
+    started = time.perf_counter()
+    if args.requests:
+        stop = lambda: results.total >= args.requests
+    else:
+        stop = lambda: time.perf_counter() - started >= args.duration
+
+    users = [VirtualUser(args.base_url, f"{args.user_prefix}-{i}", args, results) for i in range(args.users)]
+    threads = [threading.Thread(target=user.run, args=(args.mix, stop), daemon=True) for user in users]
+    print(f"{args.users} users against {args.base_url} with mix "
+          f"{', '.join(f'{name}={weight:g}' for name, weight in args.mix.items())}")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results.report(time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""
+Latency-aware Model Router for Penora
+
+Picks which model serves each call. Every call's latency, output
+tokens per second and success/failure are folded into per-model EWMAs; when
+the requested model is predicted to blow the latency SLO, is failing too
+often, or has its circuit breaker open, the call goes to the model's
+designated `fallback` in llm_backends.MODELS instead (smart -> balanced,
+creative -> balanced, local models -> balanced). A fallback served by a model
+already in the chain on the same backend is skipped, since it would fail the
+same way. A model that was passed over is
+tried again once its stats are older than the probe interval, so it is
+picked up again when it recovers.
+
+Settings:
+- MODEL_LATENCY_SLO: seconds one model call may take (default: 45)
+- MODEL_ROUTER_ALPHA: EWMA weight of the newest sample (default: 0.2)
+- MODEL_ROUTER_MAX_ERROR_RATE: error rate above which a model is passed over (default: 0.5)
+- MODEL_ROUTER_PROBE_AFTER: seconds before a passed-over model is tried again (default: 30)
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, List, Optional
+
+from llm_backends import MODELS
+from llm_resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_SLO = 45.0
+DEFAULT_ALPHA = 0.2
+DEFAULT_MAX_ERROR_RATE = 0.5
+DEFAULT_PROBE_AFTER = 30.0
+# Below this many samples a model's averages are too noisy to route on
+MIN_SAMPLES = 3
+
+
+class ModelStats:
+    """EWMAs of one model's latency, output tokens/sec and error rate"""
+
+    def __init__(self):
+        self.latency = None
+        self.tokens_per_second = None
+        self.error_rate = 0.0
+        self.samples = 0
+        self.last_sample = 0.0
+
+    def update(self, alpha: float, seconds: float, tokens: int, error: bool):
+        def ewma(current, value):
+            return value if current is None else (1 - alpha) * current + alpha * value
+
+        # Failed calls count towards latency too: a timeout is the slowest answer there is
+        self.latency = ewma(self.latency, seconds)
+        if not error and tokens and seconds > 0:
+            self.tokens_per_second = ewma(self.tokens_per_second, tokens / seconds)
+        self.error_rate = ewma(self.error_rate if self.samples else None, 1.0 if error else 0.0)
+        self.samples += 1
+        self.last_sample = time.monotonic()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'latency': round(self.latency, 3) if self.latency is not None else None,
+            'tokens_per_second': round(self.tokens_per_second, 1) if self.tokens_per_second is not None else None,
+            'error_rate': round(self.error_rate, 3),
+            'samples': self.samples
+        }
+
+
+class ModelRouter:
+    """Chooses a model per call from live latency and error stats, falling back along each model's chain"""
+
+    def __init__(self, models: Optional[Dict[str, Dict[str, Any]]] = None, slo: Optional[float] = None,
+                 alpha: Optional[float] = None, max_error_rate: Optional[float] = None,
+                 probe_after: Optional[float] = None):
+        self.models = models or MODELS
+        self.slo = float(slo or os.environ.get('MODEL_LATENCY_SLO', DEFAULT_LATENCY_SLO))
+        self.alpha = float(alpha or os.environ.get('MODEL_ROUTER_ALPHA', DEFAULT_ALPHA))
+        self.max_error_rate = float(max_error_rate or os.environ.get('MODEL_ROUTER_MAX_ERROR_RATE', DEFAULT_MAX_ERROR_RATE))
+        self.probe_after = float(probe_after or os.environ.get('MODEL_ROUTER_PROBE_AFTER', DEFAULT_PROBE_AFTER))
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_type: str, seconds: float, tokens: int = 0, error: bool = False):
+        """Fold one finished call into the model's averages"""
+        with self._lock:
+            self._stats.setdefault(model_type, ModelStats()).update(self.alpha, seconds, tokens, error)
+
+    def _chain(self, model_type: str) -> List[str]:
+        """The model followed by its fallbacks that run a different model, in order"""
+        chain, names = [], set()
+        while model_type in self.models and model_type not in chain:
+            name = (self.models[model_type].get('backend'), self.models[model_type]['name'])
+            if name not in names:
+                chain.append(model_type)
+                names.add(name)
+            model_type = self.models[model_type].get('fallback')
+        return chain
+
+    def _breaker(self, model_type: str, breakers):
+        # A BackendRouter's breakers know which backend runs each model type
+        for_model_type = getattr(breakers, 'for_model_type', None)
+        return for_model_type(model_type) if for_model_type else breakers.get(self.models[model_type]['name'])
+
+    def _healthy(self, model_type: str, slo: float, breakers=None) -> bool:
+        if breakers is not None and self._breaker(model_type, breakers).state == CircuitBreaker.OPEN:
+            return False
+        with self._lock:
+            stats = self._stats.get(model_type)
+            if stats is None or stats.samples < MIN_SAMPLES:
+                return True
+            if time.monotonic() - stats.last_sample > self.probe_after:
+                # Stale stats: give the model another chance to show it has recovered
+                return True
+            return stats.error_rate <= self.max_error_rate and stats.latency <= slo
+
+    def candidates(self, model_type: str, slo: Optional[float] = None, breakers=None) -> List[str]:
+        """
+        Models to try for one call, best first: healthy models along the fallback
+        chain, then the unhealthy ones as a last resort. breakers is the client's
+        CircuitBreakerRegistry, if it has one.
+        """
+        chain = self._chain(model_type) or ['balanced']
+        slo = slo or self.slo
+        healthy = [m for m in chain if self._healthy(m, slo, breakers)]
+        if chain[0] not in healthy:
+            logger.debug(f"Routing {model_type} requests to {healthy[0] if healthy else chain[0]}")
+        return healthy + [m for m in chain if m not in healthy]
+
+    def choose(self, model_type: str, slo: Optional[float] = None, breakers=None) -> str:
+        """The model one call should use"""
+        return self.candidates(model_type, slo, breakers)[0]
+
+    def expected_latency(self, model_type: str) -> Optional[float]:
+        """The model's average call latency, or None until it has enough samples"""
+        with self._lock:
+            stats = self._stats.get(model_type)
+            if stats is None or stats.samples < MIN_SAMPLES:
+                return None
+            return stats.latency
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {model_type: stats.to_dict() for model_type, stats in self._stats.items()}
+
+
+def billed_credits(quoted_credits: int, model_type: str, models_used: Dict[str, int],
+                   multipliers: Dict[str, float]) -> int:
+    """
+    Credits for a finished generation quoted for model_type, priced by the
+    models that actually served its calls (models_used: model -> call count).
+    Falling back to a cheaper model lowers the charge; it never exceeds the quote.
+    """
+    calls = sum(models_used.values())
+    requested = multipliers.get(model_type, 1.0)
+    if not calls or not requested:
+        return quoted_credits
+    served = sum(multipliers.get(model, 1.0) * count for model, count in models_used.items()) / calls
+    if served >= requested:
+        return quoted_credits
+    return max(1, int(round(quoted_credits * served / requested)))
+
+
+# Global instance shared by every AIService in the process
+model_router = ModelRouter()
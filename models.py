@@ -4,6 +4,7 @@ from datetime import datetime
 from sqlalchemy import func, Text, Boolean
 import secrets
 import string
+from export_cache import export_cache
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -133,20 +134,22 @@ class WorkspaceProject(db.Model):
             self.storage_size = text_size + 1024  # 1KB overhead
     
     def update_content(self, title, text):
-        """Update project content and recalculate storage"""
+        """Update project content, recalculate storage and drop its cached downloads"""
         self.project_title = title
         self.generation_text = text
         self.calculate_storage_size()
         self.updated_at = datetime.utcnow()
+        export_cache.invalidate(self.code)
     
     def get_storage_mb(self):
         """Get storage size in MB"""
         return round(self.storage_size / (1024 * 1024), 3)
     
     def soft_delete(self):
-        """Soft delete the project"""
+        """Soft delete the project and drop its cached downloads"""
         self.is_deleted = True
         self.updated_at = datetime.utcnow()
+        export_cache.invalidate(self.code)
     
     def __repr__(self):
         return f'<WorkspaceProject {self.code}: {self.project_title[:30]}...>'
@@ -1,11 +1,9 @@
-import os
 from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY
 from io import BytesIO
-import tempfile
 
 class PDFService:
     def __init__(self):
@@ -57,93 +55,85 @@ class PDFService:
             textColor='#7f8c8d'
         )
     
-    def generate_pdf(self, title, content, author="Penora AI"):
-        """Generate PDF from title and content - main method used by routes"""
-        # Convert content to chapters format if it's a single string
+    @staticmethod
+    def split_chapters(content):
+        """Chapters of a story given as one string (split on its page headers) or already as a list"""
         if isinstance(content, str):
             # Split content by page headers or use as single chapter
             if 'Page ' in content:
                 chapters = content.split('Page ')[1:]  # Skip first empty element
-                chapters = ['Page ' + chapter for chapter in chapters]
-            else:
-                chapters = [content]
-        else:
-            chapters = content
+                return ['Page ' + chapter for chapter in chapters]
+            return [content]
+        return content
+    
+    def generate_pdf(self, title, content, author="Penora AI"):
+        """Generate PDF from title and content - main method used by routes"""
+        return self.create_story_pdf(title, self.split_chapters(content), author)
+    
+    def write_pdf(self, title, content, output, author="Penora AI"):
+        """
+        Render title and content as a PDF straight into output, any writable
+        binary file object (a response buffer, a cache file), without a
+        temporary file or an intermediate copy of the document
+        """
+        chapters = self.split_chapters(content)
         
-        return self.create_story_pdf(title, chapters, author)
-
-    def create_story_pdf(self, title, chapters, author="Penora AI"):
-        """Create a PDF from story chapters"""
-        try:
-            # Create a temporary file for the PDF
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            temp_filename = temp_file.name
-            temp_file.close()
-            
-            # Create the PDF document
-            doc = SimpleDocTemplate(
-                temp_filename,
-                pagesize=A4,
-                rightMargin=72,
-                leftMargin=72,
-                topMargin=72,
-                bottomMargin=18
-            )
-            
-            # Build the story content
-            story_content = []
-            
-            # Add title page
-            story_content.append(Spacer(1, 2*inch))
-            story_content.append(Paragraph(title, self.title_style))
-            story_content.append(Spacer(1, 0.5*inch))
-            story_content.append(Paragraph(f"Generated by {author}", self.meta_style))
+        # Create the PDF document
+        doc = SimpleDocTemplate(
+            output,
+            pagesize=A4,
+            rightMargin=72,
+            leftMargin=72,
+            topMargin=72,
+            bottomMargin=18
+        )
+        
+        # Build the story content
+        story_content = []
+        
+        # Add title page
+        story_content.append(Spacer(1, 2*inch))
+        story_content.append(Paragraph(title, self.title_style))
+        story_content.append(Spacer(1, 0.5*inch))
+        story_content.append(Paragraph(f"Generated by {author}", self.meta_style))
+        story_content.append(Spacer(1, 0.25*inch))
+        story_content.append(Paragraph(f"Created with Penora AI", self.meta_style))
+        story_content.append(PageBreak())
+        
+        # Add chapters
+        for i, chapter_content in enumerate(chapters, 1):
+            # Chapter title
+            story_content.append(Paragraph(f"Chapter {i}", self.chapter_style))
             story_content.append(Spacer(1, 0.25*inch))
-            story_content.append(Paragraph(f"Created with Penora AI", self.meta_style))
-            story_content.append(PageBreak())
-            
-            # Add chapters
-            for i, chapter_content in enumerate(chapters, 1):
-                # Chapter title
-                story_content.append(Paragraph(f"Chapter {i}", self.chapter_style))
-                story_content.append(Spacer(1, 0.25*inch))
-                
-                # Chapter content - split into paragraphs
-                paragraphs = chapter_content.strip().split('\n\n')
-                for paragraph in paragraphs:
-                    if paragraph.strip():
-                        # Clean up the paragraph text
-                        clean_paragraph = paragraph.strip().replace('\n', ' ')
-                        story_content.append(Paragraph(clean_paragraph, self.body_style))
-                
-                # Add page break after each chapter except the last
-                if i < len(chapters):
-                    story_content.append(PageBreak())
-            
-            # Build the PDF
-            doc.build(story_content)
             
-            # Read the PDF content
-            with open(temp_filename, 'rb') as pdf_file:
-                pdf_content = pdf_file.read()
+            # Chapter content - split into paragraphs
+            paragraphs = chapter_content.strip().split('\n\n')
+            for paragraph in paragraphs:
+                if paragraph.strip():
+                    # Clean up the paragraph text
+                    clean_paragraph = paragraph.strip().replace('\n', ' ')
+                    story_content.append(Paragraph(clean_paragraph, self.body_style))
             
-            # Clean up the temporary file
-            os.unlink(temp_filename)
+            # Add page break after each chapter except the last
+            if i < len(chapters):
+                story_content.append(PageBreak())
+        
+        # Build the PDF
+        doc.build(story_content)
+
+    def create_story_pdf(self, title, chapters, author="Penora AI"):
+        """Create a PDF from story chapters, returning its bytes as pdf_content"""
+        try:
+            buffer = BytesIO()
+            self.write_pdf(title, chapters, buffer, author)
             
             return {
                 "success": True,
-                "pdf_content": pdf_content,
+                "pdf_content": buffer.getvalue(),
                 "filename": f"{title.replace(' ', '_')}.pdf"
             }
             
         except Exception as e:
-            # Clean up on error
-            try:
-                if 'temp_filename' in locals() and temp_filename and os.path.exists(temp_filename):
-                    os.unlink(temp_filename)
-            except:
-                pass
-            
             return {
                 "success": False,
                 "error": f"Failed to create PDF: {str(e)}"
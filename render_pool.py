@@ -0,0 +1,188 @@
+"""
+Render Pool for Penora
+Runs CPU-bound PDF and DOCX rendering in separate processes, off the request threads
+
+reportlab and python-docx are pure Python, so a render holds the GIL for as
+long as it takes and stalls every other request thread in the gunicorn
+worker. Export routes hand PDF and DOCX renders to a small pool of render
+processes instead; each render writes straight into the file the download
+is streamed from (or sends its bytes back for an in-memory buffer).
+
+Every render gets a timeout, capped by the request deadline, and every
+render process runs under a memory cap (RLIMIT_AS), so a runaway export
+fails on its own instead of taking the worker down with it. Each render
+process sits in its own slot, so a render that runs past its timeout has
+just its own process killed (a fresh one takes the slot on its next job)
+while renders in the other slots carry on; one that never got a slot (the
+pool was busy) is just dropped.
+
+Each gunicorn worker process starts its own pool on its first export.
+
+Settings:
+- RENDER_POOL_WORKERS: render processes per gunicorn worker (default: 2; 0 renders in the request thread)
+- RENDER_TIMEOUT: seconds one render may take, queueing included (default: 60)
+- RENDER_MAX_MEMORY_MB: address space each render process may use (default: 1024; 0 for no cap)
+"""
+
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Callable, Optional
+
+import request_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class RenderTimeout(Exception):
+    """A render didn't finish within its timeout"""
+
+
+def _limit_memory(max_bytes: int):
+    """Render process initializer: cap the address space it may use"""
+    if max_bytes:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (max_bytes, max_bytes))
+
+
+def _render(format: str, title: str, content: str, path: Optional[str] = None) -> Optional[bytes]:
+    """
+    Render content as a 'pdf' or 'docx' into the file at path, or return
+    its bytes when there is none. Runs in a render process.
+    """
+    from io import BytesIO
+    if format == 'pdf':
+        from pdf_service import pdf_service
+        write = pdf_service.write_pdf
+    elif format == 'docx':
+        from export_service import export_service
+        write = export_service.write_doc_file
+    else:
+        raise ValueError(f"Unsupported render format: {format}")
+
+    if path:
+        with open(path, 'wb') as output:
+            write(title, content, output)
+        return None
+    output = BytesIO()
+    write(title, content, output)
+    return output.getvalue()
+
+
+class RenderPool:
+    """Bounded pool of render processes with per-job timeouts and per-process memory caps"""
+
+    def __init__(self, workers=None, timeout=None, max_memory_mb=None):
+        self.workers = int(workers if workers is not None else os.environ.get("RENDER_POOL_WORKERS", 2))
+        self.timeout = float(timeout or os.environ.get("RENDER_TIMEOUT", 60))
+        max_memory_mb = float(max_memory_mb if max_memory_mb is not None else os.environ.get("RENDER_MAX_MEMORY_MB", 1024))
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        # One single-process executor per slot, and the slots free to take a job
+        self._pools = []
+        self._free = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _slots(self) -> queue.LifoQueue:
+        # Set up lazily, and again in a forked gunicorn worker
+        with self._lock:
+            if self._free is None or self._pool_pid != os.getpid():
+                self._pools = [None] * self.workers
+                self._free = queue.LifoQueue()
+                for slot in range(self.workers):
+                    self._free.put(slot)
+                self._pool_pid = os.getpid()
+            return self._free
+
+    def _executor(self, slot: int) -> ProcessPoolExecutor:
+        # The slot's process is started on its first job, and again after a recycle
+        with self._lock:
+            if self._pools[slot] is None:
+                # spawn rather than fork: the request process has threads running
+                self._pools[slot] = ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_limit_memory,
+                    initargs=(self.max_memory_bytes,)
+                )
+            return self._pools[slot]
+
+    def _recycle(self, slot: int, pool: ProcessPoolExecutor):
+        """Kill the process of one slot's pool (its render has hung or died); the slot starts afresh on its next job"""
+        with self._lock:
+            if self._pools[slot] is pool:
+                self._pools[slot] = None
+        processes = list((pool._processes or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.kill()
+
+    def close(self):
+        """Stop every render process"""
+        with self._lock:
+            pools, self._pools, self._free = self._pools, [], None
+        for pool in pools:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None) -> Any:
+        """
+        fn(*args) in a render process; fn and its arguments must pickle.
+        Raises RenderTimeout past the timeout, MemoryError past the memory
+        cap, and whatever fn raises.
+        """
+        if self.workers <= 0:
+            return fn(*args)
+
+        timeout = request_deadline.cap(timeout or self.timeout)
+        deadline = time.monotonic() + timeout
+        free = self._slots()
+        try:
+            slot = free.get(timeout=timeout)
+        except queue.Empty:
+            raise RenderTimeout(f"The render pool was busy for {timeout:.0f}s")
+        try:
+            pool = self._executor(slot)
+            future = pool.submit(fn, *args)
+            try:
+                return future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                logger.warning(f"⏱️ Render ran past {timeout:.0f}s, restarting its render process")
+                self._recycle(slot, pool)
+                raise RenderTimeout(f"Rendering took longer than {timeout:.0f}s")
+            except BrokenProcessPool:
+                logger.warning("💥 A render process died, restarting it")
+                self._recycle(slot, pool)
+                raise
+        finally:
+            free.put(slot)
+
+    def render(self, format: str, title: str, content: str, output: BinaryIO, timeout: Optional[float] = None):
+        """
+        Render content as a 'pdf', 'docx' or 'txt' into output. A file on
+        disk (such as an export cache file) is written by the render process
+        directly; anything else gets the rendered bytes written to it. TXT
+        is cheap and written in the calling thread.
+        """
+        if format == 'txt':
+            from export_service import export_service
+            result = export_service.create_txt_file(title, content)
+            if not result.get('success'):
+                raise Exception(result.get('error', 'Unknown error'))
+            output.write(result['data'])
+            return
+        path = getattr(output, 'name', None)
+        if self.workers > 0 and isinstance(path, str) and os.path.isfile(path):
+            self.run(_render, format, title, content, path, timeout=timeout)
+        else:
+            output.write(self.run(_render, format, title, content, timeout=timeout))
+
+
+# Global instance
+render_pool = RenderPool()
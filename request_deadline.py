@@ -0,0 +1,75 @@
+"""
+Request Deadlines for Penora
+Carries one time budget from an HTTP request down to every LLM call it makes
+
+gunicorn kills a worker whose request runs past its `timeout`, losing every
+page already generated. Instead, each generating request gets a deadline a
+safety margin short of that limit. The deadline lives in a contextvar, so it
+follows the request into AIService's thread pools and the async gateway's
+event loop. Code downstream works from the time that is left:
+- HTTP timeouts to DeepInfra are capped at it, and retries stop when it runs out
+- the model router prefers models fast enough to answer within it
+- the scheduler stops waiting for a slot once it is gone
+- AIService declines a call that can't finish in time with DeadlineExceeded,
+  so a multi-page generation returns the pages finished so far instead of
+  being killed mid-way
+
+Work outside a deadline block (job workers, scripts) has no deadline.
+
+Settings:
+- GUNICORN_TIMEOUT: worker timeout the request deadline is derived from (default: 300)
+- REQUEST_DEADLINE_MARGIN: seconds kept back for charging, saving and rendering the response (default: 30)
+"""
+
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+# time.monotonic() by which the current request's work must be done; None when unbounded
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """Not enough of the request's time budget is left for this work"""
+
+
+def request_budget() -> float:
+    """Seconds one HTTP request may spend generating"""
+    return float(os.environ.get('GUNICORN_TIMEOUT', 300)) - float(os.environ.get('REQUEST_DEADLINE_MARGIN', 30))
+
+
+@contextmanager
+def deadline(seconds: Optional[float] = None):
+    """Give the work inside this block `seconds` (default: the request budget); nesting can only shorten it"""
+    at = time.monotonic() + (request_budget() if seconds is None else seconds)
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(current, at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None when there is none"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def check(needed: float = 0.0, what: str = "This step"):
+    """Raise DeadlineExceeded unless at least `needed` seconds are left"""
+    left = remaining()
+    if left is not None and left <= needed:
+        raise DeadlineExceeded(f"{what} needs about {needed:.0f}s but only {max(0.0, left):.0f}s of the request's time is left")
+
+
+def cap(timeout: float) -> float:
+    """timeout shortened to the time left; raises DeadlineExceeded once none is"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded("The request's time budget is spent")
+    return min(timeout, left)
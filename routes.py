@@ -1,4 +1,4 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, session, g
+from flask import render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, session, g, Response, stream_with_context
 from io import BytesIO
 from app import app, db
 from models import User, Transaction, Generation, CreditPackage, WorkspaceProject
@@ -9,6 +9,10 @@ from sukusuku_integration import sukusuku_integration, require_sukusuku_auth, ge
 from shared_credit_workspace_system import unified_system
 from unified_api_endpoints import register_unified_apis
 from jwt_sukusuku_auth import sukusuku_jwt_auth
+import request_deadline
+from request_deadline import DeadlineExceeded
+from billing import (calculate_page_credits, credits_for_pages, credits_already_charged,
+                     credits_for_generation, record_delivery)
 
 def deduct_user_credits_safe(user_data, amount, description="Credit usage"):
     """Enhanced unified credit deduction for both Penora and ImageGene with real-time sync"""
@@ -86,10 +90,15 @@ def deduct_user_credits_safe(user_data, amount, description="Credit usage"):
         logging.error(f"❌ Full traceback: {traceback.format_exc()}")
         return False
 from razorpay_service import razorpay_service
+import os
 import logging
 import time
 import sqlite3
 import requests
+import json
+import hmac
+import secrets
+import functools
 from datetime import datetime
 
 # Configure logger for routes
@@ -127,6 +136,34 @@ def health_detailed():
             status["checks"]["auth"] = {"status": "error", "message": str(auth_error)}
             status["status"] = "degraded"
         
+        # Background job queue depth (informational, never degrades health)
+        try:
+            from job_queue import job_queue
+            status["checks"]["job_queue"] = dict(job_queue.stats(), status="ok", enabled=job_queue_enabled())
+        except Exception as queue_error:
+            status["checks"]["job_queue"] = {"status": "error", "message": str(queue_error)}
+        
+        # LLM response cache counters (informational, never degrades health)
+        try:
+            from llm_cache import llm_cache
+            status["checks"]["llm_cache"] = dict(llm_cache.stats(), status="ok")
+        except Exception as cache_error:
+            status["checks"]["llm_cache"] = {"status": "error", "message": str(cache_error)}
+        
+        # Per-model latency/error averages the router routes on (informational, never degrades health)
+        try:
+            from model_router import model_router
+            status["checks"]["model_router"] = {"status": "ok", "slo": model_router.slo, "models": model_router.stats()}
+        except Exception as router_error:
+            status["checks"]["model_router"] = {"status": "error", "message": str(router_error)}
+        
+        # Node-wide LLM slots in use and calls waiting for one (informational, never degrades health)
+        try:
+            from llm_scheduler import llm_scheduler
+            status["checks"]["llm_scheduler"] = dict(llm_scheduler.stats(), status="ok")
+        except Exception as scheduler_error:
+            status["checks"]["llm_scheduler"] = {"status": "error", "message": str(scheduler_error)}
+        
         status["timestamp"] = datetime.now().isoformat()
         return jsonify(status), 200 if status["status"] == "healthy" else 503
         
@@ -137,6 +174,43 @@ def health_detailed():
             "timestamp": datetime.now().isoformat()
         }), 500
 
+def require_metrics_token(func):
+    """Only serve the metrics endpoints to callers sending 'Authorization: Bearer $METRICS_TOKEN'; off when it's unset"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        expected = os.environ.get('METRICS_TOKEN', '')
+        if not expected:
+            return jsonify({"error": "Metrics are disabled"}), 404
+        sent = request.headers.get('Authorization', '')
+        if not sent.startswith('Bearer ') or not hmac.compare_digest(sent[len('Bearer '):], expected):
+            return jsonify({"error": "Unauthorized"}), 401, {'WWW-Authenticate': 'Bearer'}
+        return func(*args, **kwargs)
+    return wrapper
+
+@app.route('/metrics')
+@require_metrics_token
+def metrics():
+    """LLM call latency histograms, token and export counters in Prometheus text format"""
+    from llm_telemetry import llm_telemetry
+    from export_metrics import export_metrics
+    return Response(llm_telemetry.render_prometheus() + export_metrics.render_prometheus(),
+                    mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics/exports')
+@require_metrics_token
+def export_usage():
+    """Export cache hit rate and background pre-renders by format"""
+    from export_metrics import export_metrics
+    return jsonify({"formats": export_metrics.summary()})
+
+@app.route('/metrics/llm-usage')
+@require_metrics_token
+def llm_usage():
+    """Per-day LLM calls, tokens and latency by model, feature and outcome"""
+    from llm_telemetry import llm_telemetry
+    days = max(1, min(request.args.get('days', 30, type=int), 365))
+    return jsonify({"days": days, "usage": llm_telemetry.daily(days)})
+
 @app.route('/debug-auth')
 def debug_auth():
     """Debug route to inspect authentication state"""
@@ -475,6 +549,114 @@ def account():
                          workspace_projects=workspace_projects,
                          storage_stats=storage_stats)
 
+def generation_id_for(user_data, prompt, page_count, model_type):
+    """Checkpoint id of a multi-page generation, so a resubmit resumes it (see generation_checkpoints); None for one page"""
+    if page_count <= 1:
+        return None
+    return ai_service.checkpoints.make_id(user_data['user_id'], prompt, page_count, model_type)
+
+def save_generation_to_workspace(user_data, title, content):
+    """Save a finished generation to the user's workspace, returning the project code or None"""
+    try:
+        from workspace_service import WorkspaceService
+        logging.info(f"🔄 Attempting to save to workspace: user_id={user_data['user_id']}, title='{title}'")
+        success, project, message = WorkspaceService.save_generation(user_data['user_id'], title, content)
+        if success and project:
+            project_code = getattr(project, 'code', None)
+            logging.info(f"✅ Workspace save successful: code={project_code}")
+            return project_code
+        logging.error(f"❌ Workspace save failed: {message}")
+    except Exception as workspace_error:
+        logging.error(f"❌ Workspace save error: {workspace_error}")
+    return None
+
+def sync_session_credits(user_data, credits):
+    """Bring this session's copy of the user's balance in line with a charge made by another request or worker"""
+    user_data['credits'] = credits
+    session[f"user_credits_{user_data['user_id']}"] = credits
+    if 'user_data' in session:
+        session['user_data']['credits'] = credits
+        session.modified = True
+
+def replayable_generation(result):
+    """Whether a duplicate request may be handed this result instead of running its own"""
+    return bool(result.get('success', True) and result.get('charged', True) and not result.get('partial'))
+
+# Shown to a resubmit that outwaited its request's deadline while the original was still generating
+STILL_RUNNING_MESSAGE = "This exact request is still running. Check back shortly for its result instead of submitting it again."
+
+def single_flight_generation(user_data, action, params, work):
+    """
+    Run work() - a generation and its credit deduction, returning a JSON-serializable
+    result - once for identical concurrent requests from this user (see single_flight).
+    Duplicates from double-clicks and resubmits, on any worker, get the original's
+    result without being charged again; a 'balance' in it is synced to their session.
+    Failed, partial and uncharged results aren't shared, so a resubmit runs again.
+    work() runs under the request's deadline (see request_deadline), and a
+    duplicate waits no longer than that; if the original is still running by
+    then, the duplicate gets a failed result flagged 'in_progress'.
+    """
+    from single_flight import single_flight, SingleFlightTimeout
+    from llm_scheduler import LLMScheduler
+    key = single_flight.make_key(str(user_data['user_id']), action, params)
+    # The model calls made by work() share DeepInfra capacity fairly with other users (see llm_scheduler)
+    with LLMScheduler.user_context(user_data['user_id']), request_deadline.deadline():
+        try:
+            result, leader = single_flight.run(key, work, wait_timeout=request_deadline.remaining(),
+                                               replay=replayable_generation)
+        except SingleFlightTimeout:
+            # The original will finish (and charge) on its own; this copy must not start another run
+            logger.info(f"⏳ Duplicate {action} request gave up waiting for the original")
+            return {'success': False, 'in_progress': True, 'error': STILL_RUNNING_MESSAGE}
+    if not leader and result.get('balance') is not None:
+        sync_session_credits(user_data, result['balance'])
+    return result
+
+def job_queue_enabled():
+    """Generations go through job_queue (run by job_worker.py) instead of inline when JOB_QUEUE_ENABLED is set"""
+    return os.environ.get('JOB_QUEUE_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+@app.context_processor
+def inject_job_queue_flag():
+    return {'job_queue_enabled': job_queue_enabled()}
+
+# Seconds a stream token from /start-writing/live stays valid
+STREAM_TOKEN_MAX_AGE = 600
+
+def stream_csrf_token():
+    """Per-session token the /start-writing form posts back to /start-writing/live"""
+    if 'stream_csrf' not in session:
+        session['stream_csrf'] = secrets.token_urlsafe(32)
+    return session['stream_csrf']
+
+@app.context_processor
+def inject_stream_csrf_token():
+    return {'stream_csrf_token': stream_csrf_token}
+
+def _stream_token_serializer():
+    from itsdangerous import URLSafeTimedSerializer
+    return URLSafeTimedSerializer(app.secret_key, salt='start-writing-stream')
+
+def enqueue_generation(user_data, kind, title, credits_needed, description, **payload):
+    """
+    Queue a generation for job_worker.py; credits are charged when the job completes.
+    A resubmit of the same generation gets the job already queued for it, or
+    None if the original request is still queueing it.
+    """
+    from job_queue import job_queue
+    params = [kind, dict(payload)]
+    payload.update(
+        title=title,
+        credits_needed=credits_needed,
+        description=description,
+        username=user_data.get('username', 'Unknown'),
+        email=user_data.get('email', 'unknown@example.com'),
+        credits=user_data['credits']
+    )
+    queued = single_flight_generation(user_data, 'enqueue', params,
+                                      lambda: {'job_id': job_queue.enqueue(user_data['user_id'], kind, payload)})
+    return queued.get('job_id')
+
 @app.route('/start-writing', methods=['GET', 'POST'])
 def start_writing():
     """Unified Start Writing interface with fresh projects and file upload"""
@@ -497,69 +679,67 @@ def start_writing():
             output_length = request.form.get('output_length', 'medium')
             
             # Calculate credits needed with model multiplier
-            model_multipliers = {
-                'creative': 1.5,
-                'balanced': 1.0,
-                'fast': 0.5,
-                'summarize': 0.3
-            }
-            base_credits = page_count
-            multiplier = model_multipliers.get(model_type, 1.0)
-            credits_needed = max(1, int(base_credits * multiplier))
+            credits_needed = calculate_page_credits(page_count, model_type)
             
             if credits < credits_needed:
                 flash(f'You need at least {credits_needed} credits to generate {page_count} page(s) with {model_type} model. You have {credits} credits.', 'warning')
                 return redirect(url_for('pricing'))
             
+            if job_queue_enabled():
+                title = f"{page_count} Page(s) - {prompt[:30]}..." if len(prompt) > 30 else f"{page_count} Page(s) - {prompt}"
+                job_id = enqueue_generation(user_data, 'story', title, credits_needed,
+                                            f"{page_count} page generation: {prompt[:50]}",
+                                            prompt=prompt, page_count=page_count, model_type=model_type,
+                                            generation_id=generation_id_for(user_data, prompt, page_count, model_type))
+                if job_id is None:
+                    flash(STILL_RUNNING_MESSAGE, 'info')
+                    return render_template('start_writing.html', user_data=user_data, credits=credits)
+                return redirect(url_for('job_view', job_id=job_id))
+            
             try:
-                if page_count == 1:
-                    # Single page generation - use simple working API
+                def generate_and_charge():
                     from ai_service import generate_text_simple
-                    generation_result = generate_text_simple(prompt, model_type, pages=1)
-                    if generation_result['success']:
-                        result = generation_result['content']
-                        model_used = generation_result.get('model_used', model_type)
-                    else:
-                        flash(f"Generation failed: {generation_result['error']}", 'danger')
-                        return render_template('start_writing.html', user_data=user_data, credits=credits)
-                else:
-                    # Multi-page generation - use updated function
-                    from ai_service import generate_text_simple
-                    generation_result = generate_text_simple(prompt, model_type, pages=page_count)
-                    if generation_result.get('success'):
-                        result = generation_result['content']
-                        model_used = generation_result.get('model_used', model_type)
-                    else:
-                        flash(f"Story generation failed: {generation_result.get('error', 'Unknown error')}", 'danger')
-                        return render_template('start_writing.html', user_data=user_data, credits=credits)
+                    generation_result = generate_text_simple(prompt, model_type, pages=page_count,
+                                                             generation_id=generation_id_for(user_data, prompt, page_count, model_type))
+                    if generation_result.get('success') and generation_result.get('content'):
+                        charge = credits_for_generation(generation_result, credits_needed, model_type)
+                        generation_result['credits_used'] = charge
+                        # Deduct credits from sukusuku integration
+                        # For SSO users, use session-based credit deduction to avoid database issues
+                        # (nothing to deduct when every delivered page was paid for by an earlier run)
+                        generation_result['charged'] = not charge or deduct_user_credits_safe(user_data, charge, f"{page_count} page generation: {prompt[:50]}")
+                        generation_result['balance'] = user_data['credits']
+                        if generation_result['charged']:
+                            record_delivery(generation_result, charge)
+                            title = generation_result.get('title') or (
+                                f"{page_count} Page(s) - {prompt[:30]}..." if len(prompt) > 30 else f"{page_count} Page(s) - {prompt}")
+                            generation_result['project_code'] = save_generation_to_workspace(user_data, title, generation_result['content'])
+                    return generation_result
+                
+                # A double-click or resubmit waits for the first request instead of generating and charging again
+                generation_result = single_flight_generation(user_data, 'start_writing',
+                                                             [prompt, page_count, model_type], generate_and_charge)
+                if generation_result.get('in_progress'):
+                    flash(generation_result['error'], 'info')
+                    return render_template('start_writing.html', user_data=user_data, credits=credits)
+                if not generation_result.get('success'):
+                    failure = "Generation failed" if page_count == 1 else "Story generation failed"
+                    flash(f"{failure}: {generation_result.get('error', 'Unknown error')}", 'danger')
+                    return render_template('start_writing.html', user_data=user_data, credits=credits)
                 
+                result = generation_result.get('content')
                 if result:
-                    # Deduct credits from sukusuku integration
-                    # For SSO users, use session-based credit deduction to avoid database issues
-                    if deduct_user_credits_safe(user_data, credits_needed, f"{page_count} page generation: {prompt[:50]}"):
+                    if generation_result['charged']:
+                        credits_needed = generation_result['credits_used']
                         remaining_credits = max(0, credits - credits_needed)
                         user_data['credits'] = remaining_credits
+                        project_code = generation_result.get('project_code')
                         
-                        # Try to save to workspace (optional)
-                        project_code = None
-                        try:
-                            from workspace_service import WorkspaceService
-                            title = f"{page_count} Page(s) - {prompt[:30]}..." if len(prompt) > 30 else f"{page_count} Page(s) - {prompt}"
-                            logging.info(f"🔄 Attempting to save to workspace: user_id={user_data['user_id']}, title='{title}'")
-                            success, project, message = WorkspaceService.save_generation(
-                                user_data['user_id'], 
-                                title, 
-                                result
-                            )
-                            if success and project:
-                                project_code = getattr(project, 'code', None)
-                                logging.info(f"✅ Workspace save successful: code={project_code}")
-                            else:
-                                logging.error(f"❌ Workspace save failed: {message}")
-                        except Exception as workspace_error:
-                            logging.error(f"❌ Workspace save error: {workspace_error}")
-                            import traceback
-                            logging.error(f"❌ Full traceback: {traceback.format_exc()}")
+                        if generation_result.get('partial'):
+                            page_count = generation_result['pages_delivered']
+                            flash(f"Only {page_count} of {generation_result['pages_requested']} pages could be generated "
+                                  f"and you were charged for those. Submit the same request again to write the rest; "
+                                  f"the finished pages are kept and won't be charged again.", 'warning')
                         
                         if project_code:
                             flash(f'{page_count} page(s) generated and saved to workspace! Code: {project_code}. {credits_needed} credit(s) deducted. {remaining_credits} credits remaining.', 'success')
@@ -645,34 +825,47 @@ def start_writing():
                 # Show file analysis to user before processing
                 logging.info(f"📄 File Analysis - {filename}: {pages_detected} pages, {word_count} words, {final_credits_needed} credits needed")
                 
-                # Process file content with AI
-                processing_result = ai_service.process_uploaded_file(file_content, instruction, model_type)
+                if job_queue_enabled():
+                    title = f"{instruction.title()} - {filename[:25]}..." if len(filename) > 25 else f"{instruction.title()} - {filename}"
+                    job_id = enqueue_generation(user_data, 'file', title, final_credits_needed,
+                                                f"File Processing [{model_type}] - {filename} ({pages_detected} pages): {instruction}",
+                                                content=file_content, instruction=instruction, model_type=model_type,
+                                                filename=filename)
+                    if job_id is None:
+                        flash(STILL_RUNNING_MESSAGE, 'info')
+                        return render_template('start_writing.html', user_data=user_data, credits=credits)
+                    return redirect(url_for('job_view', job_id=job_id))
+                
+                def process_and_charge():
+                    processing_result = ai_service.process_uploaded_file(file_content, instruction, model_type)
+                    if processing_result['success']:
+                        charge = credits_for_generation(processing_result, final_credits_needed, model_type)
+                        processing_result['credits_used'] = charge
+                        # Deduct the calculated credits
+                        transaction_desc = f"File Processing [{model_type}] - {filename} ({pages_detected} pages): {instruction}"
+                        processing_result['charged'] = deduct_user_credits_safe(user_data, charge, transaction_desc)
+                        processing_result['balance'] = user_data['credits']
+                        if processing_result['charged']:
+                            # Save to workspace with enhanced metadata
+                            title = f"{instruction.title()} - {filename[:25]}..." if len(filename) > 25 else f"{instruction.title()} - {filename}"
+                            processing_result['project_code'] = save_generation_to_workspace(user_data, title, processing_result['content'])
+                    return processing_result
+                
+                # Process file content with AI (once, however many times the form is submitted)
+                processing_result = single_flight_generation(user_data, 'process_file',
+                                                             [file_content, instruction, model_type], process_and_charge)
+                if processing_result.get('in_progress'):
+                    flash(processing_result['error'], 'info')
+                    return render_template('start_writing.html', user_data=user_data, credits=credits)
                 
                 if processing_result['success']:
                     result = processing_result['content']
-                    model_used = processing_result.get('model_used', model_type)
                     
-                    # Deduct the calculated credits
-                    transaction_desc = f"File Processing [{model_type}] - {filename} ({pages_detected} pages): {instruction}"
-                    if deduct_user_credits_safe(user_data, final_credits_needed, transaction_desc):
+                    if processing_result['charged']:
+                        final_credits_needed = processing_result['credits_used']
                         remaining_credits = max(0, credits - final_credits_needed)
                         user_data['credits'] = remaining_credits
-                        
-                        # Save to workspace with enhanced metadata
-                        project_code = None
-                        try:
-                            from workspace_service import WorkspaceService
-                            title = f"{instruction.title()} - {filename[:25]}..." if len(filename) > 25 else f"{instruction.title()} - {filename}"
-                            success, project, message = WorkspaceService.save_generation(
-                                user_data['user_id'], 
-                                title, 
-                                result
-                            )
-                            if success and project and hasattr(project, 'code'):
-                                project_code = project.code
-                                logging.info(f"✅ Enhanced file saved to workspace: {project_code}")
-                        except Exception as workspace_error:
-                            logging.error(f"Workspace save error: {workspace_error}")
+                        project_code = processing_result.get('project_code')
                         
                         # Success message with detailed info
                         if project_code:
@@ -704,6 +897,265 @@ def start_writing():
             
     return render_template('start_writing.html', user_data=user_data, credits=credits)
 
+def _user_job(job_id):
+    """Load a job owned by the current user, or None"""
+    from job_queue import job_queue
+    user_data = get_user_data()
+    job = job_queue.get(job_id)
+    if user_data is None or job is None or job['user_id'] != str(user_data['user_id']):
+        return None, user_data
+    return job, user_data
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Status and, once finished, result of a queued generation"""
+    from job_queue import job_queue
+    job, user_data = _user_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Job not found"}), 404
+    
+    response = {
+        "success": True,
+        "job_id": job_id,
+        "kind": job['kind'],
+        "status": job['status'],
+        "created_at": job['created_at'],
+        "finished_at": job['finished_at']
+    }
+    if job['status'] == job_queue.QUEUED:
+        response["queue_position"] = job_queue.position(job_id)
+    elif job['status'] == job_queue.RUNNING:
+        response["progress"] = job['progress']
+        # Calls of this user's still waiting for a model slot behind other users' calls
+        from llm_scheduler import llm_scheduler
+        response["llm_queue_position"] = llm_scheduler.position(user_data['user_id'])
+    elif job['status'] == job_queue.COMPLETED:
+        response["result"] = job['result']
+        # The worker charged the unified balance; bring this session's copy up to date
+        remaining = job['result'].get('remaining_credits')
+        if remaining is not None:
+            sync_session_credits(user_data, remaining)
+    elif job['status'] == job_queue.FAILED:
+        response["error"] = job['error']
+    return jsonify(response)
+
+@app.route('/jobs/<job_id>/view')
+def job_view(job_id):
+    """Page that polls /jobs/<id> until a queued generation is ready"""
+    job, user_data = _user_job(job_id)
+    if job is None:
+        flash('That generation could not be found.', 'warning')
+        return redirect(url_for('start_writing'))
+    return render_template('job_status.html',
+                           job_id=job_id,
+                           job_title=job['payload'].get('title', 'Your generation'),
+                           credits_needed=job['payload'].get('credits_needed', 0),
+                           status_url=url_for('job_status', job_id=job_id),
+                           user_data=user_data,
+                           credits=user_data['credits'])
+
+def _sse(event, data):
+    """Format a single Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _parse_fresh_writing_args(args):
+    """Read prompt, page count and model from the live form or a stream token"""
+    prompt = (args.get('prompt') or '').strip()
+    try:
+        page_count = max(1, int(args.get('page_count', 1)))
+    except (TypeError, ValueError):
+        page_count = 1
+    model_type = args.get('model_type', 'balanced')
+    return prompt, page_count, model_type
+
+@app.route('/start-writing/live', methods=['POST'])
+def start_writing_live():
+    """
+    Live /start-writing page that renders pages while tokens stream in.
+    Only a POST from the /start-writing form, carrying its CSRF token, gets a
+    signed stream token; the SSE endpoint generates (and charges) nothing
+    without one, so a cross-site link or image can't spend credits.
+    """
+    user_data = get_user_data()
+    
+    if user_data is None:
+        return redirect(url_for('index'))
+    
+    sent_token = request.form.get('stream_csrf', '')
+    if not sent_token or not hmac.compare_digest(sent_token, session.get('stream_csrf', '')):
+        flash('Your session has expired. Please try again.', 'warning')
+        return redirect(url_for('start_writing'))
+    
+    prompt, page_count, model_type = _parse_fresh_writing_args(request.form)
+    if not prompt:
+        flash('Please describe what you would like to write about.', 'warning')
+        return redirect(url_for('start_writing'))
+    
+    credits_needed = calculate_page_credits(page_count, model_type)
+    if user_data['credits'] < credits_needed:
+        flash(f'You need at least {credits_needed} credits to generate {page_count} page(s) with {model_type} model. You have {user_data["credits"]} credits.', 'warning')
+        return redirect(url_for('pricing'))
+    
+    return render_template('story_stream.html',
+                         story_title=prompt if len(prompt) <= 60 else prompt[:60] + '...',
+                         total_chapters=page_count,
+                         credits_needed=credits_needed,
+                         stream_url=url_for('start_writing_stream', token=_stream_token_serializer().dumps({
+                             'user_id': str(user_data['user_id']),
+                             'prompt': prompt,
+                             'page_count': page_count,
+                             'model_type': model_type,
+                             'nonce': secrets.token_urlsafe(16)
+                         })),
+                         user_data=user_data,
+                         credits=user_data['credits'])
+
+@app.route('/start-writing/stream')
+def start_writing_stream():
+    """
+    Server-Sent Events endpoint for fresh /start-writing generations.
+    Relays DeepInfra tokens as they arrive, then deducts credits and saves
+    to the workspace once the whole generation has completed. It only runs
+    the generation in a stream token issued by /start-writing/live to the
+    same user, once per token. Identical generations in flight are run once
+    (see single_flight_generation): a duplicate stream waits for the original
+    and is sent its pages without being charged.
+    """
+    user_data = get_user_data()
+    
+    def error_stream(message):
+        return Response(_sse('error', {'error': message}), mimetype='text/event-stream')
+    
+    if user_data is None:
+        return error_stream('Authentication required. Please log in again.')
+    
+    from itsdangerous import BadData
+    try:
+        params = _stream_token_serializer().loads(request.args.get('token', ''), max_age=STREAM_TOKEN_MAX_AGE)
+    except BadData:
+        return error_stream('This generation link has expired. Please start again from Start Writing.')
+    if params.get('user_id') != str(user_data['user_id']):
+        return error_stream('This generation was started by another account. Please start again from Start Writing.')
+    
+    prompt, page_count, model_type = _parse_fresh_writing_args(params)
+    if not prompt:
+        return error_stream('Please describe what you would like to write about.')
+    
+    credits = user_data['credits']
+    credits_needed = calculate_page_credits(page_count, model_type)
+    if credits < credits_needed:
+        return error_stream(f'You need at least {credits_needed} credits to generate {page_count} page(s). You have {credits} credits.')
+    
+    # Each token runs one generation; reopening it (a reload, a reconnect) must not run and charge again
+    from single_flight import single_flight, SingleFlightTimeout
+    if not single_flight.claim_once(single_flight.make_key(str(user_data['user_id']), 'stream_token', params.get('nonce')),
+                                    STREAM_TOKEN_MAX_AGE):
+        return error_stream('This generation link was already used. Please check your workspace or start again from Start Writing.')
+    
+    generation_id = generation_id_for(user_data, prompt, page_count, model_type)
+    
+    def run_generation():
+        """Stream one generation as SSE frames, then charge and save it; returns the start_writing-style result"""
+        pages = {}
+        failure = None
+        try:
+            if page_count == 1:
+                fragments = ((1, fragment) for fragment in ai_service.stream_text(prompt, model_type, 'long'))
+            else:
+                fragments = ai_service.stream_story_with_model(prompt, page_count, model_type, generation_id=generation_id)
+            
+            for page_number, fragment in fragments:
+                if page_number not in pages:
+                    pages[page_number] = []
+                    yield _sse('page', {'page': page_number, 'total_pages': page_count})
+                pages[page_number].append(fragment)
+                yield _sse('token', {'text': fragment})
+        except Exception as e:
+            logging.error(f"Streaming generation error: {e}")
+            failure = e
+        
+        if generation_id:
+            # The checkpoints hold exactly the pages that streamed in full, even when the run failed part-way
+            saved = ai_service.checkpoints.pages(generation_id)
+            delivered = 0
+            while delivered < page_count and delivered + 1 in saved:
+                delivered += 1
+            page_texts = [saved[n]['content'] for n in range(1, delivered + 1)]
+        else:
+            delivered = 0 if failure else page_count
+            page_texts = [''.join(pages.get(n, [])).strip() for n in range(1, delivered + 1)]
+        
+        if not delivered:
+            if isinstance(failure, DeadlineExceeded):
+                return {'success': False, 'error': 'Ran out of time before the first page was finished. No credits were deducted. Please try again.'}
+            return {'success': False, 'error': 'Generation failed. No credits were deducted. Please try again.'}
+        if not all(page_texts):
+            return {'success': False, 'error': 'Error generating content. No credits were deducted. Please try again.'}
+        result = page_texts[0] if page_count == 1 else ai_service.format_pages(page_texts)
+        charge = credits_for_pages(credits_needed, delivered, page_count, credits_already_charged(generation_id))
+        
+        # Headers are already sent, so the session cookie cannot change here; the unified
+        # credit store is updated, and the page syncs the session from it (/api/sync-credits)
+        # after the 'done' event.
+        if charge and not deduct_user_credits_safe(user_data, charge, f"{delivered} page generation: {prompt[:50]}"):
+            return {'success': False, 'charged': False, 'error': 'Error deducting credits. Please try again.'}
+        outcome = {
+            'success': True,
+            'charged': True,
+            'content': result,
+            'pages': page_texts,
+            'generation_id': generation_id,
+            'pages_delivered': delivered,
+            'pages_requested': page_count,
+            'partial': delivered < page_count,
+            'credits_used': charge,
+            'balance': max(0, credits - charge)
+        }
+        record_delivery(outcome, charge)
+        
+        title = f"{delivered} Page(s) - {prompt[:30]}..." if len(prompt) > 30 else f"{delivered} Page(s) - {prompt}"
+        outcome['project_code'] = save_generation_to_workspace(user_data, title, result)
+        return outcome
+    
+    def generate():
+        yield _sse('start', {'total_pages': page_count, 'credits_needed': credits_needed})
+        
+        from llm_scheduler import LLMScheduler
+        with LLMScheduler.user_context(user_data['user_id']), request_deadline.deadline():
+            try:
+                # Shares the /start-writing key: a double-click, resubmit or second tab, streamed
+                # or not, attaches to the run in flight (or replays its result) instead of charging again
+                outcome, leader = yield from single_flight.stream(
+                    single_flight.make_key(str(user_data['user_id']), 'start_writing', [prompt, page_count, model_type]),
+                    run_generation, wait_timeout=request_deadline.remaining(), replay=replayable_generation)
+            except SingleFlightTimeout:
+                logger.info("⏳ Duplicate streamed start_writing request gave up waiting for the original")
+                yield _sse('error', {'error': STILL_RUNNING_MESSAGE})
+                return
+        
+        if not outcome.get('success'):
+            yield _sse('error', {'error': outcome.get('error', 'Generation failed. Please try again.')})
+            return
+        if not leader:
+            # Show the original's pages, which this copy didn't stream itself
+            for page_number, text in enumerate(outcome.get('pages') or [outcome['content']], 1):
+                yield _sse('page', {'page': page_number, 'total_pages': page_count})
+                yield _sse('token', {'text': text})
+        
+        delivered = outcome.get('pages_delivered', page_count)
+        yield _sse('done', {
+            'project_code': outcome.get('project_code'),
+            'credits_used': outcome['credits_used'],
+            'remaining_credits': outcome.get('balance', max(0, credits - outcome['credits_used'])),
+            'pages_delivered': delivered,
+            'word_count': len(outcome['content'].split())
+        })
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Disable proxy buffering so tokens flush immediately
+    return response
+
 # Old single prompt route disabled - users should use /start-writing
 # @app.route('/single-prompt-old', methods=['GET', 'POST'])
 @require_sukusuku_auth
@@ -1117,6 +1569,39 @@ def delete_workspace_project(code):
     
     return redirect(url_for('workspace'))
 
+def render_export(owner, title, content, format):
+    """
+    content rendered as a 'pdf', 'docx' or 'txt' download, as a file object to
+    stream to the client. Downloads are kept in the export cache (see
+    export_cache), so the same title and content rendered for owner before -
+    or pre-rendered when it was saved (see export_prerender) - is a file
+    read; otherwise it is rendered by the render pool straight into its cache
+    file. Falls back to an in-memory buffer if the cache can't be written.
+    Returns {'success', 'file', 'error'}.
+    """
+    from export_cache import export_cache
+    from export_metrics import export_metrics, HIT, MISS
+    from render_pool import render_pool
+    key = export_cache.make_key(owner, title, content, format)
+    cached = export_cache.open(key)
+    export_metrics.record(format, HIT if cached is not None else MISS)
+    if cached is not None:
+        logging.info(f"📦 Serving cached {format.upper()} for {owner}")
+        return {'success': True, 'file': cached}
+    
+    render = lambda output: render_pool.render(format, title, content, output)
+    try:
+        try:
+            return {'success': True, 'file': export_cache.write(key, render)}
+        except OSError as e:
+            logging.warning(f"⚠️ Export cache unavailable ({e}), rendering {format.upper()} in memory")
+            buffer = BytesIO()
+            render(buffer)
+            buffer.seek(0)
+            return {'success': True, 'file': buffer}
+    except Exception as e:
+        return {'success': False, 'error': f"Failed to create {format.upper()}: {e}"}
+
 @app.route('/workspace/download/<code>/<format>')
 @require_sukusuku_auth
 def download_workspace_project(code, format):
@@ -1145,14 +1630,8 @@ def download_workspace_project(code, format):
         logging.info(f"📄 Content length: {len(content_to_download)} chars")
 
         if format == 'pdf':
-            # Import locally to avoid circular imports or initialization issues
-            from pdf_service import pdf_service
-            
             logging.info("🔄 Generating PDF...")
-            pdf_result = pdf_service.generate_pdf(
-                title=project.project_title,
-                content=content_to_download
-            )
+            pdf_result = render_export(project.code, project.project_title, content_to_download, 'pdf')
             
             if not pdf_result.get('success'):
                 error_msg = pdf_result.get('error', 'Unknown error')
@@ -1164,9 +1643,7 @@ def download_workspace_project(code, format):
             safe_title = re.sub(r'[^a-zA-Z0-9_\-]', '_', project.project_title[:20])
             filename = f'{project.code}_{safe_title}.pdf'
             
-            # Create BytesIO buffer from PDF content
-            from io import BytesIO
-            pdf_buffer = BytesIO(pdf_result['pdf_content'])
+            pdf_buffer = pdf_result['file']
             logging.info(f"✅ PDF generated successfully, sending file: {filename}")
             
             response = send_file(pdf_buffer, as_attachment=True, 
@@ -1181,15 +1658,8 @@ def download_workspace_project(code, format):
             return response
         
         elif format in ['docx', 'txt']:
-            # Import locally
-            from export_service import export_service
-            
             logging.info(f"🔄 Generating {format.upper()}...")
-            export_result = export_service.export_content(
-                content_to_download, 
-                format, 
-                title=project.project_title
-            )
+            export_result = render_export(project.code, project.project_title, content_to_download, format)
             
             if not export_result.get('success'):
                 error_msg = export_result.get('error', 'Unknown error')
@@ -1203,9 +1673,7 @@ def download_workspace_project(code, format):
             
             mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' if format == 'docx' else 'text/plain'
             
-            # Create BytesIO buffer from file content
-            from io import BytesIO
-            content_buffer = BytesIO(export_result['data'])
+            content_buffer = export_result['file']
             
             logging.info(f"✅ {format.upper()} generated successfully, sending file: {filename}")
             response = send_file(content_buffer, as_attachment=True,
@@ -1227,6 +1695,46 @@ def download_workspace_project(code, format):
         logging.exception(f"🔥 CRITICAL DOWNLOAD ERROR: {str(e)}")
         return f"Server Error during download: {str(e)}", 500
 
+@app.route('/workspace/download-all')
+@require_sukusuku_auth
+def download_workspace_zip():
+    """
+    Stream one ZIP of the user's workspace projects: ?codes=A1B2,C3D4 picks
+    projects (default: all) and ?formats=pdf,docx,txt the formats (default: pdf)
+    """
+    user_data = g.user
+    if not user_data:
+        return "Error: User not authenticated", 401
+    
+    from workspace_service import WorkspaceService
+    from workspace_zip import stream_workspace_zip, FORMATS
+    
+    formats = list(dict.fromkeys(f.strip().lower() for f in request.args.get('formats', 'pdf').split(',') if f.strip()))
+    invalid = [f for f in formats if f not in FORMATS]
+    if not formats or invalid:
+        return f"Error: Invalid format {', '.join(invalid)}", 400
+    
+    codes = {c.strip() for c in request.args.get('codes', '').split(',') if c.strip()}
+    projects = WorkspaceService.get_user_project_titles(user_data['user_id'], codes)
+    if not projects:
+        return "Error: No projects to download", 404
+    
+    # Only codes and titles up front: each project's content is read when the archive reaches it,
+    # so one project's text is in memory at a time (stream_with_context keeps the database session)
+    members = [{'code': code, 'title': title} for code, title in projects]
+    logging.info(f"📦 ZIP DOWNLOAD: {len(members)} projects as {', '.join(formats)} for user {user_data.get('user_id')}")
+    
+    def load_content(code):
+        content = WorkspaceService.get_project_text(user_data['user_id'], code)
+        return None if content is None else content or " "
+    
+    filename = f"penora_workspace_{datetime.now().strftime('%Y%m%d')}.zip"
+    response = Response(stream_with_context(stream_workspace_zip(members, formats, render_export, load_content)),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    return response
+
 @app.route('/workspace/view/<code>')
 @require_sukusuku_auth
 def view_workspace_project(code):
@@ -1306,21 +1814,39 @@ def sudowrite_write():
         temperature = float(request.form.get('temperature', 0.7))
         model_type = 'creative'  # Use creative model for writing
         
-        # Use the basic text generation function since Sudowrite tools may not exist
-        result = ai_service.generate_text(prompt, model_type, 'medium')
+        # Never generate more variants than the user can pay for
+        variants = min(variants, credits)
+        
+        def generate_and_charge():
+            result = ai_service.sudowrite_write_tool(prompt, mode, variants, temperature, model_type)
+            if result['success']:
+                # Deduct credits (1 credit per variant actually delivered)
+                delivered = len(result['variants'])
+                result['charged'] = deduct_user_credits_safe(user_data, delivered, f"Write Tool: {mode} ({delivered} variants)")
+                result['balance'] = user_data['credits']
+            return result
+        
+        result = single_flight_generation(user_data, 'write', [prompt, mode, variants, temperature, model_type], generate_and_charge)
+        if result.get('in_progress'):
+            flash(result['error'], 'info')
+            return redirect(url_for('sudowrite_tools'))
         
         if result['success']:
-            # Deduct credits (1 credit per variant)
-            credits_needed = variants
-            if deduct_user_credits_safe(user_data, credits_needed, f"Write Tool: {mode} ({variants} variants)"):
+            delivered = result['variants']
+            credits_needed = len(delivered)
+            if result['charged']:
                 remaining_credits = user_data['credits'] - credits_needed
                 user_data['credits'] = remaining_credits
                 
-                flash(f'Generated {variants} writing variants! {credits_needed} credits used.', 'success')
+                if credits_needed < variants:
+                    flash(f'Generated {credits_needed} of {variants} writing variants (the rest failed and were not charged). {credits_needed} credits used.', 'warning')
+                else:
+                    flash(f'Generated {credits_needed} writing variants! {credits_needed} credits used.', 'success')
                 return render_template('sudowrite_tools.html', 
                                      user_data=user_data, 
                                      credits=remaining_credits,
-                                     results=[{'type': 'write', 'content': result['content'], 'model_used': result['model_used']}])
+                                     results=[{'type': 'write', 'variant': v['variant'], 'content': v['content'], 'model_used': result['model_used']}
+                                              for v in delivered])
             else:
                 flash('Error processing credits. Please try again.', 'danger')
         else:
@@ -1354,11 +1880,22 @@ def sudowrite_rewrite():
         
         # Use basic text generation as sudowrite_rewrite_tool may not exist
         rewrite_prompt = f"Please {rewrite_type} this text while maintaining its core meaning:\n\n{selected_text}"
-        result = ai_service.generate_text(rewrite_prompt, model_type, 'medium')
+        
+        def generate_and_charge():
+            result = ai_service.generate_text(rewrite_prompt, model_type, 'medium')
+            if result['success']:
+                # Deduct 1 credit
+                result['charged'] = deduct_user_credits_safe(user_data, 1, f"Rewrite Tool: {rewrite_type}")
+                result['balance'] = user_data['credits']
+            return result
+        
+        result = single_flight_generation(user_data, 'rewrite', [rewrite_prompt, model_type], generate_and_charge)
+        if result.get('in_progress'):
+            flash(result['error'], 'info')
+            return redirect(url_for('sudowrite_tools'))
         
         if result['success']:
-            # Deduct 1 credit
-            if deduct_user_credits_safe(user_data, 1, f"Rewrite Tool: {rewrite_type}"):
+            if result['charged']:
                 remaining_credits = user_data['credits'] - 1
                 user_data['credits'] = remaining_credits
                 
@@ -1665,14 +2202,8 @@ def export_generation(generation_id, format):
         logging.info(f"📄 Content length: {len(content_to_export)} chars")
         
         if format == 'pdf':
-            # Generate PDF
-            from pdf_service import pdf_service
-            
             logging.info("🔄 Generating PDF...")
-            pdf_result = pdf_service.generate_pdf(
-                title=title,
-                content=content_to_export
-            )
+            pdf_result = render_export(f"generation_{generation_id}", title, content_to_export, 'pdf')
             
             if not pdf_result.get('success'):
                 error_msg = pdf_result.get('error', 'Unknown error')
@@ -1684,8 +2215,7 @@ def export_generation(generation_id, format):
             safe_title = re.sub(r'[^a-zA-Z0-9_\-]', '_', title[:20])
             filename = f'{generation_id}_{safe_title}.pdf'
             
-            from io import BytesIO
-            pdf_buffer = BytesIO(pdf_result['pdf_content'])
+            pdf_buffer = pdf_result['file']
             logging.info(f"✅ PDF generated successfully, sending file: {filename}")
             
             response = send_file(pdf_buffer, as_attachment=True, 
@@ -1701,14 +2231,8 @@ def export_generation(generation_id, format):
             export_format = 'docx' if format == 'doc' else format
             
             # Generate DOC or TXT
-            from export_service import export_service
-            
             logging.info(f"🔄 Generating {export_format.upper()}...")
-            export_result = export_service.export_content(
-                content_to_export, 
-                export_format, 
-                title=title
-            )
+            export_result = render_export(f"generation_{generation_id}", title, content_to_export, export_format)
             
             if not export_result.get('success'):
                 error_msg = export_result.get('error', 'Unknown error')
@@ -1722,8 +2246,7 @@ def export_generation(generation_id, format):
             
             mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' if export_format == 'docx' else 'text/plain'
             
-            from io import BytesIO
-            content_buffer = BytesIO(export_result['data'])
+            content_buffer = export_result['file']
             
             logging.info(f"✅ {export_format.upper()} generated successfully, sending file: {filename}")
             response = send_file(content_buffer, as_attachment=True,
@@ -1761,30 +2284,44 @@ def download_content():
         
         if format_type == 'pdf':
             # Import locally to avoid potential scope/init issues
-            from pdf_service import pdf_service
+            from render_pool import render_pool
             
-            pdf_result = pdf_service.generate_pdf(title=title, content=content)
-            if pdf_result.get('success'):
-                from io import BytesIO
-                pdf_buffer = BytesIO(pdf_result['pdf_content'])
-                return send_file(pdf_buffer, as_attachment=True, 
-                               download_name=f'{clean_title}.pdf',
-                               mimetype='application/pdf')
-            else:
+            # Rendered in a render process into the response buffer
+            pdf_buffer = BytesIO()
+            try:
+                render_pool.render('pdf', title, content, pdf_buffer)
+            except Exception as e:
+                logging.error(f"PDF generation error: {e}")
                 return f"Error generating PDF", 500
+            pdf_buffer.seek(0)
+            return send_file(pdf_buffer, as_attachment=True, 
+                           download_name=f'{clean_title}.pdf',
+                           mimetype='application/pdf')
+        
+        elif format_type == 'docx':
+            from render_pool import render_pool
+            
+            content_buffer = BytesIO()
+            try:
+                render_pool.render('docx', title, content, content_buffer)
+            except Exception as e:
+                logging.error(f"DOCX generation error: {e}")
+                return f"Error generating file", 500
+            content_buffer.seek(0)
+            return send_file(content_buffer, as_attachment=True,
+                            download_name=f'{clean_title}.docx',
+                            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
         
-        elif format_type in ['docx', 'txt']:
+        elif format_type == 'txt':
             # Import locally
             from export_service import export_service
             
             export_result = export_service.export_content(content, format_type, title=title)
             if export_result.get('success'):
-                from io import BytesIO
                 content_buffer = BytesIO(export_result['data'])
-                mimetype = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' if format_type == 'docx' else 'text/plain'
                 return send_file(content_buffer, as_attachment=True,
-                                download_name=f'{clean_title}.{format_type}',
-                                mimetype=mimetype)
+                                download_name=f'{clean_title}.txt',
+                                mimetype='text/plain')
             else:
                 return f"Error generating file", 500
         else:
@@ -1816,11 +2353,22 @@ def sudowrite_describe():
         
         # Use basic text generation as sudowrite_describe_tool may not exist
         describe_prompt = f"Please add rich sensory descriptions focusing on {sense_focus} to enhance this text:\n\n{selected_text}"
-        result = ai_service.generate_text(describe_prompt, model_type, 'medium')
+        
+        def generate_and_charge():
+            result = ai_service.generate_text(describe_prompt, model_type, 'medium')
+            if result['success']:
+                # Deduct 1 credit
+                result['charged'] = deduct_user_credits_safe(user_data, 1, f"Describe Tool: {sense_focus}")
+                result['balance'] = user_data['credits']
+            return result
+        
+        result = single_flight_generation(user_data, 'describe', [describe_prompt, model_type], generate_and_charge)
+        if result.get('in_progress'):
+            flash(result['error'], 'info')
+            return redirect(url_for('sudowrite_tools'))
         
         if result['success']:
-            # Deduct 1 credit
-            if deduct_user_credits_safe(user_data, 1, f"Describe Tool: {sense_focus}"):
+            if result['charged']:
                 remaining_credits = user_data['credits'] - 1
                 user_data['credits'] = remaining_credits
                 
@@ -1857,19 +2405,28 @@ def sudowrite_brainstorm():
         count = int(request.form.get('count', 10))
         model_type = 'fast'  # Use fast model for brainstorming
         
-        # Use the basic text generation function since Sudowrite tools may not exist
-        brainstorm_prompt = f"Generate {count} creative {category} ideas based on: {context}"
-        result = ai_service.generate_text(brainstorm_prompt, model_type, 'medium')
+        # Brainstorm tool responses are cached, so repeated categories/contexts skip the model call
+        def generate_and_charge():
+            result = ai_service.sudowrite_brainstorm_tool(category, context, count, model_type)
+            if result['success']:
+                # Deduct 1 credit
+                result['charged'] = deduct_user_credits_safe(user_data, 1, f"Brainstorm Tool: {category} ({count} ideas)")
+                result['balance'] = user_data['credits']
+            return result
+        
+        result = single_flight_generation(user_data, 'brainstorm', [category, context, count, model_type], generate_and_charge)
+        if result.get('in_progress'):
+            flash(result['error'], 'info')
+            return redirect(url_for('sudowrite_tools'))
         
         if result['success']:
-            # Deduct 1 credit
-            if deduct_user_credits_safe(user_data, 1, f"Brainstorm Tool: {category} ({count} ideas)"):
+            if result['charged']:
                 remaining_credits = user_data['credits'] - 1
                 user_data['credits'] = remaining_credits
                 
                 # Parse content into list
                 import re
-                raw_content = result['content']
+                raw_content = result['suggestions']
                 # Split by newlines and clean up
                 content_list = []
                 for line in raw_content.split('\n'):
@@ -1964,10 +2521,9 @@ def save_edited_text(code):
         return jsonify({'success': False, 'error': 'Project not found'}), 404
     
     try:
-        # Update project with new content
-        project.project_title = request.form.get('project_title', project.project_title)
-        project.generation_text = request.form.get('generated_text', project.generation_text)
-        project.last_updated = datetime.utcnow()
+        # Update project with new content (update_content also drops its cached downloads)
+        project.update_content(request.form.get('project_title', project.project_title),
+                               request.form.get('generated_text', project.generation_text))
         
         db.session.commit()
         
@@ -0,0 +1,218 @@
+"""
+Single-flight Request Coalescing for Penora
+Runs identical concurrent requests once and hands every duplicate the same outcome
+
+A double-click, browser resubmit or second tab sends the same generation
+twice. Instead of each copy holding a worker for minutes, calling DeepInfra
+and charging credits, the first request to claim the key (hashed from
+user, action and parameters) runs the work and the duplicates wait for its
+outcome. Keys are claimed in a SQLite lock table shared by every gunicorn
+worker on the node. Finished outcomes are replayed for a short window so a
+resubmit that arrives just after the original finished gets the same
+answer. Only outcomes the caller accepts are replayed: if the work raises
+or its outcome is rejected (a failure, a partial result, a charge that
+didn't go through), the key is released and a waiting duplicate or a
+resubmit runs it again instead.
+
+Settings:
+- SINGLE_FLIGHT_DB: SQLite file shared by the workers (default: single_flight.db in PENORA_DATA_DIR)
+- SINGLE_FLIGHT_LEASE: seconds a running request holds its key before a duplicate may take over (default: 900)
+- SINGLE_FLIGHT_KEEP: seconds a finished outcome is replayed to duplicates (default: 30)
+"""
+
+import sqlite3
+import logging
+import hashlib
+import json
+import os
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, Optional, Tuple
+
+from data_dir import data_path
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightTimeout(Exception):
+    """A duplicate gave up waiting for the original request to finish"""
+
+
+class SingleFlight:
+    """Cross-process single-flight: one caller per key does the work, the rest share its JSON outcome"""
+
+    RUNNING = 'running'
+    DONE = 'done'
+    USED = 'used'
+
+    def __init__(self, db_path=None, lease_seconds=None, keep_seconds=None, poll_interval=0.25):
+        self.db_path = db_path or os.environ.get("SINGLE_FLIGHT_DB") or data_path("single_flight.db")
+        self.lease_seconds = int(lease_seconds or os.environ.get("SINGLE_FLIGHT_LEASE", 900))
+        self.keep_seconds = int(keep_seconds or os.environ.get("SINGLE_FLIGHT_KEEP", 30))
+        self.poll_interval = poll_interval
+        self._db_lock = threading.Lock()
+        self.init_database()
+
+    @contextmanager
+    def get_db_connection(self):
+        """Get database connection with proper locking"""
+        conn = None
+        try:
+            with self._db_lock:
+                conn = sqlite3.connect(
+                    self.db_path,
+                    timeout=10,
+                    check_same_thread=False
+                )
+                conn.execute('PRAGMA journal_mode=WAL')
+                yield conn
+        finally:
+            if conn:
+                conn.close()
+
+    def init_database(self):
+        """Initialize lock table schema"""
+        try:
+            with self.get_db_connection() as conn:
+                cursor = conn.cursor()
+
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS inflight_requests (
+                        flight_key TEXT PRIMARY KEY,
+                        owner TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        outcome TEXT,
+                        created_at REAL NOT NULL,
+                        expires_at REAL NOT NULL
+                    )
+                """)
+
+                cursor.execute("CREATE INDEX IF NOT EXISTS idx_inflight_expires ON inflight_requests(expires_at)")
+                conn.commit()
+                logger.info("✅ Single-flight lock table initialized")
+        except Exception as e:
+            logger.error(f"❌ Single-flight database initialization failed: {e}")
+            raise
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        """Stable key for a request from its identifying parts (user, action, parameters...)"""
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _claim(self, key: str, owner: str) -> Tuple[bool, Optional[Tuple[str, Optional[str]]]]:
+        """Try to become the key's leader; otherwise return the current (status, outcome)"""
+        now = time.time()
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            # Finished outcomes past their replay window, and leaders that died mid-flight, free the key
+            cursor.execute("DELETE FROM inflight_requests WHERE expires_at < ?", (now,))
+            cursor.execute("""
+                INSERT OR IGNORE INTO inflight_requests (flight_key, owner, status, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, owner, self.RUNNING, now, now + self.lease_seconds))
+            if cursor.rowcount == 1:
+                conn.commit()
+                return True, None
+            cursor.execute("SELECT status, outcome FROM inflight_requests WHERE flight_key = ?", (key,))
+            row = cursor.fetchone()
+            conn.commit()
+            return False, row
+
+    def _finish(self, key: str, owner: str, outcome: Any):
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE inflight_requests SET status = ?, outcome = ?, expires_at = ?
+                WHERE flight_key = ? AND owner = ?
+            """, (self.DONE, json.dumps(outcome), time.time() + self.keep_seconds, key, owner))
+            conn.commit()
+
+    def _release(self, key: str, owner: str):
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM inflight_requests WHERE flight_key = ? AND owner = ?", (key, owner))
+            conn.commit()
+
+    def claim_once(self, key: str, hold_seconds: float) -> bool:
+        """Mark key as used for hold_seconds; False if it already was (single-use tokens)"""
+        now = time.time()
+        with self.get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM inflight_requests WHERE expires_at < ?", (now,))
+            cursor.execute("""
+                INSERT OR IGNORE INTO inflight_requests (flight_key, owner, status, created_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+            """, (key, uuid.uuid4().hex, self.USED, now, now + hold_seconds))
+            claimed = cursor.rowcount == 1
+            conn.commit()
+            return claimed
+
+    def _await_turn(self, key: str, owner: str, wait_timeout: Optional[float]) -> Tuple[bool, Any]:
+        """Claim the key and return (True, None), or wait for its outcome and return (False, outcome)"""
+        deadline = time.time() + (wait_timeout or self.lease_seconds)
+        while True:
+            leader, row = self._claim(key, owner)
+            if leader:
+                return True, None
+            if row is not None and row[0] == self.DONE:
+                logger.info(f"Single-flight: duplicate request served from key {key[:12]}")
+                return False, json.loads(row[1])
+            if time.time() >= deadline:
+                raise SingleFlightTimeout("An identical request is still in progress")
+            time.sleep(self.poll_interval)
+
+    def _settle(self, key: str, owner: str, outcome: Any, replay: Optional[Callable[[Any], bool]]):
+        if replay is None or replay(outcome):
+            self._finish(key, owner, outcome)
+        else:
+            self._release(key, owner)
+
+    def run(self, key: str, work: Callable[[], Any], wait_timeout: Optional[float] = None,
+            replay: Optional[Callable[[Any], bool]] = None) -> Tuple[Any, bool]:
+        """
+        Run work() unless an identical request already is, and return (outcome, leader).
+        leader is False when the outcome was produced by another request; the
+        outcome must be JSON-serializable. replay(outcome) says whether it may be
+        handed to duplicates (default: always); if not, the key is released.
+        Duplicates wait up to wait_timeout seconds (default: the lease) before
+        raising SingleFlightTimeout.
+        """
+        owner = uuid.uuid4().hex
+        leader, outcome = self._await_turn(key, owner, wait_timeout)
+        if not leader:
+            return outcome, False
+        try:
+            outcome = work()
+        except BaseException:
+            self._release(key, owner)
+            raise
+        self._settle(key, owner, outcome, replay)
+        return outcome, True
+
+    def stream(self, key: str, work: Callable[[], Generator[Any, None, Any]], wait_timeout: Optional[float] = None,
+               replay: Optional[Callable[[Any], bool]] = None) -> Generator[Any, None, Tuple[Any, bool]]:
+        """
+        run() for work that streams: work() is a generator whose items the leader
+        yields as they come and whose return value is the outcome. Duplicates
+        yield nothing. Use as `outcome, leader = yield from single_flight.stream(key, work)`;
+        if the consumer stops early (a closed connection), the key is released.
+        """
+        owner = uuid.uuid4().hex
+        leader, outcome = self._await_turn(key, owner, wait_timeout)
+        if not leader:
+            return outcome, False
+        try:
+            outcome = yield from work()
+        except BaseException:
+            self._release(key, owner)
+            raise
+        self._settle(key, owner, outcome, replay)
+        return outcome, True
+
+# Global instance
+single_flight = SingleFlight()
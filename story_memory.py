@@ -0,0 +1,117 @@
+"""
+Story Memory for Penora
+Keeps the context of a long chapter-by-chapter story at a constant size
+
+Instead of resending every earlier chapter, a StoryMemory holds:
+- the story premise
+- a running summary, capped at SUMMARY_WORDS
+- a character/plot fact sheet, capped at MAX_FACTS short entries
+- the closing lines of the latest chapter, so the next one picks up smoothly
+
+After each chapter AIService asks the model to fold the new chapter into the
+summary and fact sheet (see update_prompt / apply_update). The caps are
+enforced here whatever the model returns, so chapter N's prompt stays about
+the size of chapter 2's.
+"""
+
+import json
+import logging
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_WORDS = 250
+MAX_FACTS = 30
+FACT_WORDS = 25
+TAIL_WORDS = 120
+
+
+def _last_words(text: str, count: int) -> str:
+    words = (text or '').split()
+    return ' '.join(words[-count:])
+
+
+def _first_words(text: str, count: int) -> str:
+    words = (text or '').split()
+    return ' '.join(words[:count])
+
+
+class StoryMemory:
+    """Compact running summary and fact sheet for one story"""
+
+    def __init__(self, premise: str, summary: str = '', facts: Optional[List[str]] = None,
+                 last_passage: str = '', chapters_written: int = 0):
+        self.premise = premise
+        self.summary = summary
+        self.facts = list(facts or [])
+        self.last_passage = last_passage
+        self.chapters_written = chapters_written
+
+    def render(self) -> str:
+        """Story context for the next chapter's prompt"""
+        parts = [f"Premise: {self.premise}"]
+        if self.summary:
+            parts.append(f"Story so far: {self.summary}")
+        if self.facts:
+            parts.append("Key facts:\n" + '\n'.join(f"- {fact}" for fact in self.facts))
+        if self.last_passage:
+            parts.append(f"The previous chapter ended: ...{self.last_passage}")
+        return '\n\n'.join(parts)
+
+    def update_prompt(self, chapter_number: int, chapter_text: str):
+        """(prompt, system message) asking the model to fold a new chapter into the memory"""
+        facts = '\n'.join(f"- {fact}" for fact in self.facts) or '(none yet)'
+        prompt = f"""Current summary of the story so far:
+{self.summary or '(the story has just begun)'}
+
+Current fact sheet:
+{facts}
+
+Chapter {chapter_number}:
+{chapter_text}
+
+Update the summary and fact sheet to include chapter {chapter_number}. Reply with JSON only:
+{{"summary": "the whole story so far in at most {SUMMARY_WORDS} words", "facts": ["at most {MAX_FACTS} short facts about characters, places, objects and open plot threads"]}}
+Keep facts that still matter, drop resolved or minor ones."""
+        system_msg = "You maintain concise story bibles for novelists. Be accurate and brief."
+        return prompt, system_msg
+
+    def apply_update(self, reply: Optional[str], chapter_number: int, chapter_text: str):
+        """Store the model's updated summary and facts, trimmed to the size caps"""
+        summary, facts = None, None
+        try:
+            data = json.loads(reply[reply.index('{'):reply.rindex('}') + 1])
+            summary = data.get('summary')
+            facts = data.get('facts')
+        except (ValueError, TypeError, AttributeError):
+            logger.warning(f"Story memory update for chapter {chapter_number} was not valid JSON; using fallback")
+
+        if not isinstance(summary, str) or not summary.strip():
+            # Fallback: append the chapter's opening to the summary and keep the most recent words
+            summary = f"{self.summary} Chapter {chapter_number}: {_first_words(chapter_text, 60)}".strip()
+        if not isinstance(facts, list):
+            facts = self.facts
+
+        self.summary = _last_words(summary, SUMMARY_WORDS)
+        self.facts = [_first_words(str(fact), FACT_WORDS) for fact in facts if str(fact).strip()][:MAX_FACTS]
+        self.last_passage = _last_words(chapter_text, TAIL_WORDS)
+        self.chapters_written = max(self.chapters_written, chapter_number)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'premise': self.premise,
+            'summary': self.summary,
+            'facts': self.facts,
+            'last_passage': self.last_passage,
+            'chapters_written': self.chapters_written
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'StoryMemory':
+        return cls(
+            premise=data.get('premise', ''),
+            summary=data.get('summary', ''),
+            facts=data.get('facts') or [],
+            last_passage=data.get('last_passage', ''),
+            chapters_written=data.get('chapters_written', 0)
+        )
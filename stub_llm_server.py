@@ -0,0 +1,284 @@
+"""
+Local OpenAI-compatible stub server for Penora benchmarks and tests
+
+Serves POST .../chat/completions with canned replies (plain JSON, or SSE
+chunks when the request sets "stream": true) so DeepInfra client behaviour
+can be measured without spending money on api.deepinfra.com.
+
+Faults can be injected to exercise retries, circuit breakers and hedging:
+the first `fail_first` requests (or a random `fail_rate` share of them) get
+`fail_status` with an optional Retry-After header, and the first `slow_first`
+requests take `slow_latency` seconds instead of `latency`.
+
+Usage:
+    python stub_llm_server.py --port 8001 --latency 0.2 --handshake-latency 0.15 --token-latency 0.02
+    python stub_llm_server.py --port 8001 --prompt-latency 0.0005 --reply-words 400
+    python stub_llm_server.py --port 8001 --fail-rate 0.2 --fail-status 503
+    python stub_llm_server.py --port 8001 --slow-first 50 --slow-latency 30
+
+load_test.py drives the whole app against this server.
+
+Then point the app at it:
+    DEEPINFRA_BASE_URL=http://127.0.0.1:8001/v1/openai DEEPINFRA_API_KEY=stub
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    """Request handler answering chat completion calls with canned content"""
+
+    # HTTP/1.1 so clients can keep connections alive between calls
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        stub = self.server.stub
+        with stub.lock:
+            stub.connections_opened += 1
+        # Emulate the DNS + TCP + TLS setup cost a fresh connection pays against a remote API
+        if stub.handshake_latency:
+            time.sleep(stub.handshake_latency)
+
+    def log_message(self, format, *args):
+        # Keep benchmark output readable
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        stub = self.server.stub
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length) if length else b"{}"
+
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        try:
+            data = json.loads(raw or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON"}})
+            return
+
+        with stub.lock:
+            stub.requests_served += 1
+            sequence = stub.requests_served
+            fail = sequence <= stub.fail_first or (stub.fail_rate and random.random() < stub.fail_rate)
+            if fail:
+                stub.failures_served += 1
+
+        if fail:
+            self._send_fault(stub)
+            return
+
+        latency = stub.slow_latency if sequence <= stub.slow_first else stub.latency
+        if latency:
+            time.sleep(latency)
+
+        prompt = ""
+        for message in data.get("messages", []):
+            if message.get("role") == "user":
+                prompt = message.get("content", "")
+
+        # Emulate prefill: longer prompts take longer before the first token
+        if stub.prompt_latency:
+            time.sleep(stub.prompt_latency * len(prompt.split()))
+
+        content = stub.reply
+        if data.get("stream"):
+            self._stream_reply(data, content)
+            return
+
+        if stub.token_latency:
+            time.sleep(stub.token_latency * len(content.split()))
+
+        completion_tokens = len(content.split())
+        self._send_json(200, {
+            "id": f"stub-{stub.requests_served}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": data.get("model", "stub-model"),
+            "choices": [{
+                "index": index,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            } for index in range(max(1, int(data.get("n", 1))))],
+            "usage": {
+                "prompt_tokens": len(prompt.split()),
+                "completion_tokens": completion_tokens,
+                "total_tokens": len(prompt.split()) + completion_tokens
+            }
+        })
+
+    def _send_fault(self, stub):
+        body = json.dumps({"error": {"message": f"Injected failure ({stub.fail_status})"}}).encode("utf-8")
+        self.send_response(stub.fail_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if stub.retry_after is not None:
+            self.send_header("Retry-After", str(stub.retry_after))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_reply(self, data, content):
+        """Send the reply word by word as OpenAI-style SSE chunks"""
+        stub = self.server.stub
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        words = content.split(" ")
+        for index, word in enumerate(words):
+            if stub.token_latency:
+                time.sleep(stub.token_latency)
+            chunk = {
+                "id": f"stub-{stub.requests_served}",
+                "object": "chat.completion.chunk",
+                "model": data.get("model", "stub-model"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": word if index == 0 else " " + word},
+                    "finish_reason": None
+                }]
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        if (data.get("stream_options") or {}).get("include_usage"):
+            prompt_tokens = sum(len(message.get("content", "").split()) for message in data.get("messages", [])
+                                if message.get("role") == "user")
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(words),
+                "total_tokens": prompt_tokens + len(words)
+            }
+            chunk = {"id": f"stub-{stub.requests_served}", "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    # Room for load tests that open hundreds of connections at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class StubLLMServer:
+    """Threaded stub server that can be started in-process or from the command line"""
+
+    DEFAULT_REPLY = ("The lighthouse keeper watched the storm roll in across the bay, "
+                     "counting the seconds between each flash of lightning.")
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, handshake_latency=0.0, token_latency=0.0, reply=None,
+                 fail_first=0, fail_rate=0.0, fail_status=503, retry_after=None, slow_first=0, slow_latency=0.0,
+                 prompt_latency=0.0):
+        self.latency = latency
+        self.handshake_latency = handshake_latency
+        self.token_latency = token_latency
+        self.prompt_latency = prompt_latency
+        self.reply = reply or self.DEFAULT_REPLY
+        self.fail_first = fail_first
+        self.fail_rate = fail_rate
+        self.fail_status = fail_status
+        self.retry_after = retry_after
+        self.slow_first = slow_first
+        self.slow_latency = slow_latency
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+        self.requests_served = 0
+        self.failures_served = 0
+
+        self.httpd = StubHTTPServer((host, port), StubLLMHandler)
+        self.httpd.stub = self
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/openai"
+
+    def reset_stats(self):
+        with self.lock:
+            self.connections_opened = 0
+            self.requests_served = 0
+            self.failures_served = 0
+
+    def start(self):
+        """Serve in a background thread and return self"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def make_reply(words):
+    """A reply of `words` words built from the canned sentence, or None for the default reply"""
+    if not words:
+        return None
+    canned = StubLLMServer.DEFAULT_REPLY.split()
+    return " ".join(canned[i % len(canned)] for i in range(words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds spent 'generating' each reply")
+    parser.add_argument("--handshake-latency", type=float, default=0.0,
+                        help="Seconds added once per new connection (emulates DNS/TCP/TLS setup)")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per generated word")
+    parser.add_argument("--prompt-latency", type=float, default=0.0, help="Seconds per prompt word (emulates prefill)")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=503, help="HTTP status used for injected failures")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with failures")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with --fail-status")
+    parser.add_argument("--slow-first", type=int, default=0, help="Answer the first N requests after --slow-latency")
+    parser.add_argument("--slow-latency", type=float, default=0.0, help="Latency of the --slow-first requests (s)")
+    parser.add_argument("--reply-words", type=int, default=0,
+                        help="Length of every reply in words (default: the one-sentence canned reply)")
+    args = parser.parse_args()
+
+    server = StubLLMServer(args.host, args.port, args.latency, args.handshake_latency, args.token_latency,
+                           reply=make_reply(args.reply_words), fail_first=args.fail_first, fail_rate=args.fail_rate,
+                           fail_status=args.fail_status, retry_after=args.retry_after, slow_first=args.slow_first,
+                           slow_latency=args.slow_latency, prompt_latency=args.prompt_latency)
+    print(f"Stub LLM server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
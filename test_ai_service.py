@@ -0,0 +1,310 @@
+import unittest
+import sys
+import os
+import threading
+import time
+import json
+import tempfile
+from unittest import mock
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from ai_service import AIService, GenerationStep, LONG_STORY_PAGE_TOKENS
+from llm_cache import LLMResponseCache
+
+
+class FakeClient:
+    """Stands in for DeepInfraClient; replies echo the page number found in the prompt"""
+
+    def __init__(self, delay=0.0, failures=None):
+        self.delay = delay
+        self.failures = dict(failures or {})  # page number -> failures left before succeeding
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.calls = 0
+        self.choice_calls = []
+        self.max_attempts = []
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        page = int(prompt.split('Write page ')[1].split(' ')[0]) if 'Write page ' in prompt else 0
+        with self.lock:
+            self.calls += 1
+            self.max_attempts.append(kwargs.get('max_attempts'))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            with self.lock:
+                if self.failures.get(page, 0) > 0:
+                    self.failures[page] -= 1
+                    raise Exception(f"Transient failure on page {page}")
+            return f"Content for page {page}"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def chat_choices(self, prompt, system_msg="", max_tokens=2500, model="", temperature=0.7, top_p=0.9, n=1, **kwargs):
+        self.choice_calls.append(n)
+        return [f"Choice {i}" for i in range(1, n + 1)]
+
+
+class TestStoryFanOut(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = LLMResponseCache(os.path.join(self.tmpdir.name, 'llm_cache.db'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_pages_reassembled_in_order(self):
+        client = FakeClient(delay=0.05)
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 6, 'balanced')
+        expected = service.format_pages([f"Content for page {i}" for i in range(1, 7)])
+        self.assertEqual(story['content'], expected)
+        self.assertGreater(client.max_in_flight, 1)
+
+    def test_concurrency_capped_per_model(self):
+        client = FakeClient(delay=0.05)
+        service = AIService(client=client, cache=self.cache)
+        service.generate_titled_story("A heist on the moon", 8, 'smart')
+        # One more for the title, which runs alongside the pages
+        self.assertLessEqual(client.max_in_flight, service.models['smart']['max_concurrency'] + 1)
+
+    def test_failed_page_retried_individually(self):
+        client = FakeClient(failures={3: 2})
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 4, 'balanced')
+        self.assertIn("=== PAGE 3 ===\n\nContent for page 3", story['content'])
+        # Four pages, two retries of page 3 and the title
+        self.assertEqual(client.calls, 7)
+        # Page retries stand in for the client's own, so each page call is one HTTP attempt
+        self.assertEqual(client.max_attempts.count(1), 6)
+
+    def test_page_failing_every_retry_keeps_earlier_pages(self):
+        client = FakeClient(failures={2: 10})
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 3, 'balanced')
+        self.assertTrue(story['partial'])
+        self.assertEqual((story['pages_delivered'], story['pages_requested']), (1, 3))
+        self.assertEqual(story['content'], service.format_pages(["Content for page 1"]))
+
+    def test_failed_fan_out_stops_running_tasks_before_their_next_call(self):
+        client = FakeClient(delay=0.2)
+        service = AIService(client=client, cache=self.cache)
+        model = service.models['balanced']['name']
+
+        def failing():
+            # Fail while the other tasks' first calls are in flight
+            while client.in_flight < 2:
+                time.sleep(0.01)
+            raise Exception("Page failed every retry")
+
+        def two_calls():
+            service._call_model(None, "Write page 1 of the draft", "", model=model)
+            return service._call_model(None, "Write page 2 of the draft", "", model=model)
+
+        outcomes = service._run_concurrently([failing, two_calls, two_calls], 3, fail_fast=True)
+        self.assertEqual(str(outcomes[0][1]), "Page failed every retry")
+        time.sleep(0.5)
+        # The calls already in flight finished; neither task started its second one
+        self.assertEqual((client.calls, client.in_flight), (2, 0))
+
+
+class TestWriteVariants(unittest.TestCase):
+    def test_single_request_when_model_supports_n(self):
+        client = FakeClient()
+        service = AIService(client=client)
+        result = service.sudowrite_write_tool("The door creaked", variants=3, model_type='balanced')
+        self.assertTrue(result['success'])
+        self.assertEqual([v['content'] for v in result['variants']], ["Choice 1", "Choice 2", "Choice 3"])
+        self.assertEqual(client.choice_calls, [3])
+        self.assertEqual(client.calls, 0)
+
+    def test_fan_out_returns_partial_results(self):
+        client = FakeClient(delay=0.05, failures={0: 1})
+        service = AIService(client=client)
+        result = service.sudowrite_write_tool("The door creaked", variants=3, model_type='creative')
+        self.assertTrue(result['success'])
+        self.assertEqual(len(result['variants']), 2)
+        self.assertEqual(result['requested'], 3)
+        self.assertEqual(client.calls, 3)
+        self.assertGreater(client.max_in_flight, 1)
+
+
+class ChunkClient:
+    """Echoes which part of a chunked file each prompt covered"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.prompts = []
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        with self.lock:
+            self.prompts.append(prompt)
+        time.sleep(0.02)
+        if 'These are summaries' in prompt:
+            return "Combined summary"
+        part = prompt.split('This is part ')[1].split(' ')[0]
+        return f"Processed part {part}"
+
+
+class TestFileChunking(unittest.TestCase):
+    def setUp(self):
+        # ~40 paragraphs of 100 words: far more than one 'balanced' expand chunk
+        self.manuscript = '\n\n'.join(f"Paragraph {i} " + 'word ' * 98 for i in range(40))
+
+    def test_chunks_break_on_paragraphs_within_budget(self):
+        from file_analyzer import FileAnalyzer
+        chunks = FileAnalyzer.split_into_chunks(self.manuscript, 350)
+        self.assertEqual(len(chunks), 14)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.split()), 350)
+            self.assertTrue(chunk.startswith('Paragraph'))
+
+    def test_chunks_keep_line_breaks_inside_paragraphs(self):
+        from file_analyzer import FileAnalyzer
+        scene = "INT. LIGHTHOUSE - NIGHT\nMARA\nWho lit the lamp?\nTOMAS\nNobody. It lit itself."
+        poem = '\n'.join(f"Line {i} of the storm song" for i in range(60))
+        chunks = FileAnalyzer.split_into_chunks(scene + '\n\n' + poem, 100)
+        self.assertEqual(chunks[0], scene)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.split()), 100)
+        # An oversized paragraph is broken between its lines, not re-flowed
+        self.assertEqual('\n'.join(chunks[1:]), poem)
+
+    def test_expand_stitches_chunks_in_order_with_progress(self):
+        client = ChunkClient()
+        service = AIService(client=client, cache=None)
+        updates = []
+        result = service.process_uploaded_file(self.manuscript, 'expand', 'balanced', progress=lambda d, t: updates.append((d, t)))
+        self.assertTrue(result['success'])
+        total = result['chunks']
+        self.assertGreater(total, 1)
+        self.assertEqual(result['content'], '\n\n'.join(f"Processed part {i}" for i in range(1, total + 1)))
+        self.assertEqual(sorted(updates), [(i, total) for i in range(1, total + 1)])
+
+    def test_summarize_reduces_chunk_summaries(self):
+        client = ChunkClient()
+        service = AIService(client=client)
+        result = service.process_uploaded_file(self.manuscript * 3, 'summarize', 'smart', use_cache=False)
+        self.assertEqual(result['content'], "Combined summary")
+        self.assertIn("Processed part 1", client.prompts[-1])
+
+
+class OutlineClient:
+    """Answers the outline call with JSON (or garbage) and echoes the overall page number otherwise"""
+
+    def __init__(self, outline_reply=None):
+        self.outline_reply = outline_reply
+        self.lock = threading.Lock()
+        self.outline_calls = 0
+        self.page_tokens = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        if 'Reply with JSON only' in prompt:
+            self.outline_calls += 1
+            chapters = int(prompt.split('must be exactly ')[1].split(' ')[0])
+            return self.outline_reply or json.dumps({
+                'title': 'The Long Night',
+                'characters': ['Mara - a lighthouse keeper'],
+                'chapters': [{'title': f"Storm {i}", 'summary': f"Events of chapter {i}."} for i in range(1, chapters + 1)]
+            })
+        if 'title' in system_msg:
+            return "The Long Night"
+        with self.lock:
+            self.page_tokens.add(max_tokens)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(0.005)
+            return f"Text for page {prompt.split('(page ')[1].split(' ')[0]}"
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+class TestLongStories(unittest.TestCase):
+    def test_hundred_pages_expanded_from_one_outline(self):
+        client = OutlineClient()
+        service = AIService(client=client, cache=None)
+        updates = []
+        story = service.generate_titled_story("A storm that never ends", 100, 'creative',
+                                              progress=lambda d, t: updates.append((d, t)))['content']
+        self.assertEqual(story.count('=== PAGE '), 100)
+        self.assertIn("=== PAGE 1 ===\n\nChapter 1: Storm 1\n\nText for page 1", story)
+        self.assertIn("=== PAGE 100 ===\n\nText for page 100", story)
+        self.assertEqual(story.count('Chapter '), 20)
+        self.assertEqual(client.outline_calls, 1)
+        self.assertEqual(client.page_tokens, {LONG_STORY_PAGE_TOKENS})
+        self.assertLessEqual(client.max_in_flight, service.models['creative']['max_concurrency'])
+        self.assertEqual(max(updates), (101, 101))
+
+    def test_unparseable_outline_still_yields_pages(self):
+        client = OutlineClient(outline_reply="1. They meet\n2. They fight\n3. They part")
+        service = AIService(client=client)
+        story = service.generate_story("A storm that never ends", 60)
+        self.assertEqual(story.count('=== PAGE '), 60)
+        self.assertIn("Chapter 12: Part 12", story)
+
+
+class TestGenerationSteps(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = LLMResponseCache(os.path.join(self.tmpdir.name, 'llm_cache.db'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_title_and_pages_run_concurrently(self):
+        client = FakeClient(delay=0.1)
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 2, 'balanced')
+        self.assertTrue(story['success'])
+        self.assertEqual(story['title'], "Content for page 0")
+        self.assertEqual(story['content'], service.format_pages(["Content for page 1", "Content for page 2"]))
+        self.assertEqual(set(story['steps']), {'title', 'page_1', 'page_2', 'story'})
+        self.assertEqual(client.max_in_flight, 3)
+
+    def test_title_requests_the_fast_model(self):
+        service = AIService(client=FakeClient(), cache=self.cache)
+        with mock.patch.object(service, '_call_model', wraps=service._call_model) as call_model:
+            self.assertEqual(service.generate_titled_story("A heist on the moon", 1, 'creative')['title'], "Content for page 0")
+        title_calls = [call for call in call_model.call_args_list if 'title generator' in call.args[2]]
+        self.assertEqual([call.args[0] for call in title_calls], ['fast'])
+        self.assertEqual(title_calls[0].kwargs['model'], service.models['fast']['name'])
+
+    def test_failed_page_cuts_story_short_but_keeps_other_steps(self):
+        client = FakeClient(failures={2: 10})
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 3, 'balanced')
+        self.assertTrue(story['success'])
+        self.assertTrue(story['partial'])
+        self.assertEqual(story['content'], service.format_pages(["Content for page 1"]))
+        self.assertEqual(story['title'], "Content for page 0")
+        self.assertTrue(story['steps']['page_3']['success'])
+
+    def test_failed_first_page_fails_story(self):
+        client = FakeClient(failures={1: 10})
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 3, 'balanced')
+        self.assertFalse(story['success'])
+        self.assertIn("Transient failure on page 1", story['error'])
+
+    def test_dependencies_receive_results_and_cycles_rejected(self):
+        outcomes = AIService._run_steps([
+            GenerationStep('draft', lambda _: "draft"),
+            GenerationStep('summary', lambda inputs: f"summary of {inputs['draft']}", after=['draft'])
+        ], max_workers=2)
+        self.assertEqual(outcomes['summary']['result'], "summary of draft")
+        with self.assertRaises(ValueError):
+            AIService._run_steps([GenerationStep('a', lambda _: 1, after=['b']),
+                                  GenerationStep('b', lambda _: 2, after=['a'])], max_workers=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
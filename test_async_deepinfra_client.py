@@ -0,0 +1,103 @@
+import unittest
+import sys
+import os
+import asyncio
+import time
+
+sys.path.append(os.getcwd())
+
+from async_deepinfra_client import AsyncDeepInfraClient, DeepInfraGateway, ask_deepinfra_async
+from deepinfra_client import DeepInfraClient
+from llm_resilience import RetryPolicy, CircuitBreaker, CircuitBreakerRegistry
+import request_deadline
+from request_deadline import DeadlineExceeded
+from stub_llm_server import StubLLMServer
+
+
+class TestAsyncDeepInfraClient(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubLLMServer(latency=0.2).start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_concurrent_calls_share_one_loop(self):
+        async def scenario():
+            client = AsyncDeepInfraClient(api_key='test-key', base_url=self.stub.base_url)
+            try:
+                start = time.perf_counter()
+                replies = await asyncio.gather(*(client.chat(f"Story {i}") for i in range(50)))
+                return replies, time.perf_counter() - start
+            finally:
+                await client.aclose()
+
+        replies, elapsed = asyncio.run(scenario())
+        self.assertEqual(set(replies), {StubLLMServer.DEFAULT_REPLY})
+        # 50 calls of 0.2s each finish in roughly one round trip, not 10s
+        self.assertLess(elapsed, 2.0)
+
+    def test_retries_transient_errors(self):
+        self.stub.fail_first = 1
+
+        async def scenario():
+            client = AsyncDeepInfraClient(api_key='test-key', base_url=self.stub.base_url,
+                                          retry_policy=RetryPolicy(max_attempts=2, base_delay=0.01))
+            try:
+                return await client.chat("Tell me a story")
+            finally:
+                await client.aclose()
+
+        self.assertEqual(asyncio.run(scenario()), StubLLMServer.DEFAULT_REPLY)
+        self.assertEqual(self.stub.requests_served, 2)
+
+    def test_timeout_cut_short_by_deadline_not_counted(self):
+        breakers = CircuitBreakerRegistry(failure_threshold=1)
+
+        async def scenario():
+            client = AsyncDeepInfraClient(api_key='test-key', base_url=self.stub.base_url, breakers=breakers)
+            try:
+                with request_deadline.deadline(0.05):
+                    return await client.chat("Tell me a story")
+            finally:
+                await client.aclose()
+
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(scenario())
+        self.assertEqual(breakers.get('mistralai/Mistral-7B-Instruct-v0.3').state, CircuitBreaker.CLOSED)
+
+    def test_ask_deepinfra_async(self):
+        os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+        os.environ['DEEPINFRA_BASE_URL'] = self.stub.base_url
+        try:
+            self.assertEqual(asyncio.run(ask_deepinfra_async("Tell me a story")), StubLLMServer.DEFAULT_REPLY)
+        finally:
+            del os.environ['DEEPINFRA_BASE_URL']
+
+
+class TestDeepInfraGateway(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubLLMServer().start()
+        self.gateway = DeepInfraGateway(api_key='test-key', base_url=self.stub.base_url)
+
+    def tearDown(self):
+        self.gateway.close()
+        self.stub.stop()
+
+    def test_sync_chat_and_stream(self):
+        self.assertEqual(self.gateway.chat("Tell me a story"), StubLLMServer.DEFAULT_REPLY)
+        fragments = list(self.gateway.stream_chat("Tell me a story"))
+        self.assertGreater(len(fragments), 1)
+        self.assertEqual(''.join(fragments), StubLLMServer.DEFAULT_REPLY)
+
+    def test_replies_stripped_like_sync_client(self):
+        self.stub.reply = "\n  A padded reply  \n"
+        sync_client = DeepInfraClient(api_key='test-key', base_url=self.stub.base_url)
+        try:
+            self.assertEqual(self.gateway.chat("Tell me a story"), "A padded reply")
+            self.assertEqual(self.gateway.chat("Tell me a story"), sync_client.chat("Tell me a story"))
+        finally:
+            sync_client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from billing import calculate_page_credits, credits_for_pages, credits_for_generation, record_delivery
+from generation_checkpoints import GenerationCheckpoints
+
+
+class TestBilling(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoints = GenerationCheckpoints(os.path.join(self.tmpdir.name, 'checkpoints.db'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_page_credits_follow_the_model(self):
+        self.assertEqual(calculate_page_credits(10, 'creative'), 15)
+        self.assertEqual(calculate_page_credits(1, 'fast'), 1)
+
+    def test_runs_of_one_generation_never_cost_more_than_the_quote(self):
+        first = credits_for_pages(10, 1, 3)
+        second = credits_for_pages(10, 2, 3, already_charged=first)
+        third = credits_for_pages(10, 3, 3, already_charged=first + second)
+        self.assertEqual((first, second, third), (4, 3, 3))
+        self.assertEqual(credits_for_pages(10, 0, 3), 0)
+
+    def test_resumed_generation_charged_for_new_pages_only(self):
+        for page_number in (1, 2):
+            self.checkpoints.save_page('gen', page_number, f"Page {page_number}")
+        partial = {'generation_id': 'gen', 'pages_billable': 2, 'pages_delivered': 2, 'pages_requested': 4}
+        self.assertEqual(credits_for_generation(partial, 8, 'balanced', self.checkpoints), 4)
+        record_delivery(partial, 4, self.checkpoints)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 4)
+
+        finished = dict(partial, pages_billable=2, pages_delivered=4)
+        self.assertEqual(credits_for_generation(finished, 8, 'balanced', self.checkpoints), 4)
+        record_delivery(finished, 4, self.checkpoints)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 0)
+
+    def test_resume_after_discounted_partial_run_charges_the_rest_of_the_quote(self):
+        for page_number in (1, 2):
+            self.checkpoints.save_page('gen', page_number, f"Page {page_number}")
+        # The first run fell back from creative to balanced for both of its pages
+        partial = {'generation_id': 'gen', 'pages_billable': 2, 'pages_delivered': 2, 'pages_requested': 4,
+                   'models_used': {'balanced': 2}}
+        first = credits_for_generation(partial, 12, 'creative', self.checkpoints)
+        self.assertEqual(first, 4)
+        record_delivery(partial, first, self.checkpoints)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 4)
+
+        finished = dict(partial, pages_delivered=4, models_used={'creative': 2})
+        second = credits_for_generation(finished, 12, 'creative', self.checkpoints)
+        self.assertEqual((second, first + second), (8, 12))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import sys
+import os
+
+sys.path.append(os.getcwd())
+
+from deepinfra_client import DeepInfraClient, get_deepinfra_client
+from stub_llm_server import StubLLMServer
+
+
+class TestDeepInfraClient(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubLLMServer().start()
+        self.client = DeepInfraClient(api_key='test-key', base_url=self.stub.base_url, pool_size=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_chat_returns_content(self):
+        content = self.client.chat("Tell me a story", "You are a storyteller.")
+        self.assertEqual(content, StubLLMServer.DEFAULT_REPLY)
+
+    def test_stream_chat_yields_fragments(self):
+        fragments = list(self.client.stream_chat("Tell me a story"))
+        self.assertGreater(len(fragments), 1)
+        self.assertEqual(''.join(fragments), StubLLMServer.DEFAULT_REPLY)
+
+    def test_connection_is_reused(self):
+        for _ in range(5):
+            self.client.chat("Tell me a story")
+        self.assertEqual(self.stub.requests_served, 5)
+        self.assertEqual(self.stub.connections_opened, 1)
+
+    def test_missing_api_key(self):
+        client = DeepInfraClient(api_key=None, base_url=self.stub.base_url)
+        client.api_key = None
+        with self.assertRaises(Exception) as ctx:
+            client.chat("Tell me a story")
+        self.assertIn("DEEPINFRA_API_KEY", str(ctx.exception))
+        self.assertEqual(self.stub.requests_served, 0)
+
+    def test_worker_client_is_shared(self):
+        self.assertIs(get_deepinfra_client(), get_deepinfra_client())
+
+
+if __name__ == '__main__':
+    unittest.main()
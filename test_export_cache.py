@@ -0,0 +1,52 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+
+from export_cache import ExportArtifactCache
+
+
+class TestExportArtifactCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ExportArtifactCache(self.tmpdir.name, max_bytes=1000)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip_and_content_addressing(self):
+        key = self.cache.make_key('AB12CD', "Title", "Once upon a time", 'pdf')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, b'%PDF-rendered')
+        self.assertEqual(self.cache.get(key), b'%PDF-rendered')
+        self.assertEqual(key, self.cache.make_key('AB12CD', "Title", "Once upon a time", 'pdf'))
+        self.assertNotEqual(key, self.cache.make_key('AB12CD', "Title", "Once upon a time.", 'pdf'))
+        self.assertNotEqual(key, self.cache.make_key('AB12CD', "Title", "Once upon a time", 'docx'))
+
+    def test_invalidate_drops_only_that_owner(self):
+        mine = self.cache.make_key('AB12CD', "Title", "Text", 'pdf')
+        other = self.cache.make_key('AB12CDE', "Title", "Text", 'pdf')
+        self.cache.put(mine, b'mine')
+        self.cache.put(other, b'other')
+        self.cache.invalidate('AB12CD')
+        self.assertIsNone(self.cache.get(mine))
+        self.assertEqual(self.cache.get(other), b'other')
+
+    def test_least_recently_used_evicted_past_size_limit(self):
+        keys = [self.cache.make_key(f"P{i}", "Title", "Text", 'docx') for i in range(3)]
+        for age, key in enumerate(keys[:2]):
+            self.cache.put(key, b'x' * 400)
+            past = time.time() - 100 + age
+            os.utime(os.path.join(self.cache.cache_dir, key), (past, past))
+        # Reading P0 makes P1 the least recently used
+        self.cache.get(keys[0])
+        self.cache.put(keys[2], b'x' * 400)
+        self.assertIsNotNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+if __name__ == '__main__':
+    unittest.main()
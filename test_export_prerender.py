@@ -0,0 +1,85 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.getcwd())
+
+from export_cache import ExportArtifactCache
+from export_metrics import ExportMetrics, HIT, MISS, PRERENDERED, PRERENDER_FAILED
+from export_prerender import ExportPrerenderer
+from render_pool import RenderPool
+
+STORY = "Page 1\n\nThe caravan set out at dusk."
+
+
+class CountingPool(RenderPool):
+    """In-thread RenderPool remembering what it rendered"""
+
+    def __init__(self):
+        super().__init__(workers=0)
+        self.rendered = []
+
+    def render(self, format, title, content, output, timeout=None):
+        self.rendered.append((format, content))
+        if format == 'docx':
+            raise Exception("docx renderer unavailable")
+        super().render(format, title, content, output, timeout)
+
+
+class TestExportPrerender(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = ExportArtifactCache(cache_dir=os.path.join(self.tmpdir.name, 'exports'))
+        self.metrics = ExportMetrics(os.path.join(self.tmpdir.name, 'export_metrics.db'))
+        self.pool = CountingPool()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def prerenderer(self, formats, **kwargs):
+        return ExportPrerenderer(formats=formats, cache=self.cache, pool=self.pool, metrics=self.metrics, **kwargs)
+
+    def test_saved_project_is_cached_in_configured_formats(self):
+        prerenderer = self.prerenderer(['pdf', 'txt', 'docx'])
+        self.assertTrue(prerenderer.schedule('ABC123', "The Shifting Map", STORY))
+        self.assertTrue(prerenderer.join(timeout=30))
+
+        for format in ('pdf', 'txt'):
+            self.assertTrue(self.cache.contains(self.cache.make_key('ABC123', "The Shifting Map", STORY, format)))
+        self.assertFalse(self.cache.contains(self.cache.make_key('ABC123', "The Shifting Map", STORY, 'docx')))
+        summary = self.metrics.summary()
+        self.assertEqual(summary['pdf'][PRERENDERED], 1)
+        self.assertEqual(summary['docx'][PRERENDER_FAILED], 1)
+
+        # Already cached formats aren't rendered again
+        prerenderer.prerender('ABC123', "The Shifting Map", STORY)
+        self.assertEqual([format for format, _ in self.pool.rendered].count('pdf'), 1)
+
+    def test_queued_saves_coalesce_and_queue_is_bounded(self):
+        prerenderer = self.prerenderer(['txt'], max_queued=1)
+        with prerenderer._cond:
+            # The thread can't pick anything up while the condition is held
+            prerenderer.schedule('ABC123', "Draft", "first draft")
+            prerenderer.schedule('ABC123', "Draft", "second draft")
+            self.assertFalse(prerenderer.schedule('XYZ789', "Other", "other story"))
+        self.assertTrue(prerenderer.join(timeout=30))
+        self.assertEqual(self.pool.rendered, [('txt', "second draft")])
+
+    def test_disabled_without_formats(self):
+        prerenderer = self.prerenderer([])
+        self.assertFalse(prerenderer.schedule('ABC123', "The Shifting Map", STORY))
+        self.assertIsNone(prerenderer._thread)
+
+    def test_hit_rate_per_format(self):
+        for event in (HIT, HIT, HIT, MISS):
+            self.metrics.record('pdf', event)
+        self.metrics.record('docx', MISS)
+        summary = self.metrics.summary()
+        self.assertEqual(summary['pdf']['hit_rate'], 0.75)
+        self.assertEqual(summary['docx']['hit_rate'], 0.0)
+        self.assertIn('penora_export_downloads_total{format="pdf",cache="hit"} 3', self.metrics.render_prometheus())
+
+
+if __name__ == '__main__':
+    unittest.main()
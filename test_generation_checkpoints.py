@@ -0,0 +1,123 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from ai_service import AIService
+from generation_checkpoints import GenerationCheckpoints
+from llm_cache import LLMResponseCache
+from test_ai_service import FakeClient
+
+
+class TestGenerationCheckpoints(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoints = GenerationCheckpoints(os.path.join(self.tmpdir.name, 'checkpoints.db'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_id_depends_on_user_and_request(self):
+        make_id = GenerationCheckpoints.make_id
+        self.assertEqual(make_id(1, "A heist", 4, 'balanced'), make_id('1', "A heist", 4, 'balanced'))
+        self.assertNotEqual(make_id(1, "A heist", 4, 'balanced'), make_id(2, "A heist", 4, 'balanced'))
+        self.assertNotEqual(make_id(1, "A heist", 4, 'balanced'), make_id(1, "A heist", 5, 'balanced'))
+
+    def test_partial_delivery_marks_pages_billed_and_complete_forgets(self):
+        self.checkpoints.save_page('gen', 1, "Page one", 'balanced')
+        self.checkpoints.save_page('gen', 2, "Page two", 'fast')
+        self.checkpoints.save_page('gen', 2, "Page two again")
+        self.assertEqual(self.checkpoints.pages('gen')[2], {'content': "Page two", 'model_type': 'fast', 'billed': False})
+
+        self.checkpoints.record_delivery('gen', 1, 4)
+        self.assertEqual({n: page['billed'] for n, page in self.checkpoints.pages('gen').items()}, {1: True, 2: False})
+
+        self.checkpoints.record_delivery('gen', 4, 4)
+        self.assertEqual(self.checkpoints.pages('gen'), {})
+
+    def test_credits_charged_kept_until_generation_completes(self):
+        for page_number in (1, 2):
+            self.checkpoints.save_page('gen', page_number, f"Page {page_number}")
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 0)
+        # A 10 credit quote: 1 of 3 pages delivered, then 2
+        self.checkpoints.record_delivery('gen', 1, 3, credits_charged=4)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 4)
+        self.checkpoints.record_delivery('gen', 2, 3, credits_charged=7)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 7)
+
+        self.checkpoints.record_delivery('gen', 3, 3)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 0)
+        with self.checkpoints.get_db_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM generation_charges").fetchone()[0], 0)
+
+    def test_expired_pages_ignored(self):
+        checkpoints = GenerationCheckpoints(self.checkpoints.db_path, ttl_seconds=-1)
+        checkpoints.save_page('gen', 1, "Page one")
+        self.assertEqual(checkpoints.pages('gen'), {})
+
+
+class TestResumableStory(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.checkpoints = GenerationCheckpoints(os.path.join(self.tmpdir.name, 'checkpoints.db'))
+        self.cache = LLMResponseCache(os.path.join(self.tmpdir.name, 'llm_cache.db'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def service(self, client):
+        return AIService(client=client, cache=self.cache, checkpoints=self.checkpoints)
+
+    def test_failed_run_resumes_from_checkpointed_pages(self):
+        first = self.service(FakeClient(failures={3: 10}))
+        usage = []
+        story = first.generate_titled_story("A heist on the moon", 4, 'balanced', usage=usage, generation_id='gen')
+        self.assertTrue(story['partial'])
+        self.assertEqual((story['pages_delivered'], story['pages_billable']), (2, 2))
+        self.assertEqual(len(usage), 2)
+        # Page 4 finished too, so it is kept for the next run
+        self.assertEqual(set(self.checkpoints.pages('gen')), {1, 2, 4})
+        self.checkpoints.record_delivery('gen', story['pages_delivered'], 4)
+
+        client = FakeClient()
+        story = self.service(client).generate_titled_story("A heist on the moon", 4, 'balanced', generation_id='gen')
+        self.assertFalse(story['partial'])
+        self.assertEqual(story['content'], first.format_pages([f"Content for page {i}" for i in range(1, 5)]))
+        # Only page 3 is generated again (the title comes from the response cache), and pages 1-2 aren't billed twice
+        self.assertEqual(client.calls, 1)
+        self.assertEqual(story['pages_billable'], 2)
+
+    def test_long_story_resumes_from_its_outline_and_pages(self):
+        # Every chapter's third page fails, so the first run delivers pages 1-2 of 60
+        first = self.service(FakeClient(failures={3: 100}))
+        story = first.generate_titled_story("A heist on the moon", 60, 'balanced', generation_id='gen')
+        self.assertTrue(story['partial'])
+        self.assertEqual((story['pages_delivered'], story['pages_billable']), (2, 2))
+        self.checkpoints.record_delivery('gen', 2, 60, credits_charged=5)
+        self.assertEqual(self.checkpoints.credits_charged('gen'), 5)
+        outline = self.checkpoints.outline('gen')
+        self.assertIsNotNone(outline)
+
+        client = FakeClient()
+        prompts = []
+        chat = client.chat
+        client.chat = lambda prompt, *args, **kwargs: prompts.append(prompt) or chat(prompt, *args, **kwargs)
+        story = self.service(client).generate_titled_story("A heist on the moon", 60, 'balanced', generation_id='gen')
+        self.assertFalse(story['partial'])
+        self.assertEqual(story['pages_billable'], 58)
+        self.assertTrue(story['content'].startswith(f"=== PAGE 1 ===\n\nChapter 1: {outline['chapters'][0]['title']}"))
+        # Neither the outline nor the delivered pages are generated again
+        self.assertFalse(any('Plan a' in prompt for prompt in prompts))
+        self.assertFalse(any('(page 1 of 60 overall)' in prompt or '(page 2 of 60 overall)' in prompt for prompt in prompts))
+
+    def test_without_generation_id_nothing_is_stored(self):
+        self.service(FakeClient()).generate_titled_story("A heist on the moon", 2, 'balanced')
+        with self.checkpoints.get_db_connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM generation_pages").fetchone()[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+sys.path.append(os.getcwd())
+
+from job_queue import JobQueue
+from job_worker import JobWorker, JobError
+import job_worker
+
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'jobs.db')
+        self.queue = JobQueue(self.db_path, lease_seconds=60, max_attempts=2)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_jobs_claimed_in_order_and_completed(self):
+        first = self.queue.enqueue('u1', 'story', {'prompt': 'one'})
+        second = self.queue.enqueue('u1', 'story', {'prompt': 'two'})
+        self.assertEqual(self.queue.position(second), 1)
+
+        job = self.queue.claim('w1')
+        self.assertEqual(job['job_id'], first)
+        self.assertEqual(job['payload'], {'prompt': 'one'})
+
+        self.queue.set_progress(first, 2, 5)
+        self.assertEqual(self.queue.get(first)['progress'], {'done': 2, 'total': 5})
+
+        self.queue.complete(first, {'content': 'done'})
+        stored = self.queue.get(first)
+        self.assertEqual(stored['status'], JobQueue.COMPLETED)
+        self.assertEqual(stored['result'], {'content': 'done'})
+
+    def test_each_job_claimed_once_across_workers(self):
+        for i in range(20):
+            self.queue.enqueue('u1', 'story', {'n': i})
+        claimed = []
+        lock = threading.Lock()
+
+        def drain():
+            # A separate instance per thread, as each gunicorn/job worker process has its own
+            queue = JobQueue(self.db_path)
+            while True:
+                job = queue.claim(threading.current_thread().name)
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job['job_id'])
+
+        threads = [threading.Thread(target=drain) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(claimed), 20)
+        self.assertEqual(len(set(claimed)), 20)
+
+    def test_abandoned_job_reclaimed_then_failed(self):
+        queue = JobQueue(self.db_path, lease_seconds=1, max_attempts=2)
+        job_id = queue.enqueue('u1', 'story', {})
+        queue.claim('crashed-worker')
+        self.assertIsNone(queue.claim('w2'))
+
+        time.sleep(1.1)
+        job = queue.claim('w2')
+        self.assertEqual((job['job_id'], job['attempts']), (job_id, 2))
+
+        time.sleep(1.1)
+        self.assertIsNone(queue.claim('w3'))
+        self.assertEqual(queue.get(job_id)['status'], JobQueue.FAILED)
+
+
+class TestJobWorker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.tmpdir.name, 'jobs.db'))
+        self.finalized = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def finalize(self, job, generation):
+        if job['payload'].get('broke'):
+            raise JobError("You don't have enough credits left to complete this generation.")
+        self.finalized.append(job['job_id'])
+        return {'content': generation['content'], 'credits_used': job['payload']['credits_needed']}
+
+    def make_worker(self, handler):
+        return JobWorker(self.queue, threads=2, poll_interval=0.05, handlers={'story': handler}, finalize=self.finalize)
+
+    def test_worker_runs_and_finalizes_jobs(self):
+        job_id = self.queue.enqueue('u1', 'story', {'prompt': 'p', 'credits_needed': 3})
+        worker = self.make_worker(lambda payload, progress: {'success': True, 'content': 'Once upon a time'})
+        worker.start()
+        deadline = time.time() + 5
+        while self.queue.get(job_id)['status'] != JobQueue.COMPLETED and time.time() < deadline:
+            time.sleep(0.05)
+        worker.stop()
+
+        self.assertEqual(self.queue.get(job_id)['result'], {'content': 'Once upon a time', 'credits_used': 3})
+        self.assertEqual(self.finalized, [job_id])
+
+    def test_failed_generation_is_not_charged(self):
+        job_id = self.queue.enqueue('u1', 'story', {'credits_needed': 3})
+        worker = self.make_worker(lambda payload, progress: {'success': False, 'error': 'Model unavailable'})
+        self.assertTrue(worker.run_once())
+        job = self.queue.get(job_id)
+        self.assertEqual((job['status'], job['error']), (JobQueue.FAILED, 'Model unavailable'))
+        self.assertEqual(self.finalized, [])
+
+    def test_job_reclaimed_by_another_worker_is_not_charged_twice(self):
+        job_id = self.queue.enqueue('u1', 'story', {'credits_needed': 3})
+        worker = self.make_worker(None)
+        job = self.queue.claim(worker.worker_id)
+
+        def generate(payload, progress):
+            # Meanwhile the lease runs out and another worker takes the job over
+            with self.queue.get_db_connection() as conn:
+                conn.execute("UPDATE generation_jobs SET worker_id = 'other-worker' WHERE job_id = ?", (job_id,))
+                conn.commit()
+            return {'success': True, 'content': 'text'}
+
+        worker.handlers = {'story': generate}
+        worker.process(job)
+        self.assertEqual(self.finalized, [])
+        self.assertEqual(self.queue.get(job_id)['status'], JobQueue.RUNNING)
+        self.assertFalse(self.queue.complete(job_id, {}, worker.worker_id))
+        self.assertTrue(self.queue.complete(job_id, {'content': 'text'}, 'other-worker'))
+
+    def test_finalize_error_fails_job(self):
+        job_id = self.queue.enqueue('u1', 'story', {'credits_needed': 3, 'broke': True})
+        worker = self.make_worker(lambda payload, progress: {'success': True, 'content': 'text'})
+        worker.run_once()
+        self.assertIn('credits', self.queue.get(job_id)['error'])
+
+    def test_worker_dying_after_charge_is_not_charged_again_on_retry(self):
+        queue = JobQueue(os.path.join(self.tmpdir.name, 'retry.db'), lease_seconds=1, max_attempts=2)
+        job_id = queue.enqueue('u1', 'story', {'credits_needed': 3, 'title': 'Moon heist'})
+        balance = [10]
+
+        class WorkerDied(BaseException):
+            """The process is killed (deploy, OOM) between charging and completing the job"""
+
+        class Credits:
+            def create_or_update_user(self, **kwargs):
+                pass
+
+            def deduct_credits(self, user_id, amount, app_name, description):
+                balance[0] -= amount
+                if balance[0] == 7:
+                    raise WorkerDied()
+                return True
+
+            def get_user_credits(self, user_id):
+                return balance[0]
+
+        generate = lambda payload, progress: {'success': True, 'content': 'Once upon a time'}
+        with mock.patch('shared_credit_workspace_system.unified_system', Credits()), \
+                mock.patch.object(job_worker, 'save_to_workspace', lambda user_id, title, content: 'ABC123'):
+            with self.assertRaises(WorkerDied):
+                JobWorker(queue, handlers={'story': generate}).run_once()
+            self.assertEqual(queue.get(job_id)['status'], JobQueue.RUNNING)
+
+            time.sleep(1.1)
+            self.assertTrue(JobWorker(queue, handlers={'story': generate}).run_once())
+
+        job = queue.get(job_id)
+        self.assertEqual((job['status'], job['attempts']), (JobQueue.COMPLETED, 2))
+        self.assertEqual((job['result']['credits_used'], job['result']['remaining_credits']), (3, 7))
+        self.assertEqual(balance[0], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import unittest
+import sys
+import os
+import tempfile
+from unittest import mock
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from ai_service import AIService
+from deepinfra_client import DeepInfraClient, DEEPINFRA_MODELS
+from llm_backends import MODELS, BackendRouter, OpenAICompatibleClient, with_local_backend
+from llm_cache import LLMResponseCache
+from model_router import ModelRouter, model_router as default_router
+from stub_llm_server import StubLLMServer
+from test_ai_service import FakeClient
+
+LOCAL_REPLY = "A reply from the box under the desk"
+
+
+class TestBackendRouter(unittest.TestCase):
+    def setUp(self):
+        self.models = {
+            'balanced': {'name': 'remote-model', 'backend': 'deepinfra'},
+            'fast': {'name': 'local-model', 'backend': 'local'}
+        }
+        self.remote, self.local = FakeClient(), FakeClient()
+        self.router = BackendRouter({'deepinfra': lambda: self.remote, 'local': lambda: self.local}, models=self.models)
+
+    def test_calls_go_to_the_models_backend(self):
+        self.router.chat("Hello", "system", model='local-model')
+        self.router.chat("Hello", "system", 100, 'remote-model')
+        self.router.chat_choices("Hello", model='local-model', n=2)
+        self.assertEqual((self.local.calls, self.remote.calls), (1, 1))
+        self.assertEqual(self.local.choice_calls, [2])
+
+    def test_model_type_routes_models_sharing_a_name(self):
+        self.models['fast']['name'] = 'remote-model'
+        self.router.chat("Hello", model='remote-model', model_type='fast')
+        self.router.for_model_type('fast').chat("Hello", model='remote-model')
+        self.router.chat("Hello", model='remote-model', model_type='balanced')
+        self.assertEqual((self.local.calls, self.remote.calls), (2, 1))
+
+    def test_unknown_models_use_default_backend(self):
+        self.router.chat("Hello", model='not-in-the-table')
+        self.assertEqual(self.remote.calls, 1)
+        self.models['fast']['backend'] = 'elsewhere'
+        with self.assertRaises(Exception):
+            self.router.chat("Hello", model='local-model')
+
+    def test_breakers_come_from_each_backend(self):
+        self.assertEqual(self.router.breakers.get('local-model').state, 'closed')
+
+
+class TestLocalModelTable(unittest.TestCase):
+    def test_local_entries_built_without_touching_deepinfra_models(self):
+        env = {'LOCAL_LLM_BASE_URL': 'http://10.0.0.5:8000/v1', 'LOCAL_LLM_MODEL_TYPES': 'fast, nonexistent',
+               'LOCAL_LLM_MODEL': 'llama-3-8b'}
+        with mock.patch.dict(os.environ, env):
+            models = with_local_backend(DEEPINFRA_MODELS)
+        self.assertEqual((models['fast']['name'], models['fast']['backend']), ('llama-3-8b', 'local'))
+        self.assertEqual(models['fast']['fallback'], 'balanced')
+        self.assertEqual(models['balanced'], DEEPINFRA_MODELS['balanced'])
+        self.assertNotIn('nonexistent', models)
+        self.assertEqual(DEEPINFRA_MODELS['fast']['backend'], 'deepinfra')
+
+    def test_no_local_server_keeps_the_table(self):
+        with mock.patch.dict(os.environ, {'LOCAL_LLM_MODEL_TYPES': 'fast'}):
+            os.environ.pop('LOCAL_LLM_BASE_URL', None)
+            self.assertIs(with_local_backend(DEEPINFRA_MODELS), DEEPINFRA_MODELS)
+
+
+class TestLocalBackend(unittest.TestCase):
+    def setUp(self):
+        self.remote = StubLLMServer().start()
+        self.local = StubLLMServer(reply=LOCAL_REPLY).start()
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.remote.stop()
+        self.local.stop()
+        self.tmpdir.cleanup()
+
+    def test_local_client_sends_no_deepinfra_key(self):
+        client = OpenAICompatibleClient(self.local.base_url)
+        self.assertNotIn('Authorization', client._headers())
+        self.assertEqual(client.chat("Tell me a story", model='local'), LOCAL_REPLY)
+        self.assertEqual(OpenAICompatibleClient(self.local.base_url, 'secret')._headers()['Authorization'], 'Bearer secret')
+
+    def test_fast_tasks_run_on_the_local_server(self):
+        router = BackendRouter({
+            'deepinfra': lambda: DeepInfraClient(api_key='test-key', base_url=self.remote.base_url),
+            'local': lambda: OpenAICompatibleClient(self.local.base_url)
+        })
+        service = AIService(client=router, cache=LLMResponseCache(os.path.join(self.tmpdir.name, 'llm_cache.db')))
+        with mock.patch.dict(DEEPINFRA_MODELS['fast'], {'name': 'local', 'backend': 'local'}):
+            ideas = service.sudowrite_brainstorm_tool('names', "A heist on the moon")
+            self.assertEqual(ideas['suggestions'], LOCAL_REPLY)
+            self.assertEqual(self.remote.requests_served, 0)
+
+            # The title is a fast task too; the balanced page stays on DeepInfra
+            self.assertEqual(service.generate_story_title("A heist on the moon")['title'], LOCAL_REPLY)
+            self.assertEqual((self.remote.requests_served, self.local.requests_served), (0, 2))
+            story = service.generate_titled_story("A lighthouse keeper's last night", 1, 'balanced')
+            self.assertEqual(story['title'], LOCAL_REPLY)
+            self.assertIn(StubLLMServer.DEFAULT_REPLY, story['content'])
+            self.assertEqual((self.remote.requests_served, self.local.requests_served), (1, 3))
+
+    def test_local_model_type_sharing_a_remote_name_runs_locally(self):
+        router = BackendRouter({
+            'deepinfra': lambda: DeepInfraClient(api_key='test-key', base_url=self.remote.base_url),
+            'local': lambda: OpenAICompatibleClient(self.local.base_url)
+        })
+        service = AIService(client=router, cache=LLMResponseCache(os.path.join(self.tmpdir.name, 'llm_cache.db')))
+        # The local server serves the same model name balanced runs on DeepInfra
+        with mock.patch.dict(DEEPINFRA_MODELS['fast'], {'backend': 'local'}):
+            self.assertEqual(service.sudowrite_brainstorm_tool('names', "A heist on the moon")['suggestions'], LOCAL_REPLY)
+            self.assertEqual(self.remote.requests_served, 0)
+
+    def test_open_local_breaker_falls_back_to_deepinfra(self):
+        self.assertIs(default_router.models, MODELS)
+        with mock.patch.dict(os.environ, {'LOCAL_LLM_BASE_URL': self.local.base_url, 'LOCAL_LLM_MODEL_TYPES': 'fast'}):
+            models = with_local_backend(DEEPINFRA_MODELS)
+        local = OpenAICompatibleClient(self.local.base_url)
+        remote = DeepInfraClient(api_key='test-key', base_url=self.remote.base_url)
+        backends = BackendRouter({'deepinfra': lambda: remote, 'local': lambda: local}, models=models)
+        model_router = ModelRouter(models=models)
+        self.assertEqual(model_router.candidates('fast', breakers=backends.breakers), ['fast', 'balanced'])
+
+        breaker = local.breakers.get('local')
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        # DeepInfra's Mistral breaker, which fast's name used to be looked up under, is still closed
+        self.assertEqual(remote.breakers.get(DEEPINFRA_MODELS['fast']['name']).state, 'closed')
+        self.assertEqual(model_router.candidates('fast', breakers=backends.breakers), ['balanced', 'fast'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from llm_cache import LLMResponseCache
+from ai_service import AIService
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = 0
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        self.calls += 1
+        return f"Reply {self.calls}"
+
+
+class TestLLMResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'cache.db')
+        self.cache = LLMResponseCache(self.db_path, ttl_seconds=60, max_entries=3)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_covers_every_parameter(self):
+        base = ('model', 'system', 'prompt', 100, 0.7)
+        key = LLMResponseCache.make_key(*base)
+        for i in range(len(base)):
+            changed = list(base)
+            changed[i] = changed[i] + 1 if isinstance(changed[i], (int, float)) else changed[i] + 'x'
+            self.assertNotEqual(key, LLMResponseCache.make_key(*changed))
+
+    def test_hit_and_miss_counters(self):
+        self.assertIsNone(self.cache.get('k'))
+        self.cache.set('k', 'value')
+        self.assertEqual(self.cache.get('k'), 'value')
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_entries_expire(self):
+        cache = LLMResponseCache(self.db_path, ttl_seconds=1)
+        cache.set('k', 'value')
+        time.sleep(1.1)
+        self.assertIsNone(cache.get('k'))
+
+    def test_least_recently_used_evicted(self):
+        for key in ('a', 'b', 'c'):
+            self.cache.set(key, key)
+            time.sleep(0.01)
+        self.cache.get('a')
+        self.cache.set('d', 'd')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 'a')
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_shared_between_instances(self):
+        other = LLMResponseCache(self.db_path)
+        self.cache.set('k', 'value')
+        self.assertEqual(other.get('k'), 'value')
+
+    def test_title_generation_uses_cache_with_opt_out(self):
+        client = CountingClient()
+        service = AIService(client=client, cache=self.cache)
+        first = service.generate_story_title("A dragon who fears fire")
+        second = service.generate_story_title("A dragon who fears fire")
+        self.assertEqual(first, second)
+        self.assertEqual(client.calls, 1)
+
+        service.generate_story_title("A dragon who fears fire", use_cache=False)
+        self.assertEqual(client.calls, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
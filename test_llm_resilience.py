@@ -0,0 +1,129 @@
+import unittest
+import sys
+import os
+import time
+
+sys.path.append(os.getcwd())
+
+from deepinfra_client import DeepInfraClient
+from llm_resilience import RetryPolicy, CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError, parse_retry_after
+from stub_llm_server import StubLLMServer
+import request_deadline
+from request_deadline import DeadlineExceeded
+
+
+def make_client(stub, max_attempts=3, threshold=5, reset=30, hedge_after=2.0):
+    return DeepInfraClient(
+        api_key='test-key',
+        base_url=stub.base_url,
+        retry_policy=RetryPolicy(max_attempts=max_attempts, base_delay=0.01, max_delay=0.05),
+        breakers=CircuitBreakerRegistry(failure_threshold=threshold, reset_timeout=reset),
+        hedge_after=hedge_after
+    )
+
+
+class TestRetries(unittest.TestCase):
+    def test_transient_errors_retried_until_success(self):
+        with StubLLMServer(fail_first=2, fail_status=503) as stub:
+            client = make_client(stub)
+            self.assertEqual(client.chat("Tell me a story"), StubLLMServer.DEFAULT_REPLY)
+            self.assertEqual(stub.requests_served, 3)
+            client.close()
+
+    def test_gives_up_after_max_attempts(self):
+        with StubLLMServer(fail_first=10, fail_status=502) as stub:
+            client = make_client(stub, max_attempts=2)
+            with self.assertRaises(Exception) as ctx:
+                client.chat("Tell me a story")
+            self.assertIn("502", str(ctx.exception))
+            self.assertEqual(stub.requests_served, 2)
+            client.close()
+
+    def test_caller_can_cap_attempts(self):
+        with StubLLMServer(fail_first=10, fail_status=503) as stub:
+            client = make_client(stub)
+            with self.assertRaises(Exception):
+                client.chat("Tell me a story", max_attempts=1)
+            self.assertEqual(stub.requests_served, 1)
+            client.close()
+
+    def test_client_errors_not_retried(self):
+        with StubLLMServer(fail_first=1, fail_status=400) as stub:
+            client = make_client(stub)
+            with self.assertRaises(Exception):
+                client.chat("Tell me a story")
+            self.assertEqual(stub.requests_served, 1)
+            client.close()
+
+    def test_retry_after_honoured(self):
+        with StubLLMServer(fail_first=1, fail_status=429, retry_after=0.3) as stub:
+            client = make_client(stub)
+            start = time.time()
+            client.chat("Tell me a story")
+            self.assertGreaterEqual(time.time() - start, 0.3)
+            client.close()
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("2"), 2.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertIsNone(parse_retry_after(None))
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_and_fails_fast(self):
+        with StubLLMServer(fail_first=100, fail_status=503) as stub:
+            client = make_client(stub, max_attempts=1, threshold=3)
+            for _ in range(3):
+                with self.assertRaises(Exception):
+                    client.chat("Tell me a story")
+            with self.assertRaises(CircuitOpenError):
+                client.chat("Tell me a story")
+            self.assertEqual(stub.requests_served, 3)
+            client.close()
+
+    def test_timeout_cut_short_by_deadline_not_counted(self):
+        with StubLLMServer(latency=1.0) as stub:
+            client = make_client(stub, threshold=1)
+            with request_deadline.deadline(0.2), self.assertRaises(DeadlineExceeded):
+                client.chat("Tell me a story")
+            self.assertEqual(stub.requests_served, 1)
+            self.assertEqual(client.breakers.get('mistralai/Mistral-7B-Instruct-v0.3').state, CircuitBreaker.CLOSED)
+            client.close()
+
+    def test_half_open_trial_closes_breaker(self):
+        breaker = CircuitBreaker('model', failure_threshold=1, reset_timeout=0.1)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        time.sleep(0.15)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens_breaker(self):
+        breaker = CircuitBreaker('model', failure_threshold=1, reset_timeout=0.1)
+        breaker.record_failure()
+        time.sleep(0.15)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class TestHedging(unittest.TestCase):
+    def test_backup_request_beats_slow_primary(self):
+        with StubLLMServer(slow_first=1, slow_latency=1.5) as stub:
+            client = make_client(stub, hedge_after=0.1)
+            start = time.time()
+            self.assertEqual(client.chat("Title please", hedge=True), StubLLMServer.DEFAULT_REPLY)
+            self.assertLess(time.time() - start, 1.0)
+            self.assertEqual(stub.requests_served, 2)
+            client.close()
+
+    def test_no_backup_when_primary_is_fast(self):
+        with StubLLMServer() as stub:
+            client = make_client(stub, hedge_after=0.5)
+            client.chat("Title please", hedge=True)
+            self.assertEqual(stub.requests_served, 1)
+            client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from llm_scheduler import LLMScheduler, SchedulerTimeout
+from ai_service import AIService
+from model_router import ModelRouter
+from llm_cache import LLMResponseCache
+
+MODEL = 'mistralai/Mistral-7B-Instruct-v0.3'
+
+
+class TestLLMScheduler(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'llm_scheduler.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def scheduler(self, **kwargs):
+        kwargs.setdefault('poll_interval', 0.01)
+        return LLMScheduler(self.db_path, **kwargs)
+
+    def test_global_cap_holds_across_instances(self):
+        in_flight = [0, 0]
+        lock = threading.Lock()
+
+        def call():
+            # A separate instance per thread, as each worker process has its own
+            scheduler = self.scheduler(max_in_flight=2)
+            slot = scheduler.acquire(MODEL)
+            with lock:
+                in_flight[0] += 1
+                in_flight[1] = max(in_flight[1], in_flight[0])
+            time.sleep(0.05)
+            with lock:
+                in_flight[0] -= 1
+            scheduler.release(slot)
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(in_flight[1], 2)
+
+    def test_single_call_not_starved_by_heavy_user(self):
+        scheduler = self.scheduler(max_in_flight=1, user_burst=100)
+        blocker = scheduler.acquire(MODEL)
+        order = []
+        lock = threading.Lock()
+
+        def call(user_id):
+            slot = self.scheduler(max_in_flight=1, user_burst=100).acquire(MODEL, user_id)
+            with lock:
+                order.append(user_id)
+            time.sleep(0.01)
+            scheduler.release(slot)
+
+        heavy = [threading.Thread(target=call, args=('heavy',)) for _ in range(10)]
+        for thread in heavy:
+            thread.start()
+        time.sleep(0.2)
+        light = threading.Thread(target=call, args=('light',))
+        light.start()
+        time.sleep(0.1)
+
+        self.assertEqual(scheduler.position('light'), 1)
+        self.assertEqual(scheduler.stats()['waiting'], {MODEL: 11})
+        scheduler.release(blocker)
+        for thread in heavy + [light]:
+            thread.join()
+        # Tags interleave users, so the late single call is served second, not eleventh
+        self.assertLessEqual(order.index('light'), 1)
+
+    def test_token_bucket_limits_user_burst(self):
+        scheduler = self.scheduler(user_burst=2, user_rate=0.01, wait_timeout=0.2)
+        scheduler.release(scheduler.acquire(MODEL, 'u1'))
+        scheduler.release(scheduler.acquire(MODEL, 'u1'))
+        with self.assertRaises(SchedulerTimeout):
+            scheduler.acquire(MODEL, 'u1')
+        # Other users have their own bucket, and the timed-out call left the queue
+        scheduler.release(scheduler.acquire(MODEL, 'u2'))
+        self.assertEqual(scheduler.stats()['waiting'], {})
+
+    def test_waiter_dropped_as_stale_queues_again(self):
+        scheduler = self.scheduler(max_in_flight=1, wait_timeout=5)
+        blocker = scheduler.acquire(MODEL)
+        acquired = []
+        thread = threading.Thread(target=lambda: acquired.append(scheduler.acquire(MODEL, 'u1')))
+        thread.start()
+        time.sleep(0.1)
+        # What another worker's stale sweep does to a waiter whose process stalled
+        with scheduler.get_db_connection() as conn:
+            conn.execute("DELETE FROM llm_waiters")
+            conn.commit()
+        time.sleep(0.1)
+        scheduler.release(blocker)
+        thread.join(timeout=2)
+        self.assertEqual(len(acquired), 1)
+
+    def test_waiters_with_a_free_slot_each_dispatch_without_queueing_behind_the_first(self):
+        scheduler = self.scheduler(max_in_flight=3, poll_interval=1.0)
+        slots = []
+        start = threading.Barrier(3)
+
+        def call():
+            start.wait()
+            slots.append(scheduler.acquire(MODEL, 'u1'))
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        began = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # None of them had to sit out a poll interval
+        self.assertLess(time.time() - began, 0.5)
+        self.assertEqual(len(slots), 3)
+
+    def test_waiters_poll_without_write_lock_until_a_slot_frees(self):
+        scheduler = self.scheduler(max_in_flight=1)
+        blocker = scheduler.acquire(MODEL)
+        dispatch = scheduler._try_dispatch
+        writes = []
+        scheduler._try_dispatch = lambda *args: writes.append(1) or dispatch(*args)
+        threads = [threading.Thread(target=lambda: scheduler.release(scheduler.acquire(MODEL, 'u1'))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Each waiter polls ~30 times here; none of those polls write while the slot is held
+        time.sleep(0.3)
+        self.assertEqual(writes, [])
+        scheduler.release(blocker)
+        for thread in threads:
+            thread.join(timeout=2)
+        self.assertEqual(scheduler.stats()['waiting'], {})
+        self.assertGreaterEqual(len(writes), 5)
+
+
+class CountingClient:
+    """Tracks calls in flight per model, since the scheduler's slots are per model"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.max_in_flight = 0
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        with self.lock:
+            self.in_flight[model] = self.in_flight.get(model, 0) + 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight[model])
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight[model] -= 1
+        return "Page text"
+
+
+class TestScheduledService(unittest.TestCase):
+    def test_fan_out_scheduled_for_calling_user(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            scheduler = LLMScheduler(os.path.join(tmpdir, 'llm_scheduler.db'), max_in_flight=1, poll_interval=0.01)
+            client = CountingClient()
+            service = AIService(client=client, router=ModelRouter(), scheduler=scheduler,
+                                cache=LLMResponseCache(os.path.join(tmpdir, 'llm_cache.db')))
+            with LLMScheduler.user_context('u1'):
+                story = service.generate_titled_story("A heist", 4, 'balanced')
+            self.assertTrue(story['success'])
+            self.assertEqual(client.max_in_flight, 1)
+            with scheduler.get_db_connection() as conn:
+                tokens = conn.execute("SELECT tokens FROM llm_buckets WHERE user_id = 'u1'").fetchone()[0]
+            self.assertLess(tokens, scheduler.user_burst - 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
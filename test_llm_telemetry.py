@@ -0,0 +1,94 @@
+import unittest
+import sys
+import os
+import tempfile
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from ai_service import AIService
+from deepinfra_client import DeepInfraClient
+from llm_telemetry import LLMTelemetry, LATENCY_BUCKETS
+from model_router import ModelRouter
+from stub_llm_server import StubLLMServer
+
+MODEL = 'mistralai/Mistral-7B-Instruct-v0.3'
+
+
+class TestClientUsage(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubLLMServer().start()
+        self.client = DeepInfraClient(api_key='test-key', base_url=self.stub.base_url, pool_size=2)
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_chat_reports_provider_usage_and_ttfb(self):
+        usage = {}
+        self.client.chat("Tell me a story", "You are a storyteller.", usage=usage)
+        self.assertEqual(usage['prompt_tokens'], 4)
+        self.assertEqual(usage['completion_tokens'], len(StubLLMServer.DEFAULT_REPLY.split()))
+        self.assertGreaterEqual(usage['ttfb'], 0)
+
+    def test_stream_reports_usage_once_exhausted(self):
+        usage = {}
+        fragments = list(self.client.stream_chat("Tell me a story", usage=usage))
+        self.assertEqual(''.join(fragments), StubLLMServer.DEFAULT_REPLY)
+        self.assertEqual(usage['completion_tokens'], len(fragments))
+        self.assertIn('ttfb', usage)
+
+
+class UsageClient:
+    """Replies with the prompt; reports provider usage like DeepInfraClient"""
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", usage=None, **kwargs):
+        if prompt == 'fail':
+            raise Exception("DeepInfra unavailable")
+        if usage is not None:
+            usage.update(prompt_tokens=100, completion_tokens=40, ttfb=0.01)
+        return "" if prompt == 'empty' else f"Reply to {prompt}"
+
+
+class TestLLMTelemetry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.telemetry = LLMTelemetry(os.path.join(self.tmpdir.name, 'llm_telemetry.db'))
+        self.service = AIService(client=UsageClient(), router=ModelRouter(), telemetry=self.telemetry)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def usage(self):
+        return {(row['feature'], row['outcome']): row for row in self.telemetry.daily(1)}
+
+    def test_calls_rolled_up_by_feature_and_outcome(self):
+        self.service.sudowrite_brainstorm_tool('characters', count=3, use_cache=False)
+        self.service.sudowrite_rewrite_tool('The storm came.')
+        usage = self.usage()
+        self.assertEqual(usage[('brainstorm_tool', 'ok')]['calls'], 1)
+        self.assertEqual(usage[('brainstorm_tool', 'ok')]['prompt_tokens'], 100)
+        self.assertEqual(usage[('rewrite_tool', 'ok')]['completion_tokens'], 40)
+        self.assertEqual(usage[('rewrite_tool', 'ok')]['model'], 'mistralai/Mistral-7B-Instruct-v0.3')
+
+    def test_failed_and_empty_calls_counted_separately(self):
+        with self.assertRaises(Exception):
+            self.service._call_model(None, 'fail', '', model=MODEL)
+        self.service._call_model(None, 'empty', '', model=MODEL)
+        usage = self.usage()
+        self.assertEqual(usage[('other', 'error')]['calls'], 1)
+        self.assertEqual(usage[('other', 'empty')]['calls'], 1)
+
+    def test_prometheus_histograms_are_cumulative(self):
+        for prompt in ('a', 'b', 'c'):
+            self.service._call_model(None, prompt, '', model=MODEL)
+        text = self.telemetry.render_prometheus()
+        labels = f'model="{MODEL}",feature="other"'
+        self.assertIn(f'penora_llm_latency_seconds_bucket{{{labels},le="+Inf"}} 3', text)
+        self.assertIn(f'penora_llm_ttfb_seconds_bucket{{{labels},le="{LATENCY_BUCKETS[0]}"}} 3', text)
+        self.assertIn(f'penora_llm_latency_seconds_count{{{labels}}} 3', text)
+        self.assertIn(f'penora_llm_completion_tokens_total{{{labels},outcome="ok"}} 120', text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import time
+from unittest import mock
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from ai_service import AIService, generate_text_simple
+from llm_resilience import CircuitBreakerRegistry
+from model_router import ModelRouter, billed_credits
+
+MULTIPLIERS = {'creative': 1.5, 'balanced': 1.0, 'fast': 0.5}
+
+
+class ModelClient:
+    """Fails every call to the listed model names; otherwise replies with the model name"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.models = []
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        self.models.append(model)
+        if model in self.failing:
+            raise Exception(f"{model} unavailable")
+        return f"Reply from {model}"
+
+
+class TestModelRouter(unittest.TestCase):
+    def test_slow_model_falls_back_along_chain(self):
+        router = ModelRouter(slo=10)
+        self.assertEqual(router.candidates('smart'), ['smart', 'balanced'])
+        for _ in range(3):
+            router.record('smart', 30.0, tokens=600)
+        self.assertEqual(router.candidates('smart'), ['balanced', 'smart'])
+        # A looser per-request SLO tolerates the slow model
+        self.assertEqual(router.choose('smart', slo=60), 'smart')
+
+    def test_erroring_model_passed_over_then_probed_again(self):
+        router = ModelRouter(probe_after=0.1)
+        for _ in range(3):
+            router.record('creative', 1.0, error=True)
+        self.assertEqual(router.choose('creative'), 'balanced')
+        self.assertEqual(router.stats()['creative']['error_rate'], 1.0)
+        time.sleep(0.15)
+        self.assertEqual(router.choose('creative'), 'creative')
+
+    def test_open_breaker_skips_model(self):
+        breakers = CircuitBreakerRegistry(failure_threshold=1)
+        breakers.get('mistralai/Mixtral-8x7B-Instruct-v0.1').record_failure()
+        self.assertEqual(ModelRouter().choose('creative', breakers=breakers), 'balanced')
+
+    def test_fallback_on_the_same_model_skipped(self):
+        models = {
+            'balanced': {'name': 'mistral-7b', 'fallback': 'fast'},
+            'fast': {'name': 'mistral-7b', 'fallback': None}
+        }
+        self.assertEqual(ModelRouter(models=models).candidates('balanced'), ['balanced'])
+        self.assertEqual(ModelRouter().candidates('balanced'), ['balanced'])
+
+    def test_billing_follows_models_used(self):
+        self.assertEqual(billed_credits(15, 'creative', {'creative': 10}, MULTIPLIERS), 15)
+        self.assertEqual(billed_credits(15, 'creative', {'creative': 5, 'balanced': 5}, MULTIPLIERS), 12)
+        self.assertEqual(billed_credits(15, 'creative', {}, MULTIPLIERS), 15)
+        # Never above the quote
+        self.assertEqual(billed_credits(5, 'fast', {'creative': 10}, MULTIPLIERS), 5)
+
+
+class TestRoutedService(unittest.TestCase):
+    def test_failed_call_served_by_fallback_and_recorded(self):
+        client = ModelClient(failing={'mistralai/Mixtral-8x7B-Instruct-v0.1'})
+        router = ModelRouter()
+        service = AIService(client=client, router=router)
+        result = service.generate_text("A lighthouse", 'creative')
+        self.assertTrue(result['success'])
+        self.assertEqual(result['model_used'], 'Mistral 7B (Balanced)')
+        self.assertEqual(result['models_used'], {'balanced': 1})
+        self.assertEqual(router.stats()['creative']['error_rate'], 1.0)
+        self.assertEqual(router.stats()['balanced']['error_rate'], 0.0)
+
+    def test_multi_page_usage_reported_per_page(self):
+        client = ModelClient(failing={'mistralai/Mixtral-8x7B-Instruct-v0.1'})
+        with mock.patch('ai_service.ai_service', AIService(client=client, router=ModelRouter())):
+            result = generate_text_simple("A lighthouse", 'creative', pages=4)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['models_used'], {'balanced': 4})
+        self.assertEqual(result['model_used'], 'balanced')
+
+
+if __name__ == '__main__':
+    unittest.main()
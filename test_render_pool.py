@@ -0,0 +1,80 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+import threading
+from io import BytesIO
+
+sys.path.append(os.getcwd())
+
+from export_cache import ExportArtifactCache
+from render_pool import RenderPool, RenderTimeout
+
+STORY = "Page 1\n\nThe caravan set out at dusk.\n\nPage 2\n\nBy dawn the map had changed."
+
+
+def _slow_len(text):
+    """A render still running when another one in the pool times out"""
+    time.sleep(3)
+    return len(text)
+
+
+class TestRenderPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = RenderPool(workers=1, timeout=30, max_memory_mb=1024)
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmpdir.cleanup()
+
+    def test_renders_into_buffer_and_cache_file(self):
+        buffer = BytesIO()
+        self.pool.render('pdf', "The Shifting Map", STORY, buffer)
+        self.assertTrue(buffer.getvalue().startswith(b'%PDF'))
+
+        cache = ExportArtifactCache(cache_dir=self.tmpdir.name)
+        key = cache.make_key('project', "The Shifting Map", STORY, 'docx')
+        with cache.write(key, lambda output: self.pool.render('docx', "The Shifting Map", STORY, output)) as artifact:
+            # A .docx is a zip archive
+            self.assertTrue(artifact.read().startswith(b'PK'))
+
+    def test_hung_render_times_out_and_pool_recovers(self):
+        start = time.monotonic()
+        with self.assertRaises(RenderTimeout):
+            self.pool.run(time.sleep, 30, timeout=1)
+        self.assertLess(time.monotonic() - start, 10)
+        buffer = BytesIO()
+        self.pool.render('pdf', "Afterwards", STORY, buffer)
+        self.assertTrue(buffer.getvalue().startswith(b'%PDF'))
+
+    def test_hung_render_does_not_kill_other_renders(self):
+        pool = RenderPool(workers=2, timeout=30, max_memory_mb=1024)
+        try:
+            # Warm both processes up so spawning doesn't eat into the timeouts below
+            pool.run(len, "warm")
+            results = []
+            thread = threading.Thread(target=lambda: results.append(pool.run(_slow_len, "survivor", timeout=20)))
+            thread.start()
+            time.sleep(0.5)
+            with self.assertRaises(RenderTimeout):
+                pool.run(time.sleep, 30, timeout=1)
+            thread.join()
+            self.assertEqual(results, [8])
+        finally:
+            pool.close()
+
+    def test_memory_cap_fails_the_job_only(self):
+        with self.assertRaises(MemoryError):
+            self.pool.run(bytearray, 4 * 1024 * 1024 * 1024)
+        self.assertEqual(self.pool.run(len, "still here"), 10)
+
+    def test_no_workers_renders_in_thread(self):
+        buffer = BytesIO()
+        RenderPool(workers=0).render('pdf', "Inline", STORY, buffer)
+        self.assertTrue(buffer.getvalue().startswith(b'%PDF'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+import request_deadline
+from request_deadline import DeadlineExceeded
+from ai_service import AIService
+from llm_cache import LLMResponseCache
+from llm_scheduler import LLMScheduler
+from test_ai_service import FakeClient
+
+MODEL = 'mistralai/Mistral-7B-Instruct-v0.3'
+
+
+class OutOfTimeClient(FakeClient):
+    """Pages from `cut_from` on fail the way the clients do once the deadline has passed"""
+
+    def __init__(self, cut_from):
+        super().__init__()
+        self.cut_from = cut_from
+        self.declined = []
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        page = int(prompt.split('Write page ')[1].split(' ')[0]) if 'Write page ' in prompt else 0
+        if page >= self.cut_from:
+            with self.lock:
+                self.declined.append((page, model))
+            raise DeadlineExceeded("The request's time budget is spent")
+        return super().chat(prompt, system_msg, max_tokens, model, **kwargs)
+
+
+class TestDeadline(unittest.TestCase):
+    def test_no_deadline_outside_a_request(self):
+        self.assertIsNone(request_deadline.remaining())
+        self.assertEqual(request_deadline.cap(120), 120)
+        request_deadline.check(1000)
+
+    def test_cap_and_check_within_deadline(self):
+        with request_deadline.deadline(10):
+            self.assertLessEqual(request_deadline.cap(120), 10)
+            self.assertEqual(request_deadline.cap(3), 3)
+            request_deadline.check(5)
+            with self.assertRaises(DeadlineExceeded):
+                request_deadline.check(30)
+        self.assertIsNone(request_deadline.remaining())
+
+    def test_nested_deadline_only_shortens(self):
+        with request_deadline.deadline(5):
+            with request_deadline.deadline(60):
+                self.assertLessEqual(request_deadline.remaining(), 5)
+            with request_deadline.deadline(0):
+                with self.assertRaises(DeadlineExceeded):
+                    request_deadline.cap(120)
+
+    def test_budget_leaves_margin_before_worker_timeout(self):
+        os.environ['GUNICORN_TIMEOUT'] = '120'
+        try:
+            self.assertEqual(request_deadline.request_budget(), 90)
+        finally:
+            del os.environ['GUNICORN_TIMEOUT']
+
+
+class TestDeadlineDownstream(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache = LLMResponseCache(os.path.join(self.tmpdir.name, 'llm_cache.db'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_story_cut_short_keeps_leading_pages(self):
+        client = OutOfTimeClient(cut_from=3)
+        service = AIService(client=client, cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 4, 'balanced')
+        self.assertTrue(story['success'])
+        self.assertTrue(story['partial'])
+        self.assertEqual(story['pages_delivered'], 2)
+        self.assertEqual(story['content'], service.format_pages(["Content for page 1", "Content for page 2"]))
+        # Out of time is passed down the fallback chain once, not retried
+        self.assertEqual({page for page, _ in client.declined}, {3, 4})
+        self.assertLessEqual(len(client.declined), 2 * len(service.models))
+
+    def test_long_story_cut_short_keeps_leading_pages(self):
+        # Every chapter's third page is declined, so only the first two pages arrive unbroken
+        service = AIService(client=OutOfTimeClient(cut_from=3), cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 60, 'balanced')
+        self.assertTrue(story['success'])
+        self.assertTrue(story['partial'])
+        self.assertEqual(story['pages_delivered'], 2)
+        self.assertEqual(story['pages_billable'], 2)
+        self.assertTrue(story['content'].startswith("=== PAGE 1 ===\n\nChapter 1: "))
+
+    def test_no_pages_in_time_fails_story(self):
+        service = AIService(client=OutOfTimeClient(cut_from=1), cache=self.cache)
+        story = service.generate_titled_story("A heist on the moon", 2, 'balanced')
+        self.assertFalse(story['success'])
+        self.assertIn("Ran out of time", story['error'])
+
+    def test_call_declined_when_too_little_time_left(self):
+        client = FakeClient()
+        service = AIService(client=client, cache=self.cache)
+        with request_deadline.deadline(1):
+            story = service.generate_titled_story("A heist on the moon", 2, 'balanced')
+        self.assertFalse(story['success'])
+        self.assertEqual(client.calls, 0)
+
+    def test_scheduler_stops_waiting_at_deadline(self):
+        scheduler = LLMScheduler(os.path.join(self.tmpdir.name, 'llm_scheduler.db'), max_in_flight=1, poll_interval=0.01)
+        held = scheduler.acquire(MODEL)
+        try:
+            start = time.monotonic()
+            with request_deadline.deadline(0.2):
+                with self.assertRaises(DeadlineExceeded):
+                    scheduler.acquire(MODEL, user_id='someone-else')
+            self.assertLess(time.monotonic() - start, 2)
+        finally:
+            scheduler.release(held)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,258 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+import re
+import json
+from unittest import mock
+
+sys.path.append(os.getcwd())
+
+from single_flight import SingleFlight, SingleFlightTimeout
+
+
+class TestSingleFlight(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmpdir.name, 'single_flight.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def flight(self, **kwargs):
+        kwargs.setdefault('poll_interval', 0.02)
+        return SingleFlight(self.db_path, **kwargs)
+
+    def test_parallel_identical_requests_run_and_charge_once(self):
+        requests = 12
+        calls = []
+        balance = [100]
+        lock = threading.Lock()
+        start = threading.Barrier(requests)
+        outcomes = []
+
+        def generate_and_charge():
+            with lock:
+                calls.append(1)
+            time.sleep(0.3)  # the DeepInfra call
+            with lock:
+                balance[0] -= 5
+                return {'content': 'Once upon a time', 'balance': balance[0]}
+
+        def request():
+            # One SingleFlight per thread, as each gunicorn worker process has its own
+            flight = self.flight()
+            key = flight.make_key('user-1', 'start_writing', ['A lighthouse story', 3, 'creative'])
+            start.wait()
+            outcome = flight.run(key, generate_and_charge)
+            with lock:
+                outcomes.append(outcome)
+
+        threads = [threading.Thread(target=request) for _ in range(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(balance[0], 95)
+        self.assertEqual(sorted(leader for _, leader in outcomes), [False] * (requests - 1) + [True])
+        self.assertTrue(all(result == {'content': 'Once upon a time', 'balance': 95} for result, _ in outcomes))
+
+    def test_keys_separate_users_and_parameters(self):
+        flight = self.flight()
+        self.assertNotEqual(flight.make_key('user-1', 'write', ['a']), flight.make_key('user-2', 'write', ['a']))
+        self.assertNotEqual(flight.make_key('user-1', 'write', ['a']), flight.make_key('user-1', 'write', ['b']))
+        self.assertEqual(flight.run('k1', lambda: {'n': 1}), ({'n': 1}, True))
+        self.assertEqual(flight.run('k2', lambda: {'n': 2}), ({'n': 2}, True))
+
+    def test_resubmit_replayed_until_keep_window_passes(self):
+        flight = self.flight(keep_seconds=1)
+        self.assertEqual(flight.run('k', lambda: {'n': 1}), ({'n': 1}, True))
+        self.assertEqual(flight.run('k', lambda: {'n': 2}), ({'n': 1}, False))
+        time.sleep(1.1)
+        self.assertEqual(flight.run('k', lambda: {'n': 3}), ({'n': 3}, True))
+
+    def test_rejected_outcome_not_replayed(self):
+        flight = self.flight()
+        succeeded = lambda outcome: outcome['success']
+        self.assertEqual(flight.run('k', lambda: {'success': False}, replay=succeeded), ({'success': False}, True))
+        # A resubmit right after a failure runs again instead of getting the failure back
+        self.assertEqual(flight.run('k', lambda: {'success': True}, replay=succeeded), ({'success': True}, True))
+        self.assertEqual(flight.run('k', lambda: {'success': False}, replay=succeeded), ({'success': True}, False))
+
+    def test_failed_leader_releases_key_to_waiting_duplicate(self):
+        flight = self.flight()
+        started = threading.Event()
+        results = []
+
+        def failing():
+            started.set()
+            time.sleep(0.2)
+            raise Exception("DeepInfra unavailable")
+
+        def leader():
+            with self.assertRaises(Exception):
+                flight.run('k', failing)
+
+        thread = threading.Thread(target=leader)
+        thread.start()
+        started.wait()
+        results.append(self.flight().run('k', lambda: {'n': 2}))
+        thread.join()
+        self.assertEqual(results, [({'n': 2}, True)])
+
+    def test_duplicate_gives_up_after_wait_timeout(self):
+        flight = self.flight()
+        started = threading.Event()
+        thread = threading.Thread(target=lambda: flight.run('k', lambda: started.set() or time.sleep(0.5) or {}))
+        thread.start()
+        started.wait()
+        with self.assertRaises(SingleFlightTimeout):
+            self.flight().run('k', lambda: {}, wait_timeout=0.1)
+        thread.join()
+
+
+    def test_streamed_work_yields_to_leader_only(self):
+        calls = []
+        outcomes = []
+        start = threading.Barrier(4)
+
+        def work():
+            calls.append(1)
+            yield 'Once '
+            time.sleep(0.3)
+            yield 'upon a time'
+            return {'content': 'Once upon a time'}
+
+        def consume():
+            items = []
+            stream = self.flight().stream('k', work)
+            start.wait()
+            while True:
+                try:
+                    items.append(next(stream))
+                except StopIteration as done:
+                    outcomes.append((items, done.value))
+                    return
+
+        threads = [threading.Thread(target=consume) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(outcomes, key=lambda o: len(o[0])), [
+            ([], ({'content': 'Once upon a time'}, False))] * 3 + [
+            (['Once ', 'upon a time'], ({'content': 'Once upon a time'}, True))])
+
+    def test_closed_stream_releases_key(self):
+        def work():
+            yield 'Once '
+            yield 'upon a time'
+            return {'n': 1}
+
+        flight = self.flight()
+        stream = flight.stream('k', work)
+        next(stream)
+        stream.close()  # the browser went away mid-generation
+        self.assertEqual(flight.run('k', lambda: {'n': 2}), ({'n': 2}, True))
+
+    def test_claim_once(self):
+        flight = self.flight()
+        self.assertTrue(flight.claim_once('token', 1))
+        self.assertFalse(flight.claim_once('token', 1))
+        time.sleep(1.1)
+        self.assertTrue(flight.claim_once('token', 1))
+
+
+class TestStartWritingStream(unittest.TestCase):
+    """Parallel identical /start-writing/live submissions and their SSE streams generate and charge once"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        if 'app' not in sys.modules:
+            os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(self.tmpdir.name, 'app.db')
+            os.environ.setdefault('SESSION_SECRET', 'test')
+        from app import app
+        import routes
+        import single_flight
+        self.app = app
+        self.calls = []
+        self.charges = []
+        lock = threading.Lock()
+
+        def stream_text(prompt, model_type='balanced', length='medium'):
+            with lock:
+                self.calls.append(prompt)
+            yield 'Once '
+            time.sleep(0.3)  # the DeepInfra call
+            yield 'upon a time'
+
+        def deduct(user_data, amount, description="Credit usage"):
+            with lock:
+                self.charges.append(amount)
+            user_data['credits'] -= amount
+            return True
+
+        flight = single_flight.SingleFlight(os.path.join(self.tmpdir.name, 'single_flight.db'), poll_interval=0.02)
+        for patcher in (
+            mock.patch.object(single_flight, 'single_flight', flight),
+            mock.patch.object(routes, 'get_user_data',
+                              lambda: {'user_id': 'user-1', 'username': 'Writer', 'email': 'w@example.com', 'credits': 100}),
+            mock.patch.object(routes.ai_service, 'stream_text', stream_text),
+            mock.patch.object(routes, 'deduct_user_credits_safe', deduct),
+            mock.patch.object(routes, 'save_generation_to_workspace', lambda user_data, title, content: 'ABC123'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def stream_url(self, client):
+        with client.session_transaction() as sess:
+            sess['stream_csrf'] = 'csrf'
+        response = client.post('/start-writing/live', data={
+            'stream_csrf': 'csrf', 'prompt': 'A lighthouse story', 'page_count': 1, 'model_type': 'fast'})
+        self.assertEqual(response.status_code, 200)
+        return re.search(r'id="streamUrl">([^<]+)<', response.get_data(as_text=True)).group(1).replace('&amp;', '&')
+
+    def test_parallel_identical_streams_generate_and_charge_once(self):
+        requests = 6
+        start = threading.Barrier(requests)
+        bodies = []
+        lock = threading.Lock()
+
+        def request():
+            client = self.app.test_client()
+            url = self.stream_url(client)
+            start.wait()
+            body = client.get(url).get_data(as_text=True)
+            with lock:
+                bodies.append((client, url, body))
+
+        threads = [threading.Thread(target=request) for _ in range(requests)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(len(self.charges), 1)
+        for _, _, body in bodies:
+            self.assertIn('event: done', body)
+            tokens = re.findall(r'event: token\ndata: (.*)\n', body)
+            self.assertEqual(''.join(json.loads(token)['text'] for token in tokens), 'Once upon a time')
+
+        # Reopening a used stream link neither generates nor charges again
+        client, url, _ = bodies[0]
+        body = client.get(url).get_data(as_text=True)
+        self.assertIn('already used', body)
+        self.assertEqual((len(self.calls), len(self.charges)), (1, 1))
+
+if __name__ == '__main__':
+    unittest.main()
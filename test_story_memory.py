@@ -0,0 +1,64 @@
+import unittest
+import sys
+import os
+import json
+
+sys.path.append(os.getcwd())
+os.environ.setdefault('DEEPINFRA_API_KEY', 'test-key')
+
+from ai_service import AIService
+from story_memory import StoryMemory, SUMMARY_WORDS, MAX_FACTS, FACT_WORDS
+
+CHAPTER = "The tide rose over the causeway while Mara argued with her brother about the lamp. " * 40
+
+
+class ChapterClient:
+    """Writes fixed chapters and answers memory updates with an ever-growing (oversized) JSON"""
+
+    def __init__(self):
+        self.chapter_prompt_words = []
+        self.updates = 0
+
+    def chat(self, prompt, system_msg="", max_tokens=2500, model="", **kwargs):
+        if 'Reply with JSON only' in prompt:
+            self.updates += 1
+            return json.dumps({
+                'summary': 'Events happened. ' * (100 * self.updates),
+                'facts': [f"Fact {i}: " + 'detail ' * 40 for i in range(10 * self.updates)]
+            })
+        self.chapter_prompt_words.append(len(prompt.split()))
+        return CHAPTER
+
+
+class TestStoryMemory(unittest.TestCase):
+    def test_caps_enforced_whatever_the_model_returns(self):
+        memory = StoryMemory("A keeper and her brother")
+        reply = json.dumps({'summary': 'word ' * 1000, 'facts': ['x ' * 100] * 100})
+        memory.apply_update(reply, 1, CHAPTER)
+        self.assertEqual(len(memory.summary.split()), SUMMARY_WORDS)
+        self.assertEqual(len(memory.facts), MAX_FACTS)
+        self.assertTrue(all(len(fact.split()) <= FACT_WORDS for fact in memory.facts))
+
+    def test_invalid_reply_falls_back_to_local_summary(self):
+        memory = StoryMemory("A keeper and her brother", facts=['Mara keeps the lighthouse'])
+        memory.apply_update("Sorry, I can't do that.", 1, CHAPTER)
+        self.assertIn("Chapter 1:", memory.summary)
+        self.assertEqual(memory.facts, ['Mara keeps the lighthouse'])
+        self.assertEqual(StoryMemory.from_dict(memory.to_dict()).to_dict(), memory.to_dict())
+
+    def test_chapter_prompts_stay_constant_size(self):
+        client = ChapterClient()
+        service = AIService(client=client)
+        memory = StoryMemory("A keeper and her brother")
+        for chapter in range(1, 31):
+            result = service.generate_story_chapter(None, chapter, 30, memory=memory)
+            self.assertTrue(result['success'])
+        self.assertEqual(client.updates, 30)
+        self.assertEqual(result['memory']['chapters_written'], 30)
+        # Bounded by the caps, not by the number of chapters written
+        self.assertLess(max(client.chapter_prompt_words), 2 * client.chapter_prompt_words[1] + 400)
+        self.assertEqual(client.chapter_prompt_words[10], client.chapter_prompt_words[29])
+
+
+if __name__ == '__main__':
+    unittest.main()
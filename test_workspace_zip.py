@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+import zipfile
+from io import BytesIO
+
+sys.path.append(os.getcwd())
+
+from workspace_zip import stream_workspace_zip, member_name, CHUNK_SIZE
+
+PROJECTS = [
+    {'code': 'ABC123', 'title': 'The Shifting Map', 'content': 'Page 1\n\nThe caravan set out at dusk.'},
+    {'code': 'XYZ789', 'title': 'Salt & Stars', 'content': 'Page 1\n\nNobody trusted the compass.'}
+]
+
+
+class FakeRender:
+    """render_export lookalike: a file of `size` bytes per member, docx of XYZ789 fails"""
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.calls = []
+
+    def __call__(self, owner, title, content, format):
+        self.calls.append((owner, format))
+        if (owner, format) == ('XYZ789', 'docx'):
+            return {'success': False, 'error': 'Failed to create DOCX: renderer crashed'}
+        unit = f"{owner}:{format}:".encode()
+        return {'success': True, 'file': BytesIO((unit * (self.size // len(unit) + 1))[:self.size])}
+
+
+class TestWorkspaceZip(unittest.TestCase):
+    def test_archive_holds_every_project_in_every_format(self):
+        render = FakeRender()
+        archive = zipfile.ZipFile(BytesIO(b''.join(stream_workspace_zip(PROJECTS, ['pdf', 'docx'], render))))
+        self.assertIsNone(archive.testzip())
+        names = archive.namelist()
+        self.assertEqual(names, [
+            member_name('ABC123', 'The Shifting Map', 'pdf'),
+            member_name('ABC123', 'The Shifting Map', 'docx'),
+            member_name('XYZ789', 'Salt & Stars', 'pdf'),
+            'ERRORS.txt'
+        ])
+        self.assertTrue(archive.read(names[0]).startswith(b'ABC123:pdf:'))
+        self.assertIn(b'renderer crashed', archive.read('ERRORS.txt'))
+
+    def test_content_loaded_as_the_archive_reaches_each_project(self):
+        contents = {project['code']: project['content'] for project in PROJECTS}
+        loaded = []
+
+        def load_content(code):
+            loaded.append(code)
+            return contents.get(code)
+
+        members = [{'code': p['code'], 'title': p['title']} for p in PROJECTS] + [{'code': 'GONE00', 'title': 'Deleted'}]
+        render = FakeRender()
+        stream = stream_workspace_zip(members, ['txt'], render, load_content)
+        first = next(stream)
+        self.assertEqual(loaded, ['ABC123'])
+        archive = zipfile.ZipFile(BytesIO(first + b''.join(stream)))
+        self.assertEqual(loaded, ['ABC123', 'XYZ789', 'GONE00'])
+        self.assertEqual(len(archive.namelist()), 3)
+        self.assertIn(b'GONE00: The project no longer exists', archive.read('ERRORS.txt'))
+
+    def test_members_are_streamed_in_bounded_chunks(self):
+        render = FakeRender(size=20 * CHUNK_SIZE)
+        stream = stream_workspace_zip(PROJECTS[:1], ['pdf', 'txt'], render)
+        first = next(stream)
+        # Nothing past the first member has been rendered when the first bytes go out
+        self.assertEqual(render.calls, [('ABC123', 'pdf')])
+        chunks = [first] + list(stream)
+        self.assertLess(max(len(chunk) for chunk in chunks), 2 * CHUNK_SIZE)
+        archive = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+        self.assertEqual(len(archive.read(member_name('ABC123', 'The Shifting Map', 'txt'))), 20 * CHUNK_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -50,6 +50,7 @@ class WorkspaceService:
             db.session.commit()
             
             logging.info(f"Saved generation '{title}' for user {user_id}, code: {project.code}")
+            WorkspaceService.prerender_exports(project)
             return True, project, f"Project saved successfully! Code: {project.code}"
             
         except Exception as e:
@@ -57,6 +58,13 @@ class WorkspaceService:
             logger.error(f"Error saving generation: {e}")
             return False, None, "Error saving project. Please try again."
     
+    @staticmethod
+    def prerender_exports(project):
+        """Queue the project's downloads to be rendered in the background, when pre-rendering is on"""
+        from export_prerender import export_prerenderer
+        # Same title and content the download routes render
+        export_prerenderer.schedule(project.code, project.project_title, project.generation_text or " ")
+    
     @staticmethod
     def get_user_projects(user_id):
         """Get all active workspace projects for a user"""
@@ -83,6 +91,36 @@ class WorkspaceService:
             logger.error(f"Error fetching user projects: {e}")
             return []
     
+    @staticmethod
+    def get_user_project_titles(user_id, codes=None):
+        """(code, title) of a user's active projects, newest first, without loading their content"""
+        try:
+            query = db.session.query(WorkspaceProject.code, WorkspaceProject.project_title).filter_by(
+                user_id=str(user_id),
+                is_deleted=False
+            )
+            if codes:
+                query = query.filter(WorkspaceProject.code.in_(codes))
+            return query.order_by(WorkspaceProject.updated_at.desc()).all()
+            
+        except Exception as e:
+            logger.error(f"Error fetching user project titles: {e}")
+            return []
+    
+    @staticmethod
+    def get_project_text(user_id, code):
+        """The content of one of a user's projects, or None if it doesn't exist (security: user must own it)"""
+        try:
+            return db.session.query(WorkspaceProject.generation_text).filter_by(
+                user_id=str(user_id),
+                code=code,
+                is_deleted=False
+            ).scalar()
+            
+        except Exception as e:
+            logger.error(f"Error fetching project text: {e}")
+            return None
+    
     @staticmethod
     def get_project_by_code(user_id, code):
         """Get a specific project by code (security: user must own it)"""
@@ -133,6 +171,7 @@ class WorkspaceService:
             db.session.commit()
             
             logger.info(f"Updated project {code} for user {user_id}")
+            WorkspaceService.prerender_exports(project)
             return True, project, "Project updated successfully!"
             
         except Exception as e:
@@ -0,0 +1,96 @@
+"""
+Workspace ZIP Export for Penora
+Streams a ZIP of many workspace projects, in several formats, while it is being built
+
+Instead of one download request per project and format, /workspace/download-all
+sends a single ZIP. Each member is rendered (or read from the export cache)
+only when the archive reaches it, then copied into the archive in chunks
+that are sent to the client as they are written, so memory stays flat
+however many projects the workspace holds. The archive is written for an
+unseekable stream (sizes go in data descriptors after each member), which
+every unzip tool reads. A project's content is loaded only when the
+archive reaches it too, so a workspace of long stories is never held in
+memory at once. A member that fails to render, or a project deleted while
+the archive is being sent, is listed in ERRORS.txt instead of failing the
+whole download.
+"""
+
+import re
+import time
+import zipfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+FORMATS = ('pdf', 'docx', 'txt')
+
+# Bytes copied from a rendered file per write (and so per chunk sent)
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink:
+    """Write-only file object (no tell or seek) collecting what ZipFile writes until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def member_name(code: str, title: str, format: str) -> str:
+    """Archive name of a project's download, as the single download names it"""
+    safe_title = re.sub(r'[^a-zA-Z0-9_\-]', '_', title[:20])
+    return f'{code}_{safe_title}.{format}'
+
+
+def stream_workspace_zip(projects: Iterable[Dict[str, str]], formats: List[str],
+                         render: Callable[[str, str, str, str], Dict[str, Any]],
+                         load_content: Optional[Callable[[str], Optional[str]]] = None) -> Iterator[bytes]:
+    """
+    Chunks of a ZIP holding every project ({'code', 'title'} and its
+    'content', or load_content(code) returning it, or None once the project
+    is gone) in every format. render(owner, title, content, format) returns
+    {'success', 'file', 'error'} like routes.render_export.
+    """
+    sink = _ChunkSink()
+    errors = []
+    with zipfile.ZipFile(sink, 'w') as archive:
+        for project in projects:
+            content = project['content'] if 'content' in project else load_content(project['code'])
+            if content is None:
+                errors.append(f"{project['code']}: The project no longer exists")
+                continue
+            for format in formats:
+                name = member_name(project['code'], project['title'], format)
+                result = render(project['code'], project['title'], content, format)
+                if not result.get('success'):
+                    errors.append(f"{name}: {result.get('error', 'Unknown error')}")
+                    continue
+
+                info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+                # PDF and DOCX are compressed already
+                info.compress_type = zipfile.ZIP_DEFLATED if format == 'txt' else zipfile.ZIP_STORED
+                with result['file'] as artifact, archive.open(info, 'w') as member:
+                    while True:
+                        chunk = artifact.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        member.write(chunk)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+
+        if errors:
+            archive.writestr('ERRORS.txt', "These files could not be created:\n" + '\n'.join(errors) + '\n')
+    yield sink.drain()